@@ -1,13 +1,22 @@
-from .io import read, EventGenerator, EventHeaderGenerator
-from .plotting import DragonBrowser
+'''
+The core of this package, the readers, utils and RunningStats,
+only needs numpy.
+The DragonBrowser (PyQt5, matplotlib) and the calibrations (pandas)
+are imported on first access of the respective attribute, so batch jobs
+not using them do not pay for their import.
+'''
+from importlib import import_module
+
+from .io import read, read_array, read_headers, scan, EventGenerator, EventHeaderGenerator, Event
 from .runningstats import RunningStats
 from .utils import cell2sample, sample2cell, cell_in_samples
-
-import pkg_resources
-__version__ = pkg_resources.require('dragonboard')[0].version
+from .utils import sample2cell_table, stop_cells2cells
 
 __all__ = [
     'read',
+    'read_array',
+    'read_headers',
+    'scan',
     'EventGenerator',
     'EventHeaderGenerator',
     'Event',
@@ -16,4 +25,34 @@ __all__ = [
     'cell2sample',
     'sample2cell',
     'cell_in_samples',
+    'sample2cell_table',
+    'stop_cells2cells',
 ]
+
+_lazy_attributes = {
+    'DragonBrowser': ('.plotting', 'DragonBrowser'),
+    'CalibrationPipeline': ('.calibration', 'CalibrationPipeline'),
+    'calibration': ('.calibration', None),
+    'plotting': ('.plotting', None),
+}
+
+
+def __getattr__(name):
+    if name == '__version__':
+        from importlib.metadata import version
+        return version('dragonboard')
+
+    if name not in _lazy_attributes:
+        raise AttributeError(
+            'module {!r} has no attribute {!r}'.format(__name__, name)
+        )
+
+    module_name, attribute = _lazy_attributes[name]
+    module = import_module(module_name, __name__)
+    value = module if attribute is None else getattr(module, attribute)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attributes) | {'__version__'})
@@ -5,6 +5,7 @@ Usage:
 Options:
     -c <calibfile>   File containing the calibration constants
     -e <extrafile>   File containing the extra offset constants
+    -p <pipeline>    Calibration pipeline config file, overrides -c and -e
     --start=<N>      First event to show
 '''
 import matplotlib
@@ -39,6 +40,7 @@ def main():
         args['-c'],
         args['-e'],
         int(args['--start']) if args['--start'] else None,
+        pipeline_file=args['-p'],
     )
     widget.show()
 
@@ -0,0 +1,3 @@
+'''
+Analyses working on blocks of many events at once
+'''
@@ -0,0 +1,130 @@
+'''
+Compare calibration methods by the mean, standard deviation, minimum
+and maximum of the calibrated time series of every event, pixel and gain.
+'''
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+from ..io import EventGenerator, gaintypes
+from ..calibration import CalibrationPipeline
+
+statistics = ('mean', 'std', 'min', 'max')
+
+
+def _name(calib):
+    if isinstance(calib, CalibrationPipeline):
+        return '+'.join(stage.__class__.__name__ for stage in calib.stages)
+    return calib.__class__.__name__
+
+
+def _as_pipeline(calib):
+    if isinstance(calib, CalibrationPipeline):
+        return calib
+    return CalibrationPipeline([calib])
+
+
+def _evaluate_range(path, calibs, first_event, num_events, samples, block_size):
+    ''' evaluate events first_event to first_event + num_events of path
+
+    returns the event counters and an array of shape
+    (len(calibs), len(statistics), num_events, pixel, gain)
+    '''
+    generator = EventGenerator(path, max_events=first_event + num_events)
+    generator.skip_events(first_event)
+
+    pipelines = [_as_pipeline(calib) for calib in calibs]
+    event_counters = np.empty(num_events, dtype='u4')
+    result = None
+
+    position = 0
+    for block in generator.iter_blocks(block_size):
+        n = len(block.data)
+        if result is None:
+            shape = (len(calibs), len(statistics), num_events) + block.data.shape[1:3]
+            result = np.empty(shape, dtype='f4')
+
+        event_counters[position:position + n] = block.headers['event_counter']
+        for i, pipeline in enumerate(pipelines):
+            calibrated = pipeline.calibrate_block(block)[..., samples]
+            out = result[i, :, position:position + n]
+            np.mean(calibrated, axis=-1, out=out[0])
+            np.std(calibrated, axis=-1, out=out[1])
+            np.min(calibrated, axis=-1, out=out[2])
+            np.max(calibrated, axis=-1, out=out[3])
+
+        position += n
+
+    return event_counters, result
+
+
+def evaluate_calibrations(
+        path,
+        calibs,
+        max_events=None,
+        skip=0,
+        start=None,
+        end=None,
+        block_size=100,
+        n_jobs=1,
+        pixels=range(7),
+        verbose=0,
+        ):
+    '''
+    Calibrate the events of path with all calibs and return a DataFrame
+    indexed by (event, pixel, channel) with the columns
+    <calibration class name>_<mean|std|min|max>,
+    for pipelines the class names of the stages are joined with '+'.
+
+    Args:
+        path (str): dragonboard .dat file
+        calibs (list): calibrations or CalibrationPipelines
+
+    Kwargs:
+        max_events (int): number of events to read from the start of the file,
+            including the skipped events, default all
+        skip (int): number of events to skip at the start of the file
+        start, end (int): slice of the samples to use
+        block_size (int): number of events calibrated at once
+        n_jobs (int): number of worker processes, each reading its own range of events
+        pixels (iterable): pixels to put into the DataFrame
+        verbose (int): verbosity of joblib
+
+    raises a ValueError if no events are left after skipping
+    '''
+    # like reading max_events events and dropping the first skip of them
+    num_events = EventGenerator(path, max_events=max_events).max_events - skip
+    if num_events <= 0:
+        raise ValueError('No events of {} selected with max_events={} and skip={}'.format(
+            path, max_events, skip
+        ))
+
+    bounds = np.linspace(skip, skip + num_events, n_jobs + 1).astype(int)
+    ranges = [
+        (first, last - first) for first, last in zip(bounds[:-1], bounds[1:])
+        if last > first
+    ]
+
+    with Parallel(n_jobs, verbose=verbose) as pool:
+        results = pool(
+            delayed(_evaluate_range)(
+                path, calibs, first, n, slice(start, end), block_size
+            )
+            for first, n in ranges
+        )
+
+    event_counters = np.concatenate([counters for counters, _ in results])
+    result = np.concatenate([r for _, r in results], axis=2)
+
+    pixels = list(pixels)
+    index = pd.MultiIndex.from_product(
+        [event_counters, pixels, gaintypes],
+        names=['event', 'pixel', 'channel'],
+    )
+    data = {}
+    for i, calib in enumerate(calibs):
+        name = _name(calib)
+        for j, statistic in enumerate(statistics):
+            data[name + '_' + statistic] = result[i, j][:, pixels].ravel()
+
+    return pd.DataFrame(data, index=index)
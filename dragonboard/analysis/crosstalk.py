@@ -0,0 +1,152 @@
+'''
+Crosstalk matrices from pulse injection runs.
+
+In each run a pulse is injected into one pixel.
+For every event the pulse position is taken as the maximum of that pixel
+in a search window, and all pixels are cut out in a window around it.
+The crosstalk of a pixel is the maximum of its averaged, baseline subtracted
+window relative to the one of the pixel with the injected pulse.
+
+The files of a campaign are named
+<folder>/CtCh{pixel with injected pulse}{H|L}.dat
+where a high signal (H) is used for the low gain channel
+and a low signal (L) for the high gain channel.
+'''
+from collections import namedtuple
+import os
+import re
+import numpy as np
+from joblib import Parallel, delayed
+
+from ..io import EventGenerator, gaintypes, num_channels
+from ..extraction import peak, windows
+
+# matrix: (num_channels, num_channels), crosstalk in percent,
+#         rows are the pixels with the injected pulse
+# averages: (num_channels, num_channels, window), averaged windows
+# num_events: (num_channels, ), number of events used for each row
+Crosstalk = namedtuple('Crosstalk', ['matrix', 'averages', 'num_events'])
+
+file_re = re.compile(r'CtCh(?P<pixel>\d)(?P<signal>[HL])\.dat$')
+signal_gain = {'H': 'low', 'L': 'high'}
+
+
+def find_crosstalk_files(folder):
+    ''' return a dict {(gain, pulse_pixel): path} for all crosstalk files in folder '''
+    files = {}
+    for filename in sorted(os.listdir(folder)):
+        match = file_re.match(filename)
+        if match is None:
+            continue
+        key = (signal_gain[match.group('signal')], int(match.group('pixel')))
+        files[key] = os.path.join(folder, filename)
+    return files
+
+
+def align_windows(data, pulse_pixel, search=(20, 75), left=20, right=20):
+    ''' cut out a window around the pulse position from all pixels
+
+    Args:
+        data: adc counts of shape (num_events, num_channels, roi)
+        pulse_pixel: pixel used to find the pulse position
+
+    Kwargs:
+        search: range of samples in which the pulse maximum is searched
+        left, right: number of samples before and after the pulse position
+
+    returns an array of shape (num_events, num_channels, left + right)
+    and the pulse positions, events where the window does not fit into the
+    roi are dropped
+    '''
+    position, _ = peak(data[:, pulse_pixel], *search)
+
+    valid = (position >= left) & (position + right <= data.shape[-1])
+    position = position[valid]
+
+    start = np.repeat(position[:, np.newaxis] - left, data.shape[1], axis=1)
+    return windows(data[valid], start, left + right), position
+
+
+def average_windows(
+        path,
+        pulse_pixel,
+        gain,
+        search=(20, 75),
+        left=20,
+        right=20,
+        baseline_samples=13,
+        max_events=None,
+        block_size=1000,
+        ):
+    ''' average the aligned windows of all events of a file
+
+    returns the baseline subtracted average of shape (num_channels, left + right)
+    and the number of events used,
+    raises a ValueError if no event has an aligned window
+    '''
+    gain = gaintypes.index(gain)
+    generator = EventGenerator(path, max_events=max_events)
+
+    total = np.zeros((num_channels, left + right))
+    num_events = 0
+    for block in generator.iter_blocks(block_size, delta_t=False):
+        aligned, position = align_windows(
+            block.data[:, :, gain], pulse_pixel, search, left, right
+        )
+        total += aligned.sum(axis=0, dtype='f8')
+        num_events += len(position)
+
+    if num_events == 0:
+        raise ValueError('No event of {} has an aligned window for pulse pixel {}'.format(
+            path, pulse_pixel
+        ))
+
+    average = total / num_events
+    average -= average[:, :baseline_samples].mean(axis=1, keepdims=True)
+    return average, num_events
+
+
+def crosstalk_matrix(files, n_jobs=1, verbose=0, **kwargs):
+    ''' calculate the crosstalk matrix for each gain
+
+    Args:
+        files: dict {(gain, pulse_pixel): path}, see find_crosstalk_files,
+               or a folder containing the crosstalk files
+
+    Kwargs:
+        n_jobs: number of files processed in parallel
+        verbose: verbosity of joblib
+        all other kwargs are passed to average_windows
+
+    returns a dict {gain: Crosstalk}, rows without a file are nan
+    '''
+    if not isinstance(files, dict):
+        files = find_crosstalk_files(files)
+    keys = sorted(files)
+
+    with Parallel(n_jobs, verbose=verbose) as pool:
+        results = pool(
+            delayed(average_windows)(files[key], key[1], key[0], **kwargs)
+            for key in keys
+        )
+
+    crosstalk = {}
+    for gain in gaintypes:
+        matrix = np.full((num_channels, num_channels), np.nan)
+        averages = None
+        num_events = np.zeros(num_channels, dtype=int)
+
+        for (key_gain, pulse_pixel), (average, n) in zip(keys, results):
+            if key_gain != gain:
+                continue
+            if averages is None:
+                averages = np.full((num_channels, ) + average.shape, np.nan)
+            averages[pulse_pixel] = average
+            num_events[pulse_pixel] = n
+            maxima = average.max(axis=1)
+            matrix[pulse_pixel] = 100 * maxima / maxima[pulse_pixel]
+
+        if averages is not None:
+            crosstalk[gain] = Crosstalk(matrix, averages, num_events)
+
+    return crosstalk
@@ -0,0 +1,103 @@
+'''
+Ratio of the high to the low gain channel from pulse injection runs.
+
+Every file of a scan contains pulses of one amplitude in all pixels.
+For each event, pixel and gain the baseline, the mean of the first samples,
+is subtracted and the maximum is searched.
+The ratio of the high and low gain maxima is averaged over all events
+of a file, so a scan over many amplitudes gives the ratio
+as a function of the high gain amplitude.
+Expected is a ratio of roughly 20, smaller ratios at low amplitudes
+are caused by noise, at high amplitudes by saturation.
+'''
+import os
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+from ..io import EventGenerator, gaintypes, num_channels
+from ..runningstats import RunningStats
+from ..extraction import baseline, peak
+
+high = gaintypes.index('high')
+low = gaintypes.index('low')
+
+
+def pulse_amplitudes(data, baseline_samples=20, search=(0, 90)):
+    ''' baseline subtracted maximum of each time series
+
+    Args:
+        data: adc counts of shape (..., roi)
+
+    Kwargs:
+        baseline_samples: the mean of the first baseline_samples is the baseline
+        search: range of samples in which the maximum is searched
+
+    returns an array of shape data.shape[:-1]
+    '''
+    _, amplitude = peak(data, *search)
+    return amplitude - baseline(data, 0, baseline_samples)
+
+
+def file_gain_ratio(path, max_events=None, block_size=1000, **kwargs):
+    ''' calculate the gain ratio statistics of one file, reading it in blocks
+
+    kwargs are passed to pulse_amplitudes.
+    returns a DataFrame indexed by pixel, events with a low gain amplitude
+    <= 0 are ignored for the ratio
+    '''
+    generator = EventGenerator(path, max_events=max_events)
+
+    ratio = RunningStats(num_channels)
+    amplitude = RunningStats((num_channels, len(gaintypes)))
+
+    for block in generator.iter_blocks(block_size, delta_t=False):
+        amplitudes = pulse_amplitudes(block.data, **kwargs)
+        amplitude.add_many(amplitudes)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratios = amplitudes[..., high] / amplitudes[..., low]
+        ratios[amplitudes[..., low] <= 0] = np.nan
+        ratio.add_many(ratios)
+
+    df = pd.DataFrame(index=pd.Index(np.arange(num_channels), name='pixel'))
+    for i, gain in enumerate(gaintypes):
+        df['amplitude_' + gain] = amplitude.mean[:, i]
+        df['amplitude_{}_std'.format(gain)] = amplitude.std[:, i]
+    df['ratio'] = ratio.mean
+    df['ratio_std'] = ratio.std
+    df['ratio_sem'] = ratio.sem
+    df['n_events'] = ratio.n
+    return df
+
+
+def gain_ratio_curves(paths, n_jobs=1, verbose=0, **kwargs):
+    ''' calculate the gain ratio for many files
+
+    Args:
+        paths: list of .dat files or a folder, which is searched recursively
+
+    Kwargs:
+        n_jobs: number of files processed in parallel
+        verbose: verbosity of joblib
+        all other kwargs are passed to file_gain_ratio
+
+    returns a DataFrame indexed by (pixel, file), sorted by the mean high gain
+    amplitude, with the columns of file_gain_ratio
+    '''
+    if isinstance(paths, str):
+        paths = sorted(
+            os.path.join(dirpath, filename)
+            for dirpath, dirnames, filenames in os.walk(paths)
+            for filename in filenames
+            if filename.endswith('.dat')
+        )
+
+    with Parallel(n_jobs, verbose=verbose) as pool:
+        results = pool(
+            delayed(file_gain_ratio)(path, **kwargs) for path in paths
+        )
+
+    df = pd.concat(results, keys=paths, names=['file'])
+    df = df.reorder_levels(['pixel', 'file'])
+    return df.sort_values('amplitude_high').sort_index(level='pixel', sort_remaining=False)
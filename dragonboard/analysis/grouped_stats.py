@@ -0,0 +1,214 @@
+'''
+Per (cell, sample) statistics of tables too large for memory.
+
+The tables written by dragonboard_dataextraction (pixel_{p}_{g} with the
+columns cell, sample, delta_t and adc_counts) are read in chunks.
+Count, mean and standard deviation of every group are accumulated in dense
+arrays using np.bincount on the flat group index,
+e.g. cell * num_samples + sample, and merged chunk by chunk
+with the parallel algorithm of Chan et al.
+Percentiles are calculated in a second pass from integer histograms
+around the mean of each group.
+'''
+import numpy as np
+import pandas as pd
+
+from ..io import max_roi
+
+
+class GroupedStats:
+    ''' Accumulate count, mean and std of values grouped by integer keys
+
+    Args:
+        by: names of the group columns, non negative integers,
+            the number of groups grows as larger keys are seen
+
+    Kwargs:
+        percentiles: percentiles to calculate, in percent, needs a second
+            pass over the data with `add_histogram` after all calls to `add`
+        percentile_window: percentiles are exact for integer values within
+            mean ± percentile_window of each group, values outside are
+            counted at the edges of the window
+    '''
+
+    initial_size = {'cell': max_roi}
+
+    def __init__(self, by=('cell', 'sample'), percentiles=(), percentile_window=64):
+        self.by = tuple(by)
+        self.percentiles = tuple(percentiles)
+        self.percentile_window = percentile_window
+
+        self.shape = tuple(self.initial_size.get(name, 1) for name in self.by)
+        self.count = np.zeros(self.shape, dtype='i8')
+        self.mean = np.zeros(self.shape)
+        self.M2 = np.zeros(self.shape)
+        self.histogram = None
+
+    def _grow(self, keys):
+        shape = tuple(
+            max(size, int(key.max()) + 1) if len(key) else size
+            for size, key in zip(self.shape, keys)
+        )
+        if shape == self.shape:
+            return
+
+        if self.histogram is not None:
+            raise ValueError('New groups found while filling the histograms')
+
+        pad = [(0, new - old) for old, new in zip(self.shape, shape)]
+        self.count = np.pad(self.count, pad)
+        self.mean = np.pad(self.mean, pad)
+        self.M2 = np.pad(self.M2, pad)
+        self.shape = shape
+
+    def _flat_index(self, keys):
+        self._grow(keys)
+        return np.ravel_multi_index(tuple(np.asarray(k, dtype='i8') for k in keys), self.shape)
+
+    def add(self, keys, values):
+        ''' add values, keys is a sequence of arrays, one for each group column '''
+        values = np.asarray(values, dtype='f8')
+        index = self._flat_index(keys)
+        size = self.count.size
+
+        count = np.bincount(index, minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.bincount(index, weights=values, minlength=size) / count
+        M2 = np.bincount(index, weights=(values - mean[index]) ** 2, minlength=size)
+
+        total = self.count.ravel() + count
+        update = count > 0
+        delta = mean[update] - self.mean.ravel()[update]
+
+        self.mean.ravel()[update] += delta * count[update] / total[update]
+        self.M2.ravel()[update] += (
+            M2[update] + delta ** 2 * self.count.ravel()[update] * count[update] / total[update]
+        )
+        self.count.ravel()[:] = total
+
+    def add_histogram(self, keys, values):
+        ''' second pass for the percentiles, add the same values as with `add` '''
+        window = self.percentile_window
+        num_bins = 2 * window + 1
+        if self.histogram is None:
+            self.center = np.round(self.mean).astype('i8')
+            self.histogram = np.zeros(self.count.size * num_bins, dtype='u4')
+
+        index = self._flat_index(keys)
+        values = np.round(np.asarray(values, dtype='f8')).astype('i8')
+        bins = np.clip(values - self.center.ravel()[index] + window, 0, num_bins - 1)
+
+        self.histogram += np.bincount(
+            index * num_bins + bins, minlength=self.histogram.size
+        ).astype('u4')
+
+    @property
+    def std(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, np.sqrt(self.M2 / (self.count - 1)), np.nan)
+
+    def _percentiles(self, valid):
+        ''' percentiles like np.percentile with linear interpolation '''
+        num_bins = 2 * self.percentile_window + 1
+        histogram = self.histogram.reshape(-1, num_bins)[valid.ravel()]
+        cumulative = np.cumsum(histogram, axis=1)
+        count = self.count.ravel()[valid.ravel()]
+        offset = self.center.ravel()[valid.ravel()] - self.percentile_window
+
+        def value_at(rank):
+            # number of values <= the bin edges tells in which bin rank lies
+            position = (cumulative <= rank[:, np.newaxis]).sum(axis=1)
+            return offset + np.minimum(position, num_bins - 1)
+
+        result = {}
+        for q in self.percentiles:
+            rank = q / 100 * (count - 1)
+            lower = np.floor(rank)
+            low = value_at(lower)
+            high = value_at(np.ceil(rank))
+            result['{:g}%'.format(q)] = low + (rank - lower) * (high - low)
+        return result
+
+    def result(self):
+        ''' return a DataFrame indexed by the group columns
+        with the columns mean, std, count and the percentiles
+        for all groups with at least one value
+        '''
+        valid = self.count > 0
+        keys = np.nonzero(valid)
+        if len(self.by) == 1:
+            index = pd.Index(keys[0], name=self.by[0])
+        else:
+            index = pd.MultiIndex.from_arrays(keys, names=self.by)
+
+        df = pd.DataFrame({
+            'mean': self.mean[valid],
+            'std': self.std[valid],
+            'count': self.count[valid],
+        }, index=index)
+
+        if self.percentiles:
+            if self.histogram is None:
+                raise ValueError('Percentiles need a second pass using add_histogram')
+            for name, column in self._percentiles(valid).items():
+                df[name] = column
+
+        return df
+
+
+def iter_chunks(path, key, chunksize=1000000, selection=None):
+    ''' iterate over an hdf5 table in DataFrames of chunksize rows
+
+    selection: callable returning a boolean mask for a chunk
+    '''
+    with pd.HDFStore(path, mode='r') as store:
+        for chunk in store.select(key, chunksize=chunksize):
+            if selection is not None:
+                chunk = chunk[np.asarray(selection(chunk))]
+            yield chunk
+
+
+def grouped_stats(
+        path,
+        key,
+        by=('cell', 'sample'),
+        value='adc_counts',
+        selection=None,
+        percentiles=(),
+        percentile_window=64,
+        chunksize=1000000,
+        ):
+    '''
+    Out of core replacement for
+    df[selection(df)].groupby(by)[value].agg(['mean', 'std', 'count'])
+    on the table key of the hdf5 file path
+
+    Args:
+        path: hdf5 file
+        key: name of the table, e.g. pixel_0_high
+
+    Kwargs:
+        by: group columns
+        value: column name or callable returning the values for a chunk
+        selection: callable returning a boolean mask for a chunk
+        percentiles: e.g. (25, 50, 75), adds the columns '25%', '50%', '75%',
+            this reads the table twice, see GroupedStats
+        percentile_window: see GroupedStats
+        chunksize: number of rows read at once
+    '''
+    stats = GroupedStats(by, percentiles, percentile_window)
+
+    def chunks():
+        for chunk in iter_chunks(path, key, chunksize, selection):
+            keys = [chunk[name].values for name in stats.by]
+            values = value(chunk) if callable(value) else chunk[value]
+            yield keys, np.asarray(values)
+
+    for keys, values in chunks():
+        stats.add(keys, values)
+
+    if percentiles:
+        for keys, values in chunks():
+            stats.add_histogram(keys, values)
+
+    return stats.result()
@@ -0,0 +1,199 @@
+'''
+Process many input files in parallel with a resumable job state.
+
+A Recipe processes every input file on its own into a part file
+and merges all part files into the output at the end.
+The part files are written into a work directory together with
+a manifest, manifest.json, recording every finished task with the size and
+modification time of its input file and a hash of the recipe options.
+Running the same batch again only processes the files that are not finished,
+changed since or were processed with other options,
+so an interrupted batch continues where it stopped.
+
+A task failing does not stop the other tasks, the failures are reported
+at the end and nothing is merged, fixing the cause and running the batch
+again processes only the failed files.
+'''
+from collections import namedtuple
+import datetime
+import hashlib
+import json
+import logging
+import os
+import traceback
+
+from joblib import Parallel, delayed
+
+log = logging.getLogger(__name__)
+
+manifest_name = 'manifest.json'
+manifest_version = 1
+
+
+class Recipe(namedtuple('Recipe', ['name', 'process', 'merge', 'part_extension'])):
+    ''' How to process a batch
+
+    process(inputfile, partfile, options): process one input file into partfile
+    merge(inputfiles, partfiles, outputfile, options): merge the part files,
+        in the order of the input files, into outputfile
+    part_extension: file extension of the part files, e.g. '.hdf5'
+    '''
+
+
+class BatchError(RuntimeError):
+    ''' raised if tasks of a batch failed, failed maps input files to the tracebacks '''
+
+    def __init__(self, failed):
+        self.failed = failed
+        super().__init__('{} of the tasks failed:\n{}'.format(
+            len(failed),
+            '\n'.join('{}:\n{}'.format(path, error) for path, error in failed.items()),
+        ))
+
+
+def options_hash(recipe, options):
+    data = json.dumps([recipe.name, options], sort_keys=True, default=str)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def part_path(workdir, inputfile, recipe):
+    ''' the part file of inputfile, unique for input files with the same name '''
+    path = os.path.realpath(inputfile)
+    digest = hashlib.sha1(path.encode()).hexdigest()[:8]
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(workdir, '{}_{}{}'.format(name, digest, recipe.part_extension))
+
+
+class Manifest:
+    ''' The finished tasks of a batch, saved as json in the work directory '''
+
+    def __init__(self, workdir):
+        self.path = os.path.join(workdir, manifest_name)
+        self.tasks = {}
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            if data['version'] > manifest_version:
+                raise ValueError('{} has version {}, only {} is supported'.format(
+                    self.path, data['version'], manifest_version
+                ))
+            self.tasks = data['tasks']
+
+    @staticmethod
+    def _input_state(inputfile):
+        stat = os.stat(inputfile)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def is_done(self, inputfile, partfile, options):
+        ''' True if inputfile was processed with options and did not change since '''
+        task = self.tasks.get(os.path.realpath(inputfile))
+        return (
+            task is not None
+            and task['options'] == options
+            and task['part'] == partfile
+            and task['input'] == self._input_state(inputfile)
+            and os.path.isfile(partfile)
+        )
+
+    def add(self, inputfile, partfile, options):
+        self.tasks[os.path.realpath(inputfile)] = {
+            'part': partfile,
+            'options': options,
+            'input': self._input_state(inputfile),
+            'finished': datetime.datetime.now().isoformat(),
+        }
+
+    def save(self):
+        # write a new file and replace the old one, so an interruption
+        # never leaves a broken manifest
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': manifest_version, 'tasks': self.tasks}, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+def _run_task(recipe, inputfile, partfile, options):
+    ''' process a single file, returns the traceback as string if it failed '''
+    tmp = partfile + '.tmp' + recipe.part_extension
+    try:
+        recipe.process(inputfile, tmp, options)
+        os.replace(tmp, partfile)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return inputfile, traceback.format_exc()
+    return inputfile, None
+
+
+def run_batch(
+        recipe,
+        inputfiles,
+        outputfile,
+        options=None,
+        workdir=None,
+        n_jobs=1,
+        overwrite=False,
+        merge=True,
+        verbose=0,
+        ):
+    ''' process inputfiles with recipe and merge the results into outputfile
+
+    Args:
+        recipe: a Recipe
+        inputfiles: list of input files
+        outputfile: result of recipe.merge
+
+    Kwargs:
+        options: dict of options for the recipe, json serializable
+        workdir: directory for the part files and the manifest,
+            default is outputfile + '.parts'
+        n_jobs: number of files processed in parallel
+        overwrite: if False, raise a FileExistsError if outputfile exists
+        merge: if False, only process the files
+        verbose: verbosity of joblib
+
+    returns the list of part files, in the order of inputfiles
+    raises a BatchError if any task failed, after all other tasks are finished
+    '''
+    options = dict(options or {})
+    if os.path.exists(outputfile) and not overwrite and merge:
+        raise FileExistsError('{} exists, set overwrite to replace it'.format(outputfile))
+
+    if workdir is None:
+        workdir = outputfile + '.parts'
+    workdir = os.path.abspath(workdir)
+    os.makedirs(workdir, exist_ok=True)
+
+    manifest = Manifest(workdir)
+    digest = options_hash(recipe, options)
+    partfiles = [part_path(workdir, inputfile, recipe) for inputfile in inputfiles]
+    pending = [
+        (inputfile, partfile)
+        for inputfile, partfile in zip(inputfiles, partfiles)
+        if not manifest.is_done(inputfile, partfile, digest)
+    ]
+    log.info('%d of %d files already processed', len(inputfiles) - len(pending), len(inputfiles))
+
+    failed = {}
+    if pending:
+        with Parallel(n_jobs, verbose=verbose, return_as='generator') as pool:
+            results = pool(
+                delayed(_run_task)(recipe, inputfile, partfile, options)
+                for inputfile, partfile in pending
+            )
+            parts = dict(pending)
+            for inputfile, error in results:
+                if error is None:
+                    manifest.add(inputfile, parts[inputfile], digest)
+                    manifest.save()
+                else:
+                    log.error('Processing %s failed', inputfile)
+                    failed[inputfile] = error
+
+    if failed:
+        raise BatchError(failed)
+
+    if merge:
+        recipe.merge(list(inputfiles), partfiles, outputfile, options)
+
+    return partfiles
@@ -0,0 +1,62 @@
+'''
+A cache for arrays parsed from slow to read input files.
+
+Arrays are stored as .npy files named after the sha1 hash of the input,
+so a changed input file is parsed again and unchanged files are shared
+between all jobs using the same cache directory.
+The directory is $DRAGONBOARD_CACHE_DIR or ~/.cache/dragonboard.
+'''
+import hashlib
+import os
+import tempfile
+import numpy as np
+
+
+def cache_dir():
+    return os.environ.get(
+        'DRAGONBOARD_CACHE_DIR',
+        os.path.join(os.path.expanduser('~'), '.cache', 'dragonboard'),
+    )
+
+
+def file_hash(path, block_size=2**20):
+    ''' sha1 hex digest of the content of path '''
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def cached_array(path, parse, name):
+    ''' return parse(path), using the cached result if it exists
+
+    name identifies the parser, so different parsers of the same file
+    do not share a cache entry.
+    If the cache directory is not writable, the result is not cached.
+    '''
+    cache_path = os.path.join(
+        cache_dir(), '{}_{}.npy'.format(name, file_hash(path))
+    )
+    try:
+        return np.load(cache_path)
+    except (OSError, ValueError):
+        pass
+
+    array = parse(path)
+
+    tmp = None
+    try:
+        os.makedirs(cache_dir(), exist_ok=True)
+        # write to a temporary file first, so concurrent jobs
+        # never read a partially written cache entry
+        fd, tmp = tempfile.mkstemp(dir=cache_dir(), suffix='.npy')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp, cache_path)
+    except OSError:
+        # do not leave a partially written file behind, e.g. on a full disk
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+
+    return array
@@ -1,97 +1,315 @@
+import json
+import os
 import numpy as np
 import pandas as pd
-from copy import deepcopy
+from copy import copy
 
-from .utils import sample2cell
+from .io import stop_cells_to_array, structured_to_array
+from .io import gaintypes, max_roi, num_channels, num_gains
+from .calibration_bundle import is_bundle, load_bundle
+from .cache import cached_array
+from .delta_t import as_float
+from .extraction import Extractor
+from .utils import stop_cells2cells
 
 
-class NoCalibration:
+def _as_array(structured):
+    ''' structured_to_array, time_since_last_readout is None without delta_t '''
+    if structured is None:
+        return None
+    return structured_to_array(structured)
+
+
+def _gather(constants, cells, *index):
+    ''' return constants[pixel, gain, cell, *index] for the cells
+    of shape (..., pixel, gain, sample)
+    '''
+    pixel = np.arange(constants.shape[0])[:, np.newaxis, np.newaxis]
+    gain = np.arange(constants.shape[1])[:, np.newaxis]
+    return constants[(pixel, gain, cells) + index]
+
+
+timelapse_columns = ('a', 'b', 'c', 'chisq_ndf')
+
+
+class CalibrationPipeline:
+    ''' Apply several calibration stages at once.
+
+    The physical cells of all samples are calculated only once per event
+    and shared by all stages. Each stage adds its offsets into one
+    float buffer, which is subtracted from the adc data with
+    a single conversion to the data type at the end.
+
+    An optional dragonboard.extraction.Extractor runs after the calibration
+    in `extract_block`.
+    '''
+
+    def __init__(self, stages, extractor=None):
+        self.stages = list(stages)
+        self.extractor = extractor
+
+    def __repr__(self):
+        stages = ', '.join(stage.__class__.__name__ for stage in self.stages)
+        if self.extractor is None:
+            return '{}([{}])'.format(self.__class__.__name__, stages)
+        return '{}([{}], extractor={!r})'.format(
+            self.__class__.__name__, stages, self.extractor
+        )
+
+    @classmethod
+    def from_files(cls, calibpath=None, extrapath=None):
+        ''' choose the calibration matching the given files
+
+        calibpath: TimelapseCalibration
+        extrapath: MedianTimelapseExtraOffsets
+        calibpath and extrapath: TimelapseCalibrationExtraOffsets
+        neither: no calibration
+        '''
+        if extrapath and not calibpath:
+            stages = [MedianTimelapseExtraOffsets(extrapath)]
+        elif extrapath and calibpath:
+            stages = [TimelapseCalibrationExtraOffsets(calibpath, extrapath)]
+        elif calibpath:
+            stages = [TimelapseCalibration(calibpath)]
+        else:
+            stages = []
+        return cls(stages)
+
+    @classmethod
+    def from_config(cls, path):
+        ''' build a pipeline from a json file like this:
+
+        {"stages": [
+            {"calibration": "TimelapseCalibration", "filename": "fits.hdf5"},
+            {"calibration": "PatternSubtraction", "pattern_file": "pattern.hdf5"}
+        ],
+         "extraction": {"integration": "sliding", "width": 7}}
+
+        All other keys of a stage are passed to the calibration class,
+        strings are treated as paths relative to the config file.
+        The optional "extraction" is passed to dragonboard.extraction.Extractor.
+        '''
+        with open(path) as f:
+            config = json.load(f)
+
+        basedir = os.path.dirname(os.path.abspath(path))
+        stages = []
+        for stage_config in config['stages']:
+            kwargs = dict(stage_config)
+            name = kwargs.pop('calibration')
+            if name not in calibrations:
+                raise ValueError('Unknown calibration {!r} in {}'.format(name, path))
+            for key, value in kwargs.items():
+                if isinstance(value, str):
+                    kwargs[key] = os.path.join(basedir, value)
+            stages.append(calibrations[name](**kwargs))
+
+        extractor = None
+        if 'extraction' in config:
+            extractor = Extractor(**config['extraction'])
+
+        return cls(stages, extractor=extractor)
+
+    def instrument(self, stats):
+        ''' return a copy of this pipeline that records the time
+        spent in each stage in stats, a dragonboard.profiling.PipelineStats
+        '''
+        stages = []
+        for stage in self.stages:
+            stage = copy(stage)
+            stage.add_offsets = stats.wrap(stage.__class__.__name__, stage.add_offsets)
+            stages.append(stage)
+
+        extractor = self.extractor
+        if extractor is not None:
+            extractor = stats.wrap(extractor.__class__.__name__, extractor)
+        return self.__class__(stages, extractor=extractor)
+
+    def offsets(self, stop_cells, time_since_last_readout, roi=None):
+        ''' return the summed offsets of all stages as float32 array
+
+        stop_cells: array of shape (..., pixel, gain)
+        time_since_last_readout: array of shape (..., pixel, gain, sample),
+            compact delta_t is expanded to float here.
+            None for data read without delta_t, then roi has to be given
+            and stages using delta_t raise a ValueError.
+        roi: number of samples, default is the last axis of time_since_last_readout
+        '''
+        if time_since_last_readout is None:
+            for stage in self.stages:
+                if stage.uses_delta_t:
+                    raise ValueError(
+                        '{} needs the time_since_last_readout, '
+                        'read the data with delta_t=True'.format(stage.__class__.__name__)
+                    )
+            if roi is None:
+                raise ValueError('roi is needed without time_since_last_readout')
+        time_since_last_readout = as_float(time_since_last_readout)
+        if roi is None:
+            roi = time_since_last_readout.shape[-1]
+        cells = stop_cells2cells(stop_cells, roi)
+
+        offsets = np.zeros(cells.shape, dtype='f4')
+        for stage in self.stages:
+            stage.add_offsets(offsets, cells, time_since_last_readout)
+
+        return offsets
+
+    def calibrate_block(self, block):
+        ''' return the calibrated data of an EventBlock as new array '''
+        if not self.stages:
+            return block.data.copy()
+
+        offsets = self.offsets(
+            stop_cells_to_array(block.headers['stop_cells']),
+            block.time_since_last_readout,
+            roi=block.data.shape[-1],
+        )
+        return block.data - offsets.astype(block.data.dtype)
+
+    def extract_block(self, block):
+        ''' calibrate an EventBlock and return the features of all
+        time series, see dragonboard.extraction.Extractor
+        '''
+        if self.extractor is None:
+            raise ValueError('This pipeline has no extractor')
+        return self.extractor(self.calibrate_block(block))
+
+    def __call__(self, event):
+        ''' return a new event with calibrated data '''
+        if not self.stages:
+            return event
+
+        # events of the flat layout are already plain arrays
+        flat = event.data.dtype.names is None
+        if flat:
+            stop_cells = event.header.stop_cells
+            time_since_last_readout = event.time_since_last_readout
+        else:
+            stop_cells = _as_array(event.header.stop_cells)
+            time_since_last_readout = _as_array(event.time_since_last_readout)
+
+        data = event.data.copy()
+        adc = data if flat else _as_array(data)
+        offsets = self.offsets(stop_cells, time_since_last_readout, roi=adc.shape[-1])
+
+        adc -= offsets.astype(adc.dtype)
+
+        return event._replace(data=data)
+
+
+class Calibration:
+    ''' Base class for calibrations.
+
+    Subclasses implement `add_offsets`, calling an instance calibrates
+    a single event, use a CalibrationPipeline to combine several.
+    Subclasses using the time_since_last_readout set `uses_delta_t`,
+    they cannot calibrate data read without delta_t.
+    '''
+    uses_delta_t = False
+
+    def add_offsets(self, offsets, cells, time_since_last_readout):
+        ''' add the offsets of this calibration to `offsets`
+
+        All arrays have the shape (..., pixel, gain, sample),
+        cells are the physical cells of each sample.
+        '''
+        raise NotImplementedError
+
+    def __call__(self, event):
+        ''' calibrate data in event '''
+        return CalibrationPipeline([self])(event)
+
+
+class NoCalibration(Calibration):
+    def add_offsets(self, offsets, cells, time_since_last_readout):
+        pass
+
     def __call__(self, event):
         return event
 
 
 def read_calib_constants(filepath):
+    ''' return the timelapse fit results as DataFrame indexed by (pixel, channel, cell) '''
+    if is_bundle(filepath):
+        bundle = load_bundle(filepath, kind='timelapse')
+        index = pd.MultiIndex.from_product(
+            [np.arange(num_channels), gaintypes, np.arange(max_roi)],
+            names=['pixel', 'channel', 'cell'],
+        )
+        return pd.DataFrame(
+            {name: bundle[name].ravel() for name in timelapse_columns}, index=index
+        ).sort_index()
+
     return pd.read_hdf(filepath).set_index(
         ['pixel', 'channel', 'cell']
     ).sort_index()
 
 
-class TakaOffsetCalibration:
+def load_timelapse_constants(filepath):
+    ''' return a dict with the arrays a, b, c and chisq_ndf
+    of shape (pixel, gain, cell) from a bundle or an hdf5 file
+    '''
+    if is_bundle(filepath):
+        bundle = load_bundle(filepath, kind='timelapse')
+        return {name: bundle[name] for name in timelapse_columns}
+
+    calib_constants = read_calib_constants(filepath)
+    constants = {
+        name: np.zeros((num_channels, num_gains, max_roi), dtype='f4')
+        for name in timelapse_columns
+    }
+    for pixel in range(num_channels):
+        for gain, channel in enumerate(gaintypes):
+            values = calib_constants.loc[pixel, channel]
+            for name in timelapse_columns:
+                constants[name][pixel, gain] = values[name].values
+    return constants
+
+
+def parse_taka_offsets(filename):
+    ''' parse the text table of Taka's offsets into an array of shape (pixel, gain, cell)
+
+    The table has 4096 rows, one per cell, and 16 columns,
+    the high gain of pixel 0 to 7 and then the low gain of pixel 0 to 7.
+    '''
+    table = np.loadtxt(filename, dtype='f8', ndmin=2)
+    if table.shape != (max_roi, 2 * num_channels):
+        raise ValueError('Expected a table of shape {}, got {} in {}'.format(
+            (max_roi, 2 * num_channels), table.shape, filename
+        ))
 
-    def __init__(self, filename):
-        self.roi = None
-        table = np.genfromtxt(filename)
-        assert table.shape == (4096, 16)
-        table = table.astype('i4')
-        self.offsets = np.zeros(
-            8,
-            dtype=[
-                ("low", 'i4', 4096),
-                ("high", 'i4', 4096),
-            ]
-        )
-        for i in range(8):
-            self.offsets["high"][i] = table[:, i]
-            self.offsets["low"][i] = table[:, i + 8]
+    # (cell, gain, pixel) with the high gain first
+    offsets = table.astype('i4').reshape(max_roi, num_gains, num_channels)
+    return np.ascontiguousarray(offsets[:, ::-1].transpose(2, 1, 0))
 
-    def __call__(self, event):
-        ''' calibrate data in event '''
-        event = deepcopy(event)
 
-        if self.roi is None:
-            self.roi = event.roi
-            self.sample = np.arange(event.roi)
+def load_taka_offsets(filename):
+    ''' parse_taka_offsets using the binary cache, see dragonboard.cache '''
+    return cached_array(filename, parse_taka_offsets, 'taka_offsets')
 
-        assert self.roi == event.roi
 
-        for pixel in range(len(event.data)):
-            for channel in event.data.dtype.names:
-                sc = event.header.stop_cells[pixel][channel]
-                cells = sample2cell(self.sample, sc)
+class TakaOffsetCalibration(Calibration):
 
-                event.data[pixel][channel] -= self.offsets[pixel][channel][cells]
+    def __init__(self, filename):
+        self.offsets = load_taka_offsets(filename)
 
-        return event
+    def add_offsets(self, offsets, cells, time_since_last_readout):
+        offsets += _gather(self.offsets, cells)
 
 
-class TimelapseCalibration:
+class TimelapseCalibration(Calibration):
     ''' Performs timelapse correction of measured data of
     the form calibrated = data - a * time_since_last_readout**b +c
     where a, b and c come from the fits performed by scripts/fit_delta_t.py
     '''
+    uses_delta_t = True
 
     def __init__(self, filename):
-        self.calib_constants = read_calib_constants(filename)
-        self.roi = None
-        self.sample = None
-
-        self.a = np.zeros(
-            8,
-            dtype=[
-                ("low", 'f4', 4096),
-                ("high", 'f4', 4096),
-            ]
-        )
-        self.b = np.zeros(
-            8,
-            dtype=[
-                ("low", 'f4', 4096),
-                ("high", 'f4', 4096),
-            ]
-        )
-        self.c = np.zeros(
-            8,
-            dtype=[
-                ("low", 'f4', 4096),
-                ("high", 'f4', 4096),
-            ]
-        )
-        for pixel in range(8):
-            for channel in ["low", "high"]:
-                a, b, c = self.calib_constants.loc[pixel, channel].values.T
-                self.a[pixel][channel][:] = a
-                self.b[pixel][channel][:] = b
-                self.c[pixel][channel][:] = c
+        constants = load_timelapse_constants(filename)
+        self.a = constants['a']
+        self.b = constants['b']
+        self.c = constants['c']
 
     def offset(self, delta_t, a, b, c):
         o = a * delta_t ** b + c
@@ -102,35 +320,20 @@ class TimelapseCalibration:
 
         return o
 
-    def __call__(self, event):
-        ''' calibrate data in event '''
-        event = deepcopy(event)
-
-        if self.roi is None:
-            self.roi = event.roi
-            self.sample = np.arange(event.roi)
-
-        assert self.roi == event.roi
-
-        for pixel in range(len(event.data)):
-            for channel in event.data.dtype.names:
-                sc = event.header.stop_cells[pixel][channel]
-                cells = sample2cell(self.sample, sc)
-
-                a = self.a[pixel][channel][cells]
-                b = self.b[pixel][channel][cells]
-                c = self.c[pixel][channel][cells]
-
-                dt = event.time_since_last_readout[pixel][channel]
-                event.data[pixel][channel] -= self.offset(dt, a, b, c).astype('>i2')
-
-        return event
+    def add_offsets(self, offsets, cells, time_since_last_readout):
+        offsets += self.offset(
+            time_since_last_readout,
+            _gather(self.a, cells),
+            _gather(self.b, cells),
+            _gather(self.c, cells),
+        )
 
 
 def read_offsets(offsets_file):
-    offsets = np.zeros(
-            shape=(8, 2, 4096, 40),
-            dtype='f4')
+    ''' read the output of scripts/offset_cell_sample.py
+    into an array of shape (pixel, gain, cell, sample), high gain first
+    '''
+    offsets = None
 
     def name_to_channel_gain_id(name):
         _, channel, gain = name.split('_')
@@ -143,22 +346,55 @@ def read_offsets(offsets_file):
             channel, gain_id = name_to_channel_gain_id(name)
             df = st[name]
             df.sort_values(["cell", "sample"], inplace=True)
-            offsets[channel, gain_id] = df["median"].values.reshape(-1, 40)
+            num_samples = int(df["sample"].max()) + 1
+            if offsets is None:
+                offsets = np.zeros(
+                    shape=(num_channels, num_gains, max_roi, num_samples),
+                    dtype='f4')
+            offsets[channel, gain_id] = df["median"].values.reshape(-1, num_samples)
 
     return offsets
 
 
-class MedianTimelapseCalibration:
+def load_offsets(offsets_file):
+    ''' return the offsets of shape (pixel, gain, cell, sample)
+    from a bundle or an hdf5 file
+    '''
+    if is_bundle(offsets_file):
+        return load_bundle(offsets_file, kind='offsets')['offsets']
+    # the offsets file stores the high gain first
+    return read_offsets(offsets_file)[:, ::-1]
+
+
+def load_pattern(pattern_file):
+    ''' return the pattern of shape (pixel, gain, cell, sample)
+    from a bundle or the hdf5 output of scripts/extract_pattern.py
+    '''
+    if is_bundle(pattern_file):
+        return load_bundle(pattern_file, kind='pattern')['pattern']
+
+    df = pd.read_hdf(pattern_file).reset_index()
+    shape = (df['pixel'].nunique(), num_gains, max_roi, df['sample'].nunique())
+    pattern = (
+        df.set_index(['pixel', 'channel', 'cell', 'sample'])
+        .sort_index()
+    )['mean'].values.reshape(shape)
+    # channels are sorted alphabetically, high gain first
+    return pattern[:, ::-1]
+
+
+class MedianTimelapseCalibration(Calibration):
     ''' Performs timelapse correction of measured data of
     the form calibrated = data - a * time_since_last_readout**b +c
     where c comes from the fits performed by scripts/fit_delta_t.py
     and a,b are median values.
     '''
+    uses_delta_t = True
 
-    def __init__(self, filename):
-        self.calib_constants = read_calib_constants(filename)
-        self.roi = None
-        self.sample = None
+    def __init__(self, filename, a=1.4599324285222228, b=-0.37503250093991702):
+        self.a = a
+        self.b = b
+        self.c = load_timelapse_constants(filename)['c']
 
     def offset(self, delta_t, a, b, c):
         o = a * delta_t ** b + c
@@ -169,80 +405,50 @@ class MedianTimelapseCalibration:
 
         return o
 
-    def __call__(self, event):
-        ''' calibrate data in event '''
-        event = deepcopy(event)
-
-        if self.roi is None:
-            self.roi = event.roi
-            self.sample = np.arange(event.roi)
-
-        assert self.roi == event.roi
-
-        for pixel in range(len(event.data)):
-            for channel in event.data.dtype.names:
-                sc = event.header.stop_cells[pixel][channel]
-                cells = sample2cell(self.sample, sc)
-
-                a, b, c = self.calib_constants.loc[pixel, channel].loc[cells].values.T
-                a = 1.4599324285222228
-                b = -0.37503250093991702
-                dt = event.time_since_last_readout[pixel][channel]
-                event.data[pixel][channel] -= self.offset(dt, a, b, c).astype('>i2')
-
-        return event
+    def add_offsets(self, offsets, cells, time_since_last_readout):
+        offsets += self.offset(
+            time_since_last_readout,
+            self.a,
+            self.b,
+            _gather(self.c, cells),
+        )
 
 
-class TimelapseCalibrationExtraOffsets:
+class TimelapseCalibrationExtraOffsets(Calibration):
     ''' Performs timelapse correction of measured data of
     the form calibrated = data - a * time_since_last_readout**b +c.
     Here, c is a function of sample_id. Takes 2 inputparameters:
     fits_file = file generated by scripts/fit_delta_t.py
     offsets_file = file generated by scripts/offset_cell_sample.py
     '''
+    uses_delta_t = True
 
     def __init__(self, fits_file, offsets_file):
-        self.calib_constants = read_calib_constants(fits_file).drop('c', axis=1)
-        self.offsets = read_offsets(offsets_file)
-        self.roi = None
-        self.sample = None
+        constants = load_timelapse_constants(fits_file)
+        self.a = constants['a']
+        self.b = constants['b']
+        self.offsets = load_offsets(offsets_file)
 
     def offset(self, delta_t, a, b):
         o = a * delta_t ** b
         o[np.isnan(o)] = 0
         return o
 
-    def __call__(self, event):
-        ''' calibrate data in event '''
-        event = deepcopy(event)
-
-        if self.roi is None:
-            self.roi = event.roi
-            self.sample = np.arange(event.roi)
-
-        assert self.roi == event.roi
-
-        for pixel in range(len(event.data)):
-            for gain in event.data.dtype.names:
-                gain_id = {'high': 0, 'low': 1}[gain]
-                sc = event.header.stop_cells[pixel][gain]
-                cells = sample2cell(self.sample, sc)
-
-                dt = event.time_since_last_readout[pixel][gain]
-                a, b = self.calib_constants.loc[pixel, gain].loc[cells].values.T
-                delta_t_offset = self.offset(dt, a, b).astype('>i2')
-                extra_offset = self.offsets[pixel, gain_id, cells, self.sample].astype('>i2')
-                event.data[pixel][gain] -= delta_t_offset + extra_offset
-
-        return event
+    def add_offsets(self, offsets, cells, time_since_last_readout):
+        sample = np.arange(cells.shape[-1])
+        offsets += self.offset(
+            time_since_last_readout,
+            _gather(self.a, cells),
+            _gather(self.b, cells),
+        )
+        offsets += _gather(self.offsets, cells, sample)
 
 
-class MedianTimelapseExtraOffsets:
+class MedianTimelapseExtraOffsets(Calibration):
+    uses_delta_t = True
 
     def __init__(self, offsets_file, a=1.4599324285222228, b=-0.37503250093991702):
-        self.offsets = read_offsets(offsets_file)
-        self.roi = None
-        self.sample = None
+        self.offsets = load_offsets(offsets_file)
         self.a = a
         self.b = b
 
@@ -251,57 +457,35 @@ class MedianTimelapseExtraOffsets:
         o[np.isnan(o)] = 0
         return o
 
-    def __call__(self, event):
-        ''' calibrate data in event '''
-        event = deepcopy(event)
-
-        if self.roi is None:
-            self.roi = event.roi
-            self.sample = np.arange(event.roi)
-
-        assert self.roi == event.roi
+    def add_offsets(self, offsets, cells, time_since_last_readout):
+        sample = np.arange(cells.shape[-1])
+        offsets += self.offset(time_since_last_readout)
+        offsets += _gather(self.offsets, cells, sample)
 
-        for pixel in range(len(event.data)):
-            for gain in event.data.dtype.names:
-                gain_id = {'high': 0, 'low': 1}[gain]
-                sc = event.header.stop_cells[pixel][gain]
-                cells = sample2cell(self.sample, sc)
 
-                dt = event.time_since_last_readout[pixel][gain]
-                delta_t_offset = self.offset(dt).astype('>i2')
-                extra_offset = self.offsets[pixel, gain_id, cells, self.sample].astype('>i2')
-                event.data[pixel][gain] -= delta_t_offset + extra_offset
+class PatternSubtraction(Calibration):
+    def __init__(self, pattern_file, num_samples=10):
+        self.pattern_data = load_pattern(pattern_file)
+        self.num_samples = min(num_samples, self.pattern_data.shape[-1])
 
-        return event
-
-
-class PatternSubtraction:
-    def __init__(self, pattern_file):
-        self.pattern_data = (
-            pd.read_hdf(pattern_file)
-            .reset_index()
-            .set_index(['pixel', 'channel', 'cell', 'sample'])
-            .sort_index()
-        )['mean'].values.reshape(7, 2, 4096, 11)
-        self.roi = None
-
-    def __call__(self, event):
-        ''' calibrate data in event '''
-        event = deepcopy(event)
-
-        if self.roi is None:
-            self.roi = event.roi
-            self.sample = np.arange(event.roi)[:10]
-
-        assert self.roi == event.roi
-
-        for pixel in range(len(event.data) - 1):
-            for gain in event.data.dtype.names:
-                gain_id = {'high': 0, 'low': 1}[gain]
-                sc = event.header.stop_cells[pixel][gain]
-                cells = sample2cell(self.sample, sc)
-
-                offset = self.pattern_data[pixel, gain_id, cells, self.sample]
-                event.data[pixel][gain][:10] -= np.round(offset).astype('>i2')
-
-        return event
+    def add_offsets(self, offsets, cells, time_since_last_readout):
+        n_pixels = self.pattern_data.shape[0]
+        sample = np.arange(self.num_samples)
+        pattern = _gather(
+            self.pattern_data, cells[..., :n_pixels, :, :self.num_samples], sample
+        )
+        offsets[..., :n_pixels, :, :self.num_samples] += np.round(pattern)
+
+
+calibrations = {
+    cls.__name__: cls
+    for cls in (
+        NoCalibration,
+        TakaOffsetCalibration,
+        TimelapseCalibration,
+        MedianTimelapseCalibration,
+        TimelapseCalibrationExtraOffsets,
+        MedianTimelapseExtraOffsets,
+        PatternSubtraction,
+    )
+}
@@ -0,0 +1,181 @@
+'''
+A single file format for calibration constants, that loads without parsing.
+
+Layout of a bundle file:
+
+    magic      8 bytes, b'\x93DRGCAL\x00'
+    length     uint32, little endian, length of the header
+    header     json, padded with spaces
+    arrays     raw array data, each array starts at a multiple of 64 bytes
+
+The header contains the format version, the kind of constants
+(e.g. 'timelapse', 'offsets', 'pattern'), free metadata like the roi,
+dtype, shape and offset of every array and a sha256 checksum of the array data.
+
+Arrays are memory mapped read only, so loading takes milliseconds and all
+processes using the same file share the pages in memory.
+The gain axis of all arrays is ordered like dragonboard.io.gaintypes.
+'''
+import hashlib
+import json
+import struct
+import numpy as np
+
+bundle_extension = '.dcal'
+format_version = 1
+magic = b'\x93DRGCAL\x00'
+alignment = 64
+
+
+def is_bundle(path):
+    ''' check if path is a calibration bundle by reading the magic bytes '''
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(magic)) == magic
+    except OSError:
+        return False
+
+
+def _align(position):
+    return -(-position // alignment) * alignment
+
+
+class CalibrationBundle:
+    ''' The arrays and metadata of a bundle file, see load_bundle '''
+
+    def __init__(self, kind, arrays, metadata, checksum=None, path=None):
+        self.kind = kind
+        self.arrays = arrays
+        self.metadata = metadata
+        self.checksum = checksum
+        self.path = path
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    def __repr__(self):
+        return '{}(kind={!r}, arrays={})'.format(
+            self.__class__.__name__,
+            self.kind,
+            {name: array.shape for name, array in self.arrays.items()},
+        )
+
+
+def write_bundle(path, kind, arrays, **metadata):
+    ''' write a dict of arrays into a bundle file
+
+    Args:
+        path: output file, by convention ending with bundle_extension
+        kind: kind of the constants, checked when loading
+        arrays: dict {name: array}
+
+    all other kwargs are stored as metadata and have to be json serializable
+    '''
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+
+    # the offsets depend on the header size, which depends on the offsets,
+    # so the header gets a fixed amount of padding for the offset numbers
+    descriptions = {}
+    position = 0
+    checksum = hashlib.sha256()
+    for name, array in arrays.items():
+        descriptions[name] = {
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'offset': position,
+        }
+        position = _align(position + array.nbytes)
+
+    header = {
+        'format_version': format_version,
+        'kind': kind,
+        'metadata': metadata,
+        'arrays': descriptions,
+    }
+    header_length = len(json.dumps(header)) + 16 * len(arrays) + 256
+    data_start = _align(len(magic) + 4 + header_length)
+    for description in descriptions.values():
+        description['offset'] += data_start
+
+    with open(path, 'wb') as f:
+        f.seek(data_start)
+        for name, array in arrays.items():
+            f.seek(descriptions[name]['offset'])
+            data = array.tobytes()
+            checksum.update(data)
+            f.write(data)
+
+        header['checksum'] = 'sha256:' + checksum.hexdigest()
+        encoded = json.dumps(header).encode()
+        length = data_start - len(magic) - 4
+        assert len(encoded) <= length, 'header too long'
+
+        f.seek(0)
+        f.write(magic)
+        f.write(struct.pack('<I', length))
+        f.write(encoded.ljust(length))
+
+
+def _read_header(f, path):
+    if f.read(len(magic)) != magic:
+        raise ValueError('{} is not a calibration bundle'.format(path))
+
+    length, = struct.unpack('<I', f.read(4))
+    header = json.loads(f.read(length).decode())
+
+    if header['format_version'] > format_version:
+        raise ValueError(
+            '{} has format version {}, only versions up to {} are supported'.format(
+                path, header['format_version'], format_version
+            )
+        )
+    return header
+
+
+def load_bundle(path, kind=None, mmap=True, verify=False):
+    ''' load a calibration bundle
+
+    Kwargs:
+        kind: if given, raise a ValueError if the bundle is of another kind
+        mmap: memory map the arrays read only instead of reading them
+        verify: compare the checksum of the array data, this reads the whole file
+    '''
+    with open(path, 'rb') as f:
+        header = _read_header(f, path)
+
+    if kind is not None and header['kind'] != kind:
+        raise ValueError('{} contains {} constants, expected {}'.format(
+            path, header['kind'], kind
+        ))
+
+    if mmap:
+        data = np.memmap(path, dtype='u1', mode='r')
+    else:
+        data = np.fromfile(path, dtype='u1')
+
+    arrays = {}
+    checksum = hashlib.sha256()
+    for name, description in header['arrays'].items():
+        dtype = np.dtype(description['dtype'])
+        shape = tuple(description['shape'])
+        start = description['offset']
+        stop = start + dtype.itemsize * int(np.prod(shape))
+
+        raw = data[start:stop]
+        if verify:
+            checksum.update(raw.tobytes())
+        arrays[name] = raw.view(dtype).reshape(shape)
+
+    if verify and 'sha256:' + checksum.hexdigest() != header['checksum']:
+        raise ValueError('Checksum mismatch, {} is corrupted'.format(path))
+
+    return CalibrationBundle(
+        kind=header['kind'],
+        arrays=arrays,
+        metadata=header['metadata'],
+        checksum=header['checksum'],
+        path=path,
+    )
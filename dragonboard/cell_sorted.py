@@ -0,0 +1,209 @@
+'''
+Cell sorted layout for the output of dragonboard_dataextraction.
+
+The default output has one table pixel_{p}_{g} per channel with the rows in
+event order. In the cell sorted layout each channel is a group
+/pixel_{p}_{g} with one array per column, sorted by cell, and the arrays
+cell_start and cell_stop of shape (4096, ), so all samples of a cell are
+one contiguous slice:
+
+    with CellSortedFile('cstc_sorted.hdf5') as f:
+        data = f.cell(pixel=0, gain='high', cell=42)
+        data['delta_t'], data['adc_counts']
+
+Files are created from the event ordered tables with `sort_by_cell`,
+an external merge sort: the input is read once in chunks, every chunk is
+sorted by cell and spilled to a temporary file, then the output is written
+front to back, merging the cells of all sorted chunks.
+'''
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import tables
+
+from .io import max_roi
+
+layout_name = 'cell_sorted'
+layout_version = 1
+
+column_dtypes = {
+    'cell': 'i2',
+    'sample': 'i2',
+    'delta_t': 'f4',
+    'adc_counts': 'i2',
+}
+
+
+def _channel_keys(store):
+    return [key.lstrip('/') for key in store.keys() if key.startswith('/pixel_')]
+
+
+def _cell_spans(counts, max_rows):
+    ''' split the cells into consecutive ranges (first, last)
+    of at most max_rows samples, or a single cell if it has more
+    '''
+    stop = np.cumsum(counts)
+    spans = []
+    first = 0
+    while first < len(counts):
+        done = stop[first - 1] if first else 0
+        last = max(first + 1, int(np.searchsorted(stop, done + max_rows, side='right')))
+        spans.append((first, last))
+        first = last
+    return spans
+
+
+def _sorted_runs(store, key, columns, chunksize, tmpdir):
+    ''' sort every chunk of a table by cell and save its columns as .npy files
+
+    returns the number of samples per cell and a list of runs,
+    dicts with the column files and the cell bounds of the run
+    '''
+    counts = np.zeros(max_roi, dtype='i8')
+    runs = []
+    for i, chunk in enumerate(store.select(key, chunksize=chunksize)):
+        cells = chunk['cell'].values
+        order = np.argsort(cells, kind='stable')
+        run_counts = np.bincount(cells, minlength=max_roi)
+        counts += run_counts
+
+        run = {'bounds': np.append(0, np.cumsum(run_counts))}
+        for column in columns:
+            path = os.path.join(tmpdir, '{}_{}_{}.npy'.format(key, i, column))
+            np.save(path, chunk[column].values[order].astype(column_dtypes[column]))
+            run[column] = path
+        runs.append(run)
+
+    return counts, runs
+
+
+def sort_by_cell(inputfile, outputfile, chunksize=10000000, complevel=5):
+    ''' convert the event ordered tables of inputfile into the cell sorted layout
+
+    The data of a channel is read once in chunks of chunksize rows,
+    each chunk is sorted by cell and written to a temporary file next to
+    outputfile. The output is then written in order, in spans of up to
+    chunksize rows, each the concatenation of the same cells of all chunks,
+    so every compressed output chunk is written once.
+    '''
+    filters = tables.Filters(complevel=complevel, complib='blosc')
+    columns = [c for c in column_dtypes if c != 'cell']
+    outdir = os.path.dirname(os.path.abspath(outputfile))
+
+    with pd.HDFStore(inputfile, mode='r') as store, \
+            tables.open_file(outputfile, mode='w', filters=filters) as out, \
+            tempfile.TemporaryDirectory(dir=outdir) as tmpdir:
+
+        out.root._v_attrs.layout = layout_name
+        out.root._v_attrs.version = layout_version
+
+        for key in _channel_keys(store):
+            counts, runs = _sorted_runs(store, key, columns, chunksize, tmpdir)
+
+            cell_stop = np.cumsum(counts)
+            cell_start = cell_stop - counts
+
+            group = out.create_group('/', key)
+            out.create_array(group, 'cell_start', cell_start)
+            out.create_array(group, 'cell_stop', cell_stop)
+
+            arrays = {
+                column: out.create_carray(
+                    group,
+                    column,
+                    atom=tables.Atom.from_dtype(np.dtype(column_dtypes[column])),
+                    shape=(int(cell_stop[-1]), ),
+                )
+                for column in columns
+            }
+            sources = {
+                column: [np.load(run[column], mmap_mode='r') for run in runs]
+                for column in columns
+            }
+
+            for first, last in _cell_spans(counts, chunksize):
+                start, stop = cell_start[first], cell_stop[last - 1]
+                if start == stop:
+                    continue
+
+                # the runs are in event order, so a stable sort of the
+                # concatenated runs by cell keeps the event order within a cell
+                slices = [slice(run['bounds'][first], run['bounds'][last]) for run in runs]
+                cells = np.concatenate([
+                    np.repeat(np.arange(first, last), np.diff(run['bounds'][first:last + 1]))
+                    for run in runs
+                ])
+                order = np.argsort(cells, kind='stable')
+
+                for column in columns:
+                    values = np.concatenate([
+                        source[part] for source, part in zip(sources[column], slices)
+                    ])
+                    arrays[column][start:stop] = values[order]
+
+            del sources
+            for run in runs:
+                for column in columns:
+                    os.remove(run[column])
+
+
+class CellSortedFile:
+    ''' Read access to a file in the cell sorted layout '''
+
+    def __init__(self, path):
+        self.path = path
+        self.file = tables.open_file(path, mode='r')
+
+        attrs = self.file.root._v_attrs
+        if getattr(attrs, 'layout', None) != layout_name:
+            self.file.close()
+            raise ValueError('{} is not in the {} layout'.format(path, layout_name))
+        if attrs.version > layout_version:
+            self.file.close()
+            raise ValueError('{} has layout version {}, only {} is supported'.format(
+                path, attrs.version, layout_version
+            ))
+
+        self._index = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    @property
+    def channels(self):
+        return sorted(group._v_name for group in self.file.root)
+
+    def _group(self, pixel, gain):
+        return self.file.get_node('/pixel_{}_{}'.format(pixel, gain))
+
+    def index(self, pixel, gain):
+        ''' return the cell_start and cell_stop arrays of a channel '''
+        key = (pixel, gain)
+        if key not in self._index:
+            group = self._group(pixel, gain)
+            self._index[key] = (group.cell_start.read(), group.cell_stop.read())
+        return self._index[key]
+
+    def cell(self, pixel, gain, cell, columns=('delta_t', 'adc_counts')):
+        ''' return a dict with the columns of all samples of a cell '''
+        group = self._group(pixel, gain)
+        cell_start, cell_stop = self.index(pixel, gain)
+        start, stop = int(cell_start[cell]), int(cell_stop[cell])
+        return {
+            column: group._f_get_child(column).read(start, stop)
+            for column in columns
+        }
+
+    def channel(self, pixel, gain, columns=('delta_t', 'adc_counts')):
+        ''' return a dict with the columns of all samples of a channel,
+        sorted by cell, use `index` to find the cells
+        '''
+        group = self._group(pixel, gain)
+        return {column: group._f_get_child(column).read() for column in columns}
@@ -0,0 +1,63 @@
+'''
+A compact uint16 representation of the time since the last readout.
+
+delta_t in seconds is quantised logarithmically between min_delta_t
+and max_delta_t into the codes 0 to 65534, the code `invalid`
+stands for nan, e.g. cells never read out before.
+The relative quantisation error is below 2.2e-4, less than the
+precision needed by the timelapse calibration, while the arrays take
+half the memory of float32.
+
+Codes are expanded back to float32 with a lookup table,
+only where the float values are needed, e.g. by the calibrations.
+'''
+import numpy as np
+
+compact_dtype = np.dtype('u2')
+min_delta_t = 1e-7
+max_delta_t = 1e5
+invalid = np.iinfo(compact_dtype).max
+
+_log_min = np.log(min_delta_t)
+_step = (np.log(max_delta_t) - _log_min) / (invalid - 1)
+
+_table = np.append(
+    np.exp(_log_min + _step * np.arange(invalid)),
+    np.nan,
+).astype('f4')
+_table.flags.writeable = False
+
+
+def is_compact(delta_t):
+    return delta_t is not None and delta_t.dtype == compact_dtype
+
+
+def compress(delta_t):
+    ''' quantise float delta_t into codes,
+    values are clipped to [min_delta_t, max_delta_t], nan becomes invalid
+    '''
+    delta_t = np.asarray(delta_t)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        codes = np.round((np.log(delta_t) - _log_min) / _step)
+    codes = np.clip(codes, 0, invalid - 1)
+    codes[np.isnan(codes)] = invalid
+    return codes.astype(compact_dtype)
+
+
+def expand(codes):
+    ''' return the float32 delta_t of codes '''
+    return _table.take(codes)
+
+
+def as_float(delta_t):
+    ''' return delta_t as float array, expanding it if it is compact '''
+    if is_compact(delta_t):
+        return expand(delta_t)
+    return delta_t
+
+
+def valid(delta_t):
+    ''' boolean mask of the samples with a known delta_t, for both forms '''
+    if is_compact(delta_t):
+        return delta_t != invalid
+    return np.logical_not(np.isnan(delta_t))
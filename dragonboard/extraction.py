@@ -0,0 +1,201 @@
+'''
+Pulse extraction on many time series at once.
+
+All functions take arrays of shape (..., roi), typically calibrated
+event blocks of shape (num_events, num_channels, num_gains, roi),
+and work along the last axis without python loops.
+The Extractor combines them into one step, that can be added to a
+CalibrationPipeline to get charge and time per channel.
+'''
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# result of an Extractor, one entry per time series
+features_dtype = np.dtype([
+    ('baseline', 'f4'),
+    ('amplitude', 'f4'),
+    ('peak_position', 'i2'),
+    ('charge', 'f4'),
+    ('window_start', 'i2'),
+    ('arrival_time', 'f4'),
+])
+
+
+def baseline(data, start=0, stop=20):
+    ''' mean of the samples start to stop '''
+    return data[..., start:stop].mean(axis=-1, dtype='f4')
+
+
+def peak(data, start=None, stop=None):
+    ''' return position and value of the maximum between start and stop
+
+    start and stop are clipped to the roi like slice indices,
+    raises a ValueError if no sample is left between them
+    '''
+    start, stop, _ = slice(start, stop).indices(data.shape[-1])
+    if stop <= start:
+        raise ValueError('The peak search window is empty for {} samples'.format(
+            data.shape[-1]
+        ))
+    position = start + np.argmax(data[..., start:stop], axis=-1)
+    amplitude = np.take_along_axis(data, position[..., np.newaxis], axis=-1)[..., 0]
+    return position, amplitude
+
+
+def window_sums(data, width):
+    ''' sums of all windows of width samples, shape (..., roi - width + 1)
+
+    calculated from the cumulative sum, so the cost does not depend on width
+    '''
+    cumsum = np.zeros(data.shape[:-1] + (data.shape[-1] + 1, ), dtype='f8')
+    np.cumsum(data, axis=-1, out=cumsum[..., 1:])
+    return cumsum[..., width:] - cumsum[..., :-width]
+
+
+def windows(data, start, width):
+    ''' cut out width samples beginning at start, which has the shape data.shape[:-1]
+
+    start is clipped, so that all windows are inside the roi
+    returns an array of shape (..., width)
+    '''
+    start = np.clip(start, 0, data.shape[-1] - width)
+    view = sliding_window_view(data, width, axis=-1)
+    return np.take_along_axis(view, start[..., np.newaxis, np.newaxis], axis=-2)[..., 0, :]
+
+
+def fixed_window_integral(data, start, width):
+    ''' sum of width samples beginning at start, start can be
+    a number or an array of shape data.shape[:-1], e.g. peak_position - width // 2.
+    start is clipped, so that all windows are inside the roi
+    '''
+    sums = window_sums(data, width)
+    start = np.clip(start, 0, sums.shape[-1] - 1)
+    start = np.broadcast_to(start, data.shape[:-1])
+    return np.take_along_axis(sums, start[..., np.newaxis], axis=-1)[..., 0]
+
+
+def sliding_window_integral(data, width, start=None, stop=None):
+    ''' maximum sum of width consecutive samples,
+    the windows start between start and stop
+
+    returns the start position of the window and the sum
+    '''
+    return peak(window_sums(data, width), start, stop)
+
+
+def arrival_time(data, peak_position, fraction=0.5):
+    ''' time where the rising edge before the peak crosses
+    fraction of the peak amplitude, linearly interpolated between samples
+
+    data should be baseline subtracted, nan if there is no crossing
+    '''
+    roi = data.shape[-1]
+    peak_position = np.asarray(peak_position)
+    amplitude = np.take_along_axis(data, peak_position[..., np.newaxis], axis=-1)
+    threshold = fraction * amplitude
+
+    # last sample before the peak below the threshold
+    below = (data < threshold) & (np.arange(roi) < peak_position[..., np.newaxis])
+    last_below = roi - 1 - np.argmax(below[..., ::-1], axis=-1)
+    found = below.any(axis=-1)
+    last_below[~found] = 0
+
+    index = last_below[..., np.newaxis]
+    before = np.take_along_axis(data, index, axis=-1)[..., 0].astype('f4')
+    after = np.take_along_axis(data, np.minimum(index + 1, roi - 1), axis=-1)[..., 0]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        time = last_below + (threshold[..., 0] - before) / (after - before)
+    return np.where(found, time, np.nan).astype('f4')
+
+
+class Extractor:
+    ''' Extract baseline, peak, charge and arrival time from calibrated data
+
+    Kwargs:
+        baseline_window: (start, stop) of the samples used for the baseline
+        search_window: (start, stop) of the samples searched for the peak
+        width: number of samples integrated
+        integration: one of
+            'peak': window centered around the peak
+            'fixed': window beginning at the sample `start`
+            'sliding': window with the maximum sum in the search window
+        start: start of the window for the 'fixed' integration
+        fraction: fraction of the amplitude used for the arrival time
+    '''
+
+    integration_methods = ('peak', 'fixed', 'sliding')
+
+    def __init__(
+            self,
+            baseline_window=(0, 20),
+            search_window=(None, None),
+            width=7,
+            integration='peak',
+            start=0,
+            fraction=0.5,
+            ):
+        if integration not in self.integration_methods:
+            raise ValueError('Unknown integration {!r}, use one of {}'.format(
+                integration, self.integration_methods
+            ))
+        # windows with indices of mixed sign can only be checked against the roi
+        start, stop = search_window
+        if None not in (start, stop) and (start < 0) == (stop < 0) and stop <= start:
+            raise ValueError('search_window {} is empty'.format(tuple(search_window)))
+        if width < 1:
+            raise ValueError('width must be at least 1, got {}'.format(width))
+
+        self.baseline_window = tuple(baseline_window)
+        self.search_window = tuple(search_window)
+        self.width = width
+        self.integration = integration
+        self.start = start
+        self.fraction = fraction
+
+    def __repr__(self):
+        return '{}(integration={!r}, width={})'.format(
+            self.__class__.__name__, self.integration, self.width
+        )
+
+    def __call__(self, data):
+        ''' return a structured array of shape data.shape[:-1] with
+        the fields of features_dtype
+        '''
+        roi = data.shape[-1]
+        if self.width > roi:
+            raise ValueError('width {} is larger than the roi {}'.format(self.width, roi))
+        # clip the search window to the roi, like slice indices
+        search_start, search_stop, _ = slice(*self.search_window).indices(roi)
+        if search_stop <= search_start:
+            raise ValueError('search_window {} has no samples in the roi of {}'.format(
+                self.search_window, roi
+            ))
+
+        features = np.empty(data.shape[:-1], dtype=features_dtype)
+
+        features['baseline'] = baseline(data, *self.baseline_window)
+        data = data - features['baseline'][..., np.newaxis]
+
+        position, amplitude = peak(data, search_start, search_stop)
+        features['peak_position'] = position
+        features['amplitude'] = amplitude
+
+        if self.integration == 'sliding':
+            # windows have to start in the search window and end in the roi
+            start, charge = sliding_window_integral(
+                data, self.width, search_start, min(search_stop, roi - self.width + 1)
+            )
+        else:
+            if self.integration == 'peak':
+                start = position - self.width // 2
+            else:
+                start = np.full(data.shape[:-1], self.start)
+            start = np.clip(start, 0, data.shape[-1] - self.width)
+            charge = fixed_window_integral(data, start, self.width)
+
+        features['window_start'] = start
+        features['charge'] = charge
+        features['arrival_time'] = arrival_time(data, position, self.fraction)
+
+        return features
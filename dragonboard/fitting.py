@@ -0,0 +1,222 @@
+'''
+Fit the timelapse dependence a * delta_t ** b + c of all cells at once.
+
+The samples of all channels are kept in three flat arrays,
+delta_t, adc_counts and the channel and cell of each sample, see `sort_samples`.
+For parallel fits these arrays and the result array of shape
+(num_channels, num_gains, max_roi, 4) are put into shared memory,
+so the worker processes only receive ranges of cells to fit and
+write their results directly into place.
+'''
+from multiprocessing import Pool, shared_memory
+import logging
+import os
+import numpy as np
+import pandas as pd
+from scipy.optimize import curve_fit
+from tqdm import tqdm
+
+from .io import gaintypes, max_roi, num_channels, num_gains
+from .calibration_bundle import bundle_extension, write_bundle
+from .delta_t import as_float
+
+log = logging.getLogger(__name__)
+
+# a, b, c, chisq_ndf
+result_columns = ['a', 'b', 'c', 'chisq_ndf']
+p0_default = (1.3, -0.38, 0)
+
+
+def f(x, a, b, c):
+    return a * x ** b + c
+
+
+def fit_cell(adc, delta_t, cell=None):
+    ''' fit a * delta_t ** b + c to the samples of one cell
+
+    returns a, b, c, chisquare / ndf,
+    if the fit fails, the start values and nan are returned
+    '''
+    if not len(adc):
+        return p0_default + (np.nan, )
+
+    adc = np.asarray(adc, dtype='f8')
+    delta_t = np.asarray(delta_t, dtype='f8')
+
+    big_time = np.percentile(delta_t, 75)
+    p0 = [
+        p0_default[0],
+        p0_default[1],
+        adc[delta_t >= big_time].mean(),
+    ]
+    try:
+        (a, b, c), cov = curve_fit(f, delta_t, adc, p0=p0)
+    except (RuntimeError, TypeError):
+        log.error('Could not fit cell {}'.format(cell))
+        return p0[0], p0[1], p0[2], np.nan
+
+    ndf = len(adc) - 3
+    residuals = adc - f(delta_t, a, b, c)
+    chisquare = np.sum(residuals**2) / ndf
+
+    return a, b, c, chisquare
+
+
+def sort_samples(channel, cell, delta_t, adc_counts):
+    ''' sort samples by channel and cell
+
+    Args:
+        channel: flat channel index of each sample, pixel * num_gains + gain
+        cell: physical cell of each sample
+
+    returns delta_t and adc_counts sorted and the arrays cell_start, cell_stop
+    of shape (num_channels, num_gains, max_roi), so the samples of a cell
+    are delta_t[cell_start[pixel, gain, cell]:cell_stop[pixel, gain, cell]]
+    '''
+    key = np.asarray(channel, dtype='i8') * max_roi + cell
+    order = np.argsort(key, kind='stable')
+
+    counts = np.bincount(key, minlength=num_channels * num_gains * max_roi)
+    cell_stop = np.cumsum(counts).reshape(num_channels, num_gains, max_roi)
+    cell_start = cell_stop - counts.reshape(cell_stop.shape)
+
+    return delta_t[order], adc_counts[order], cell_start, cell_stop
+
+
+_shared = {}
+
+
+def _to_shared(array):
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[...] = array
+    return shm, shared
+
+
+def _attach(specs):
+    ''' worker initializer, attach to the shared arrays '''
+    for key, (name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _shared[key] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+
+def _fit_range(task):
+    ''' fit the cells first to last of the flattened (pixel, gain, cell) index '''
+    first, last = task
+    delta_t = _shared['delta_t'][1]
+    adc_counts = _shared['adc_counts'][1]
+    cell_start = _shared['cell_start'][1].ravel()
+    cell_stop = _shared['cell_stop'][1].ravel()
+    result = _shared['result'][1].reshape(-1, len(result_columns))
+
+    for i in range(first, last):
+        start, stop = cell_start[i], cell_stop[i]
+        result[i] = fit_cell(
+            adc_counts[start:stop], as_float(delta_t[start:stop]), cell=i % max_roi
+        )
+
+    return last - first
+
+
+def fit_timelapse(
+        delta_t,
+        adc_counts,
+        cell_start,
+        cell_stop,
+        n_jobs=None,
+        chunksize=16,
+        progress=False,
+        ):
+    ''' fit all cells of all channels
+
+    Args:
+        delta_t, adc_counts, cell_start, cell_stop: see sort_samples,
+            delta_t may be compact, see dragonboard.delta_t,
+            it is expanded for one cell at a time
+
+    Kwargs:
+        n_jobs: number of worker processes, default is the number of cpus,
+            with n_jobs=1 the fits run in this process
+        chunksize: number of cells fitted per task,
+            the tasks are handed out to idle workers one after another
+        progress: show a progress bar
+
+    returns an array of shape (num_channels, num_gains, max_roi, 4)
+    with the columns a, b, c, chisq_ndf
+    '''
+    if n_jobs is None:
+        n_jobs = os.cpu_count()
+
+    arrays = {
+        'delta_t': np.ascontiguousarray(delta_t),
+        'adc_counts': np.ascontiguousarray(adc_counts),
+        'cell_start': np.ascontiguousarray(cell_start),
+        'cell_stop': np.ascontiguousarray(cell_stop),
+        'result': np.full(cell_start.shape + (len(result_columns), ), np.nan),
+    }
+    num_cells = cell_start.size
+    tasks = [
+        (first, min(first + chunksize, num_cells))
+        for first in range(0, num_cells, chunksize)
+    ]
+
+    with tqdm(total=num_cells, disable=not progress, unit=' cells') as pbar:
+        if n_jobs == 1:
+            _shared.update({key: (None, array) for key, array in arrays.items()})
+            try:
+                for task in tasks:
+                    pbar.update(_fit_range(task))
+            finally:
+                _shared.clear()
+            return arrays['result']
+
+        shms = {}
+        try:
+            specs = {}
+            for key, array in arrays.items():
+                shms[key], arrays[key] = _to_shared(array)
+                specs[key] = (shms[key].name, array.shape, array.dtype)
+
+            with Pool(n_jobs, initializer=_attach, initargs=(specs, )) as pool:
+                for num_fitted in pool.imap_unordered(_fit_range, tasks):
+                    pbar.update(num_fitted)
+
+            return arrays['result'].copy()
+        finally:
+            # views into the shared memory must be gone before closing it
+            arrays.clear()
+            for shm in shms.values():
+                shm.close()
+                shm.unlink()
+
+
+def result_to_dataframe(result, pixels=range(num_channels)):
+    ''' convert the result of fit_timelapse into the table format
+    of the calibration files, columns a, b, c, chisq_ndf, pixel, channel, cell
+    '''
+    dfs = []
+    for pixel in pixels:
+        for gain, channel in enumerate(gaintypes):
+            df = pd.DataFrame(result[pixel, gain], columns=result_columns)
+            df['pixel'] = pixel
+            df['channel'] = channel
+            df['cell'] = np.arange(max_roi)
+            dfs.append(df)
+    return pd.concat(dfs, ignore_index=True)
+
+
+def write_result(path, result, pixels=range(num_channels), **metadata):
+    ''' write the result of fit_timelapse,
+    as calibration bundle if path ends with the bundle extension,
+    else as hdf5 table, see result_to_dataframe.
+    kwargs are stored as metadata of the bundle
+    '''
+    if path.endswith(bundle_extension):
+        arrays = {
+            name: result[..., i].astype('f4') for i, name in enumerate(result_columns)
+        }
+        write_bundle(path, 'timelapse', arrays, **metadata)
+        return
+
+    with pd.HDFStore(path, 'w') as store:
+        store.append('data', result_to_dataframe(result, pixels), min_itemsize={'channel': 4})
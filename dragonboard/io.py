@@ -1,9 +1,15 @@
 import struct
+import mmap
 import numpy as np
 from collections import namedtuple
+from collections.abc import Sequence
 import os.path
+import time
 import warnings
 
+from .profiling import PipelineStats
+from .delta_t import compress as compress_delta_t, compact_dtype
+
 stop_cell_map = {
     ("high", 0): 0,
     ("high", 1): 0,
@@ -29,10 +35,175 @@ num_channels = 8
 num_gains = 2
 adc_word_size = 2
 
+# The layout of an Event depends on the layout option of the generator:
+#   'structured' (default):
+#       data: structured array of shape (num_channels, ) with the fields
+#             'low' and 'high', each of length roi
+#       header.stop_cells: structured array of shape (num_channels, ), stop_cells_dtype
+#       time_since_last_readout: like data, float32
+#   'flat':
+#       data: contiguous array of shape (num_channels, num_gains, roi),
+#             gains in the order of gaintypes, like an EventBlock without the event axis
+#       header.stop_cells: array of shape (num_channels, num_gains)
+#       time_since_last_readout: array like data, float32
+# so that structured.data[pixel][gain] == flat.data[pixel, gaintypes.index(gain)],
+# use to_flat and to_structured to convert events.
 Event = namedtuple(
     'Event', ['header', 'roi', 'data', 'time_since_last_readout']
 )
 
+# stop cells of one event in user order, shape (num_channels, )
+stop_cells_dtype = np.dtype([('low', 'i2'), ('high', 'i2')])
+
+# many events at once:
+# headers: structured array, see AbstractEventGenerator.read_headers
+# data: (num_events, num_channels, num_gains, roi), gains in the order of gaintypes
+# time_since_last_readout: same shape as data or None
+EventBlock = namedtuple(
+    'EventBlock', ['headers', 'roi', 'data', 'time_since_last_readout']
+)
+
+
+# index of the stop cell word of each (pixel, gain) as stored in the event header,
+# gains ordered like gaintypes, so words[stop_cell_index] is in user order
+stop_cell_index = np.array([
+    [stop_cell_map[(gain, pixel)] for gain in gaintypes]
+    for pixel in range(num_channels)
+])
+
+
+def decode_stop_cells(words):
+    ''' convert the stop cell words in drs4 chip order into user order
+
+    words has shape (8, ) for one event or (num_events, 8) for many,
+    e.g. the stop_cells field of a header memmap.
+    returns a structured array with the fields of stop_cells_dtype
+    of shape (num_channels, ) or (num_events, num_channels)
+    '''
+    words = np.asarray(words)
+    stop_cells = np.take(words, stop_cell_index, axis=-1).astype('i2')
+    return stop_cells.view(stop_cells_dtype)[..., 0]
+
+
+def stop_cells_to_array(stop_cells):
+    ''' convert stop cells with the fields ('low', 'high')
+    e.g. of shape (num_channels, ) or (num_events, num_channels)
+    into an array with an additional gain axis, gains ordered like gaintypes
+    '''
+    return np.stack([stop_cells[gain] for gain in gaintypes], axis=-1)
+
+
+def structured_to_array(structured):
+    ''' view an array with the fields ('low', 'high')
+    as plain array with an additional gain axis,
+    e.g. adc data of shape (8, ) with fields of length roi
+    becomes an array of shape (8, 2, roi).
+    '''
+    field_dtype = structured.dtype[0]
+    return structured.view(field_dtype.base).reshape(
+        structured.shape + (len(structured.dtype.names), ) + field_dtype.shape
+    )
+
+
+def array_to_structured(array):
+    ''' inverse of structured_to_array, the gain axis is the last one
+    for e.g. stop cells and the second to last for time series
+    '''
+    array = np.ascontiguousarray(array)
+    if array.shape[-1] == num_gains:
+        dtype = [(gain, array.dtype) for gain in gaintypes]
+        return array.view(dtype).reshape(array.shape[:-1])
+
+    roi = array.shape[-1]
+    dtype = [(gain, array.dtype, roi) for gain in gaintypes]
+    return array.reshape(array.shape[:-2] + (-1, )).view(dtype).reshape(array.shape[:-2])
+
+
+def _optional(convert, array):
+    ''' time_since_last_readout is None for generators without delta_t '''
+    return None if array is None else convert(array)
+
+
+def to_flat(event):
+    ''' convert an event of the structured layout into the flat layout '''
+    if event.data.dtype.names is None:
+        return event
+    return event._replace(
+        header=event.header._replace(stop_cells=stop_cells_to_array(event.header.stop_cells)),
+        data=np.ascontiguousarray(structured_to_array(event.data)),
+        time_since_last_readout=_optional(structured_to_array, event.time_since_last_readout),
+    )
+
+
+def to_structured(event):
+    ''' convert an event of the flat layout into the structured layout '''
+    if event.data.dtype.names is not None:
+        return event
+    return event._replace(
+        header=event.header._replace(
+            stop_cells=array_to_structured(event.header.stop_cells.astype('i2'))
+        ),
+        data=array_to_structured(event.data),
+        time_since_last_readout=_optional(array_to_structured, event.time_since_last_readout),
+    )
+
+
+class BrokenEventError(IOError):
+    ''' raised if an event header does not look like a valid header
+
+    event is the index of the broken event, if known
+    '''
+
+    def __init__(self, message, event=None):
+        super().__init__(message)
+        self.event = event
+
+
+class IntegrityReport(namedtuple('IntegrityReport', [
+        'path',
+        'event_size',
+        'offsets',
+        'skipped',
+        'truncated_bytes',
+        'counter_gaps',
+        'timestamp_jumps',
+        ])):
+    ''' result of AbstractEventGenerator.scan
+
+    offsets: byte offsets of all valid events, the valid-event index
+    skipped: list of (start, stop) byte ranges that do not belong to a valid event
+    truncated_bytes: number of bytes at the end of the file not forming a whole event
+    counter_gaps: indices into offsets, where the event counter does not increase by one
+    timestamp_jumps: indices into offsets, where the clock decreases
+    '''
+
+    @property
+    def num_events(self):
+        return len(self.offsets)
+
+    @property
+    def ok(self):
+        return not (
+            self.skipped or self.truncated_bytes
+            or len(self.counter_gaps) or len(self.timestamp_jumps)
+        )
+
+    def summary(self):
+        ''' return a compact human readable report '''
+        lines = [
+            '{}: {}'.format(self.path, 'ok' if self.ok else 'PROBLEMS FOUND'),
+            '  valid events ....: {}'.format(self.num_events),
+            '  skipped ranges ..: {} ({} bytes)'.format(
+                len(self.skipped), sum(stop - start for start, stop in self.skipped)
+            ),
+            '  truncated bytes .: {}'.format(self.truncated_bytes),
+            '  counter gaps ....: {}'.format(len(self.counter_gaps)),
+            '  clock jumps back : {}'.format(len(self.timestamp_jumps)),
+        ]
+        for start, stop in self.skipped[:5]:
+            lines.append('  skipped bytes {} to {}'.format(start, stop))
+        return '\n'.join(lines)
+
 
 def assign_from_rolled_source(source, destination, roll_by):
     """ do the same as
@@ -50,23 +221,263 @@ def assign_from_rolled_source(source, destination, roll_by):
 
     return destination
 
-def read(path, max_events=None):
-    ''' return list of Events in file path '''
-    return list(EventGenerator(path, max_events=None))
+def read(path, max_events=None, chunk_size=100, delta_t=True, **kwargs):
+    ''' return the Events in file path as lazy sequence, see EventSequence
+
+    Only chunk_size events are in memory at once, use read_array
+    to load the data of all events into one array.
+    '''
+    return EventSequence(
+        path, max_events=max_events, chunk_size=chunk_size, delta_t=delta_t, **kwargs
+    )
+
+
+def read_array(path, max_events=None, dtype='i2', delta_t=False, block_size=1000, **kwargs):
+    ''' read all events in file path into one EventBlock
+
+    The arrays for the headers, the adc data of shape
+    (num_events, num_channels, num_gains, roi) and, if delta_t is True,
+    time_since_last_readout are allocated once with their final size
+    and filled block by block, see AbstractEventGenerator.next_block,
+    so the memory needed is the size of the result plus one block.
+    Without delta_t, this is about the size of the file for dtype 'i2',
+    with compact_delta_t=True, see EventGenerator, delta_t adds the same again.
+    kwargs are passed to EventGenerator.
+    '''
+    generator = EventGenerator(path, max_events=max_events, dtype=dtype, **kwargs)
+    num_events = generator.max_events
+    shape = (num_events, num_channels, num_gains, generator.roi)
+
+    headers = np.empty(num_events, dtype=generator.header_dtype)
+    data = np.empty(shape, dtype=generator.dtype.newbyteorder('='))
+    time_since_last_readout = None
+    if delta_t:
+        dt_dtype = compact_dtype if generator.compact_delta_t else 'f4'
+        time_since_last_readout = np.empty(shape, dtype=dt_dtype)
+
+    start = 0
+    for block in generator.iter_blocks(block_size, delta_t=delta_t):
+        stop = start + len(block.headers)
+        headers[start:stop] = block.headers
+        data[start:stop] = block.data
+        if delta_t:
+            time_since_last_readout[start:stop] = block.time_since_last_readout
+        start = stop
+
+    return EventBlock(headers, generator.roi, data, time_since_last_readout)
+
+
+def read_headers(path, max_events=None, version=None, **kwargs):
+    ''' return the headers of all events in file path as structured array
+
+    see AbstractEventGenerator.read_headers
+    '''
+    return EventHeaderGenerator(path, max_events, version=version, **kwargs).read_headers()
+
+
+def scan(path, version=None):
+    ''' check the integrity of file path and return an IntegrityReport
+
+    see AbstractEventGenerator.scan
+    '''
+    return EventHeaderGenerator(path, version=version).scan()
+
+
+class EventSequence(Sequence):
+    ''' The events of a file as a lazy sequence
+
+    Events are read on access in chunks of chunk_size events,
+    only the last chunk is kept in memory.
+    Slicing returns a new lazy EventSequence, so e.g.
+    `read(path)[1000:2000:10]` reads only the needed chunks.
+
+    The time_since_last_readout of an event depends on all events before it,
+    so accessing an event before the current chunk reads the headers
+    of all events up to it again. Without delta_t, time_since_last_readout
+    is None and events can be accessed in any order at the same cost.
+    kwargs are passed to EventGenerator.
+    '''
+
+    def __init__(self, path, max_events=None, chunk_size=100, delta_t=True, **kwargs):
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be at least 1, got {}'.format(chunk_size))
+
+        self.path = path
+        self.chunk_size = chunk_size
+        self.delta_t = delta_t
+        self.kwargs = kwargs
+
+        self._generator = EventGenerator(path, max_events, delta_t=delta_t, **kwargs)
+        self.max_events = self._generator.max_events
+        self.roi = self._generator.roi
+        self._indices = range(self.max_events)
+        self._chunk_start = None
+        self._chunk = []
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __repr__(self):
+        return '{}({!r}, num_events={}, chunk_size={}, delta_t={})'.format(
+            self.__class__.__name__, self.path, len(self), self.chunk_size, self.delta_t,
+        )
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            view = self.__class__.__new__(self.__class__)
+            view.__dict__.update(self.__dict__)
+            view._indices = self._indices[key]
+            view._generator = None
+            view._chunk_start = None
+            view._chunk = []
+            return view
+
+        return self._event(self._indices[key])
+
+    def __iter__(self):
+        for index in self._indices:
+            yield self._event(index)
+
+    def _event(self, index):
+        ''' return the event at position index in the file '''
+        start = self._chunk_start
+        if start is None or not start <= index < start + len(self._chunk):
+            self._read_chunk(index)
+        return self._chunk[index - self._chunk_start]
+
+    def _read_chunk(self, first):
+        # release the old chunk before reading the next one
+        self._chunk = []
+
+        generator = self._generator
+        if generator is None or (self.delta_t and generator.event_counter > first):
+            # last_seen has to be replayed from the first event
+            generator = self._generator = EventGenerator(
+                self.path, self.max_events, delta_t=self.delta_t, **self.kwargs
+            )
+        elif generator.event_counter > first:
+            # without delta_t, going back is only a seek,
+            # with resync, next seeks to the event offset itself
+            generator.event_counter = first
+            if generator._event_offsets is None:
+                generator.file_descriptor.seek(first * generator.event_size)
+        generator.skip_events(first - generator.event_counter)
+
+        num_events = min(self.chunk_size, self.max_events - first)
+        self._chunk = [generator.next() for _ in range(num_events)]
+        self._chunk_start = first
+
+
+def decode_adc(adc_data, roi, dtype='i2'):
+    ''' decode the raw adc words of one or many events
+
+    adc_data has shape (num_gains * num_channels * roi, ) for a single event
+    or (num_events, num_gains * num_channels * roi) for many events.
+    The first half of an event holds the even pixels, the second half the odd.
+    Each half is ordered by sample, then by pairs of pixels and then
+    by gain with the high gain first.
+
+    This is a single reshape and transpose, the only copy is the
+    conversion to dtype at the end.
+
+    returns an array of shape (num_channels, num_gains, roi)
+    or (num_events, num_channels, num_gains, roi)
+    with the gains in the order of gaintypes
+    '''
+    adc_data = np.asarray(adc_data)
+    shape = adc_data.shape[:-1]
+    # (event, odd pixel, sample, pixel pair, gain)
+    adc = adc_data.reshape(shape + (2, roi, num_channels // 2, num_gains))
+    # high gain is stored first, gaintypes has low gain first
+    adc = adc[..., ::-1]
+    # (event, pixel pair, odd pixel, gain, sample)
+    axes = tuple(range(len(shape)))
+    adc = adc.transpose(axes + tuple(len(shape) + i for i in (2, 0, 3, 1)))
+    return adc.reshape(shape + (num_channels, num_gains, roi)).astype(dtype)
 
 
 class AbstractEventGenerator(object):
     header_size = None
     Event = Event
 
-    def __init__(self, path, max_events=None):
+    def __init__(
+            self,
+            path,
+            max_events=None,
+            profile=False,
+            resync=False,
+            follow=False,
+            poll_interval=0.1,
+            timeout=None,
+            dtype='>i2',
+            layout='structured',
+            delta_t=True,
+            compact_delta_t=False,
+            ):
+        ''' iterate over the events in the file at path
+
+        *layout* is either 'structured' or 'flat', see the documentation
+        of Event for the difference.
+
+        *dtype* is the data type of the adc data of the events.
+        The file stores big endian int16, the default '>i2' keeps that,
+        use 'i2' or 'f4' to byteswap once while decoding,
+        so later arithmetic works on native data.
+        Event blocks, see `next_block`, always hold native data,
+        int16 for the default.
+
+        If *delta_t* is False, time_since_last_readout is not calculated
+        and None for all events, saving the bookkeeping of the last
+        readout of every cell. It is also the default for `next_block`.
+
+        If *compact_delta_t* is True, time_since_last_readout is
+        log-quantised uint16 instead of float32, see dragonboard.delta_t.
+        The calibrations expand it to float when they need it.
+
+        If *profile* is True, the time spent in each stage of
+        the event decoding is recorded, see `stats`.
+
+        If *resync* is True, the file is scanned for broken events first,
+        see `scan`, and only the valid events are returned.
+
+        If *follow* is True, the file is expected to be still written,
+        like `tail -f`. When all complete events are read, the file size is
+        checked every *poll_interval* seconds until new complete events
+        are available. Iteration stops after *timeout* seconds
+        without new events (never, if timeout is None) or after max_events.
+        The file needs to contain at least two events when the
+        generator is created, so the event size can be determined.
+        '''
+        if follow and resync:
+            raise ValueError('follow and resync cannot be used together')
+
         self.path = os.path.realpath(path)
+        self.follow = follow
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self._requested_max_events = max_events
+        self.dtype = np.dtype(dtype)
+        if self.dtype.kind not in 'iuf':
+            raise ValueError('dtype must be numeric, got {}'.format(self.dtype))
+        if layout not in ('structured', 'flat'):
+            raise ValueError('layout must be "structured" or "flat", got {!r}'.format(layout))
+        self.layout = layout
+        self.delta_t = delta_t
+        self.compact_delta_t = compact_delta_t
 
         self.file_descriptor = open(self.path, "rb")
 
         self.event_size = self.guess_event_size()
         self.roi = self.calc_roi()
-        self.num_events = self.calc_num_events()
+        self._event_offsets = None
+        if resync:
+            report = self.scan()
+            if not report.ok:
+                warnings.warn('\n' + report.summary())
+            self._event_offsets = report.offsets
+            self.num_events = report.num_events
+        else:
+            self.num_events = self.calc_num_events()
         if max_events is None or max_events > len(self):
             self.max_events = len(self)
         else:
@@ -74,16 +485,42 @@ class AbstractEventGenerator(object):
 
         self.event_counter = 0
 
-        self.last_seen = np.full(
-            num_channels,
-            np.nan,
-            dtype=[
-                ("low", 'f4', max_roi),
-                ("high", 'f4', max_roi),
-            ]
-        )
+        # clock ticks of the last readout of every cell, -1 for never
+        self.last_seen = np.full((num_channels, num_gains, max_roi), -1, dtype='i8')
+        # index of the readout cells of each channel into the flat last_seen,
+        # _readout_cells[stop_cells] + _channel_offsets, see _update_last_seen
+        from .utils import sample2cell_table
+        self._readout_cells = sample2cell_table(self.roi)
+        self._channel_offsets = (
+            np.arange(num_channels * num_gains) * max_roi
+        ).reshape(num_channels, num_gains, 1)
         self._alarm_previous_was_called = False
 
+        self._stats = PipelineStats()
+        if profile:
+            # stage name: method, read_block and decode_adc are the stages of next_block
+            stages = {
+                'read_header': 'read_header',
+                'read_adc_data': 'read_adc_data',
+                'read_block': '_read_block',
+                'decode_adc': '_decode_block',
+                '_update_last_seen': '_update_last_seen',
+            }
+            for stage, method in stages.items():
+                setattr(self, method, self._stats.wrap(stage, getattr(self, method)))
+
+    def stats(self):
+        ''' return the PipelineStats of this generator
+
+        Events and bytes read are always counted, the per stage timings
+        are only available if the generator was created with profile=True.
+        bytes_read counts the headers and adc data read from the file,
+        including headers read from the memory map, e.g. by `skip_events`.
+        Further stages, e.g. calibrations, can be added using `stats().wrap`
+        '''
+        self._stats.events = self.event_counter
+        return self._stats
+
     def __repr__(self):
         return(
             "{name}(\n"
@@ -130,19 +567,286 @@ class AbstractEventGenerator(object):
         raise NotImplementedError
 
     def _read_stop_cells(self):
-        stop_cell_dtype = np.dtype('uint16').newbyteorder('>')
-        stop_cell_size = 8 * stop_cell_dtype.itemsize
+        stop_cell_dtype = np.dtype('>u2')
+        words = np.frombuffer(
+            self.file_descriptor.read(8 * stop_cell_dtype.itemsize), dtype=stop_cell_dtype
+        )
+        return decode_stop_cells(words)
+
+    def read_stop_cells(self):
+        ''' return the stop cells of the first max_events events
 
-        stop_cells_for_user = np.empty(
-            num_channels, dtype=[('low', 'i2'), ('high', 'i2')]
+        The stop cells are decoded from a memory map of the headers,
+        without reading the rest of the headers or the adc data.
+        returns a structured array of shape (num_events, num_channels)
+        with the fields of stop_cells_dtype or, for the flat layout,
+        an array of shape (num_events, num_channels, num_gains)
+        '''
+        raw = self._raw_headers(0, self.max_events)
+        stop_cells = decode_stop_cells(raw['stop_cells'])
+        if self.layout == 'flat':
+            return stop_cells_to_array(stop_cells)
+        return stop_cells
+
+    def _header_memmap(self, num_events, first_event=0):
+        ''' memory map the headers of num_events events starting at first_event
+
+        The dtype covers a whole event, with the adc data as opaque void field,
+        so reading the header fields only touches the header bytes.
+        '''
+        return self._header_memmap_at(num_events, first_event * self.event_size)
+
+    def _header_memmap_at(self, num_events, offset):
+        ''' memory map the headers of num_events events starting at byte offset '''
+        dtype = np.dtype(self.raw_header_dtype + [
+            ('adc_data', 'V{}'.format(self.event_size - self.header_size)),
+        ])
+        if num_events == 0:
+            return np.empty(0, dtype=dtype)
+
+        return np.memmap(
+            self.path,
+            dtype=dtype,
+            mode='r',
+            offset=offset,
+            shape=(num_events, ),
         )
-        stop_cells__in_drs4_chip_order = np.frombuffer(
-            self.file_descriptor.read(stop_cell_size), dtype=stop_cell_dtype)
 
-        for g, p in stop_cell_map:
-            chip = stop_cell_map[(g, p)]
-            stop_cells_for_user[g][p] = stop_cells__in_drs4_chip_order[chip]
-        return stop_cells_for_user
+    def read_headers(self):
+        ''' return the headers of the first max_events events as structured array
+
+        The array has one field per field of the EventHeader of this version,
+        stop_cells is in user order with shape (num_events, num_channels)
+        like the stop_cells of a single header.
+        The headers are read directly from a memory map of the file,
+        without touching the adc data.
+        Raises a BrokenEventError for headers with wrong markers, like `read_header`.
+        '''
+        return self._headers_from_raw(self._raw_headers(0, self.max_events))
+
+    def _raw_headers(self, first_event, num_events):
+        ''' return the raw headers of num_events events starting at first_event '''
+        if self._event_offsets is None:
+            raw = self._header_memmap(num_events, first_event)
+        else:
+            raw_dtype = np.dtype(self.raw_header_dtype)
+            data = np.memmap(self.path, dtype='u1', mode='r')
+            offsets = self._event_offsets[first_event:first_event + num_events]
+            index = offsets[:, np.newaxis] + np.arange(raw_dtype.itemsize)
+            raw = data[index].view(raw_dtype)[:, 0]
+
+        self._stats.bytes_read += len(raw) * self.header_size
+        return raw
+
+    def _headers_from_raw(self, raw, first_event=0, check=True):
+        ''' convert raw headers as stored in the file to header_dtype
+
+        first_event is the index of the first header, for the error message
+        raised if a header has wrong markers. With check=False, the markers
+        are not checked, e.g. for headers already validated by `scan`.
+        '''
+        valid = self._valid_headers(raw) if check else True
+        if not np.all(valid):
+            event = first_event + int(np.argmin(valid))
+            raise BrokenEventError(
+                'Event {} of {} has a broken header'.format(event, self.path),
+                event=event,
+            )
+
+        headers = np.empty(len(raw), dtype=self.header_dtype)
+        for name in headers.dtype.names:
+            if name in raw.dtype.names and name != 'stop_cells':
+                headers[name] = raw[name]
+
+        headers['timestamp'] = self._timestamp(raw[self.clock_field])
+
+        headers['stop_cells'] = decode_stop_cells(raw['stop_cells'])
+
+        return headers
+
+    def _valid_headers(self, raw):
+        ''' return a boolean array, True for raw headers with correct markers '''
+        raise NotImplementedError
+
+    def _find_next_header(self, data, start):
+        ''' return the offset of the next valid header in data at or after start
+
+        data is a memory map of the whole file, returns None if there is none
+        '''
+        marker, marker_offset = self.header_marker
+        raw_dtype = np.dtype(self.raw_header_dtype)
+        position = data.find(marker, start + marker_offset)
+        while position != -1:
+            header_start = position - marker_offset
+            header_bytes = data[header_start:header_start + raw_dtype.itemsize]
+            if header_start >= start and len(header_bytes) == raw_dtype.itemsize:
+                if self._valid_headers(np.frombuffer(header_bytes, raw_dtype))[0]:
+                    return header_start
+            position = data.find(marker, position + 1)
+        return None
+
+    def scan(self):
+        ''' check the integrity of the file and return an IntegrityReport
+
+        The headers are checked for their markers in a vectorized way
+        using a memory map of consecutive events.
+        If a broken header is found, the file is searched for the next
+        valid header and the check continues from there.
+        If the next valid header starts inside the previous event,
+        this event was truncated and is also treated as broken.
+        '''
+        filesize = os.path.getsize(self.path)
+        offsets = []
+        counters = []
+        clocks = []
+        skipped = []
+        truncated_bytes = 0
+
+        with open(self.path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            position = 0
+            while True:
+                num_events = (filesize - position) // self.event_size
+                raw = self._header_memmap_at(num_events, position)
+
+                valid = self._valid_headers(raw)
+                first_broken = np.argmin(valid) if not np.all(valid) else num_events
+
+                offsets.append(position + np.arange(first_broken) * self.event_size)
+                counters.append(np.array(raw['event_counter'][:first_broken]))
+                clocks.append(np.array(raw[self.clock_field][:first_broken]))
+
+                if first_broken == num_events:
+                    truncated_bytes = filesize - position - num_events * self.event_size
+                    break
+
+                broken_start = position + first_broken * self.event_size
+
+                # the next header might start inside of the last event that looked valid
+                search_start = broken_start
+                if first_broken > 0:
+                    search_start = broken_start - self.event_size + 1
+
+                next_header = self._find_next_header(data, search_start)
+                if next_header is None:
+                    skipped.append((broken_start, filesize))
+                    break
+
+                if next_header < broken_start:
+                    offsets[-1] = offsets[-1][:-1]
+                    counters[-1] = counters[-1][:-1]
+                    clocks[-1] = clocks[-1][:-1]
+                    broken_start -= self.event_size
+
+                skipped.append((broken_start, next_header))
+                position = next_header
+        finally:
+            data.close()
+
+        counters = np.concatenate(counters).astype('i8')
+        clocks = np.concatenate(clocks)
+
+        return IntegrityReport(
+            path=self.path,
+            event_size=self.event_size,
+            offsets=np.concatenate(offsets),
+            skipped=skipped,
+            truncated_bytes=truncated_bytes,
+            counter_gaps=np.flatnonzero(np.diff(counters) != 1) + 1,
+            timestamp_jumps=np.flatnonzero(clocks[1:] < clocks[:-1]) + 1,
+        )
+
+    def next_block(self, max_events, delta_t=None):
+        ''' read up to max_events events at once and return an EventBlock
+
+        The adc data of all events is decoded together into a native
+        array of shape (num_events, num_channels, num_gains, roi),
+        int16 or the native version of the generator's dtype,
+        which is much faster than decoding event by event.
+        In follow mode, this returns as soon as at least one new event
+        is available.
+
+        If delta_t is False, time_since_last_readout is not calculated
+        and last_seen is not updated, so later events will have
+        wrong time_since_last_readout values.
+        The default is the delta_t option of the generator.
+
+        Raises a BrokenEventError if a header of the block has wrong markers,
+        like `next`, use resync to skip broken events.
+        '''
+        if delta_t is None:
+            delta_t = self.delta_t
+
+        if not self._has_next():
+            raise StopIteration
+
+        num_events = min(max_events, self.max_events - self.event_counter)
+        raw, headers = self._read_block(num_events)
+        data = self._decode_block(raw)
+
+        time_since_last_readout = None
+        if delta_t:
+            time_since_last_readout = np.empty(data.shape, dtype='f4')
+            for i, header in enumerate(headers):
+                time_since_last_readout[i] = self._update_last_seen(self.EventHeader(*header))
+            if self.compact_delta_t:
+                time_since_last_readout = compress_delta_t(time_since_last_readout)
+
+        self.event_counter += num_events
+        return EventBlock(headers, self.roi, data, time_since_last_readout)
+
+    def _read_block(self, num_events):
+        ''' read the next num_events events, return the raw events and their headers '''
+        event_dtype = np.dtype(self.raw_header_dtype + [
+            ('adc_data', '>i2', num_gains * num_channels * self.roi),
+        ])
+
+        f = self.file_descriptor
+        if self._event_offsets is None:
+            buffer = f.read(num_events * self.event_size)
+        else:
+            chunks = []
+            for offset in self._event_offsets[self.event_counter:self.event_counter + num_events]:
+                f.seek(offset)
+                chunks.append(f.read(self.event_size))
+            buffer = b''.join(chunks)
+        self._stats.bytes_read += len(buffer)
+
+        raw = np.frombuffer(buffer, dtype=event_dtype)
+        # with resync, only events with valid headers are read
+        headers = self._headers_from_raw(
+            raw, self.event_counter, check=self._event_offsets is None
+        )
+        return raw, headers
+
+    def _decode_block(self, raw):
+        return decode_adc(raw['adc_data'], self.roi, self.dtype.newbyteorder('='))
+
+    def skip_events(self, num_events):
+        ''' skip num_events events, reading only their headers
+
+        last_seen is updated, so the time_since_last_readout
+        of the following events is the same as without skipping.
+        '''
+        num_events = min(num_events, self.max_events - self.event_counter)
+        if self.delta_t:
+            raw = self._raw_headers(self.event_counter, num_events)
+            for header in self._headers_from_raw(raw, self.event_counter):
+                self._update_last_seen(self.EventHeader(*header))
+
+        self.event_counter += num_events
+        if self._event_offsets is None:
+            self.file_descriptor.seek(self.event_counter * self.event_size)
+
+    def iter_blocks(self, block_size=1000, delta_t=None):
+        ''' iterate over the remaining events in EventBlocks, see next_block '''
+        while True:
+            try:
+                yield self.next_block(block_size, delta_t=delta_t)
+            except StopIteration:
+                return
 
     def read_chunk(self):
         N = self.header_size + max_roi * adc_word_size * num_gains * num_channels
@@ -164,92 +868,133 @@ class AbstractEventGenerator(object):
         return self.next()
 
     def _update_last_seen(self, event_header):
+        ''' return the time since the last readout of all samples of this event
+        as float32 array of shape (num_channels, num_gains, roi), nan for cells
+        not read out before, and mark the cells read out by this event as seen.
+
+        last_seen holds integer clock ticks, so the differences are exact
+        independent of the run time and only converted to seconds at the end.
+        '''
         stopcell_readout_window_length = 12
         assert self.roi >= stopcell_readout_window_length
 
-        time_since_last_readout = np.full(
-            num_channels,
-            np.nan,
-            dtype=[
-                ("low", 'f4', self.roi),
-                ("high", 'f4', self.roi),
-            ]
-        )
         if self._alarm_previous_was_called:
-            return time_since_last_readout
-
-        now = event_header.timestamp
-
-        for g, p in stop_cell_map:
-            sc = event_header.stop_cells[g][p]
-            sc_1024 = sc % 1024
-            sc_channel = sc // 1024
-
-            assign_from_rolled_source(
-                destination=time_since_last_readout[g][p],
-                source=now - self.last_seen[g][p],
-                roll_by=sc)
-
-            # Under certain conditions cells get clocked out of the DRS but are not digitized,
-            # this is a side effect of reading out the stopcell position.
-            # Often this coincides with cells, which are digitized anyway,
-            # but sometimes additional cells are clocked out,
-            # so their "last_seen" needs to be set to "now"
-            # even though they were not digitized.
-            # c.f. https://www.dropbox.com/s/dub2rrydllkqyl5/DRSreadoutproc.pptx?dl=0
-            if p % 2 == 0:
-                if sc_1024 >= 767:
-                    self.last_seen[g][p][(sc+1024)%max_roi:(sc+1024)%max_roi+stopcell_readout_window_length] = now
-                if sc_1024 > 1024 - self.roi:
-                    self.last_seen[g][p][sc_channel * 1024] = now
-
-            cells = (np.arange(self.roi) + sc) % max_roi
-            self.last_seen[g][p][cells] = now
+            return np.full((num_channels, num_gains, self.roi), np.nan, dtype='f4')
+
+        now = np.int64(getattr(event_header, self.clock_field))
+        stop_cells = event_header.stop_cells
+        if stop_cells.dtype.names is not None:
+            stop_cells = stop_cells_to_array(stop_cells)
+        stop_cells = stop_cells.astype('i8')
+
+        index = self._readout_cells[stop_cells] + self._channel_offsets
+        last_seen = self.last_seen.take(index)
+        # the difference is exact, float32 is only used for the result
+        time_since_last_readout = self._timestamp((now - last_seen).astype('f4'))
+        time_since_last_readout[last_seen < 0] = np.nan
+
+        # Under certain conditions cells get clocked out of the DRS but are not digitized,
+        # this is a side effect of reading out the stopcell position.
+        # Often this coincides with cells, which are digitized anyway,
+        # but sometimes additional cells are clocked out,
+        # so their "last_seen" needs to be set to "now"
+        # even though they were not digitized.
+        # This only happens for the even pixels, which read out the stop cell.
+        # c.f. https://www.dropbox.com/s/dub2rrydllkqyl5/DRSreadoutproc.pptx?dl=0
+        even = (np.arange(num_channels) % 2 == 0)[:, np.newaxis]
+        stop_cells_1024 = stop_cells % 1024
+
+        window = (
+            ((stop_cells + 1024) % max_roi)[..., np.newaxis]
+            + np.arange(stopcell_readout_window_length)
+        )
+        in_window = (even & (stop_cells_1024 >= 767))[..., np.newaxis] & (window < max_roi)
+        pixel, gain, _ = np.nonzero(in_window)
+        self.last_seen[pixel, gain, window[in_window]] = now
+
+        first_cell = even & (stop_cells_1024 > 1024 - self.roi)
+        pixel, gain = np.nonzero(first_cell)
+        self.last_seen[pixel, gain, (stop_cells - stop_cells_1024)[first_cell]] = now
+
+        self.last_seen.put(index, now)
 
         return time_since_last_readout
 
+    def _wait_for_events(self):
+        ''' in follow mode, wait until the next event is completely written
+
+        return False if max_events is reached or the timeout expired
+        '''
+        if not self.follow:
+            return False
+
+        requested = self._requested_max_events
+        if requested is not None and self.event_counter >= requested:
+            return False
+
+        waiting_since = time.monotonic()
+        while True:
+            num_events = os.fstat(self.file_descriptor.fileno()).st_size // self.event_size
+            if num_events > self.num_events:
+                self.num_events = num_events
+                self.max_events = num_events if requested is None else min(requested, num_events)
+                return True
+
+            if self.timeout is not None and time.monotonic() - waiting_since > self.timeout:
+                return False
+
+            time.sleep(self.poll_interval)
+
+    def _has_next(self):
+        return self.event_counter < self.max_events or self._wait_for_events()
+
     def next(self):
-        if self.event_counter >= self.max_events:
+        if not self._has_next():
             raise StopIteration
 
+        if self._event_offsets is not None:
+            offset = self._event_offsets[self.event_counter]
+            if self.file_descriptor.tell() != offset:
+                self.file_descriptor.seek(offset)
+
         event_header = self.read_header()
         data = self.read_adc_data()
 
-        time_since_last_readout = self._update_last_seen(event_header)
+        time_since_last_readout = None
+        if self.delta_t:
+            time_since_last_readout = self._update_last_seen(event_header)
+            if self.compact_delta_t:
+                time_since_last_readout = compress_delta_t(time_since_last_readout)
+            if self.layout != 'flat':
+                time_since_last_readout = array_to_structured(time_since_last_readout)
         self.event_counter += 1
+
+        if self.layout == 'flat':
+            event_header = event_header._replace(
+                stop_cells=stop_cells_to_array(event_header.stop_cells)
+            )
         return self.Event(event_header, self.roi, data, time_since_last_readout)
 
     def read_adc_data(self):
-        ''' return array of raw ADC data, shape:(16, roi)
+        ''' read and decode the adc data of one event, see decode_adc
 
-        The ADC data, is just a contiguous bunch of 16bit integers
-        So its easy to read.
-        However the assignment of integers to the 16 channels
-        is not soo easy. I hope I did it correctly.
+        returns a structured array of shape (num_channels, ) with the fields
+        'low' and 'high' or, for the flat layout,
+        an array of shape (num_channels, num_gains, roi)
         '''
-        f = self.file_descriptor
-
-        d = np.fromfile(f, '>i2', num_gains * num_channels * self.roi)
+        d = np.fromfile(self.file_descriptor, '>i2', num_gains * num_channels * self.roi)
+        self._stats.bytes_read += d.nbytes
+        data = decode_adc(d, self.roi, self.dtype)
 
-        N = num_gains * num_channels * self.roi
-        roi_dtype = '{}>i2'.format(self.roi)
-        array = np.empty(
-            num_channels, dtype=[('low', roi_dtype), ('high', roi_dtype)]
-        )
-        data_odd = d[N // 2:]
-        data_even = d[:N // 2]
-        for channel in range(0, num_channels, 2):
-            array['high'][channel] = data_even[channel::8]
-            array['low'][channel] = data_even[channel + 1::8]
-            array['high'][channel + 1] = data_odd[channel::8]
-            array['low'][channel + 1] = data_odd[channel + 1::8]
-
-        return array
+        if self.layout == 'flat':
+            return data
+        return array_to_structured(data)
 
 
 EventHeader_v5_1_05 = namedtuple('EventHeader_v5_1_05', [
     'event_counter',
     'trigger_counter',
+    'clock',
     'timestamp',
     'stop_cells',
     'flag',
@@ -261,6 +1006,35 @@ class EventGenerator_v5_1_05(AbstractEventGenerator):
     timestamp_conversion_to_s = 7.5e-9
     EventHeader = EventHeader_v5_1_05
 
+    # header as stored in the file, including the stop cells in chip order
+    raw_header_dtype = [
+        ('event_counter', '>u4'),
+        ('trigger_counter', '>u4'),
+        ('clock', '>u8'),
+        ('flag', 'S16'),
+        ('stop_cells', '>u2', 8),
+    ]
+    clock_field = 'clock'
+    header_dtype = np.dtype([
+        ('event_counter', 'u4'),
+        ('trigger_counter', 'u4'),
+        ('clock', 'u8'),
+        ('timestamp', 'f8'),
+        ('stop_cells', stop_cells_dtype, num_channels),
+        ('flag', 'S16'),
+    ])
+
+    def _timestamp(self, clock):
+        return clock * self.timestamp_conversion_to_s
+
+    @property
+    def header_marker(self):
+        # the flag is the only constant part of the header, see guess_event_size
+        return self.flag, 16
+
+    def _valid_headers(self, raw):
+        return raw['flag'] == self.flag
+
     def read_header(self):
         ''' return EventHeader from file f
 
@@ -282,12 +1056,18 @@ class EventGenerator_v5_1_05(AbstractEventGenerator):
             found_flag,
         ) = struct.unpack('!IIQ16s', f.read(struct.calcsize('!IIQ16s')))
 
+        if found_flag != self.flag:
+            raise BrokenEventError(
+                "Flag is not {!r} but {!r}".format(self.flag, found_flag)
+            )
+
         stop_cells_for_user = self._read_stop_cells()
+        self._stats.bytes_read += self.header_size
 
-        timestamp_in_s = clock * self.timestamp_conversion_to_s
+        timestamp_in_s = self._timestamp(clock)
 
         return self.EventHeader(
-            event_id, trigger_id, timestamp_in_s, stop_cells_for_user, found_flag
+            event_id, trigger_id, clock, timestamp_in_s, stop_cells_for_user, found_flag
         )
 
     def calc_roi(self):
@@ -320,6 +1100,7 @@ class EventGenerator_v5_1_05(AbstractEventGenerator):
         # file:
 
         flag = chunk[16:32]
+        self.flag = flag
         first_flag = chunk.find(flag)
         second_flag = chunk.find(flag, first_flag + 1)
 
@@ -345,6 +1126,41 @@ class EventGenerator_v5_1_0B(AbstractEventGenerator):
     header_size = 4 * 16
     EventHeader = EventHeader_v5_1_0B
 
+    # header as stored in the file, including the stop cells in chip order
+    raw_header_dtype = [
+        ('header_aaaa', '>u2'),
+        ('pps_counter', '>u2'),
+        ('counter_10MHz', '>u4'),
+        ('event_counter', '>u4'),
+        ('trigger_counter', '>u4'),
+        ('counter_133MHz', '>u8'),
+        ('data_header', '>u8'),
+        ('flag', 'S16'),
+        ('stop_cells', '>u2', 8),
+    ]
+    clock_field = 'counter_133MHz'
+    header_dtype = np.dtype([
+        ('event_counter', 'u4'),
+        ('trigger_counter', 'u4'),
+        ('counter_133MHz', 'u8'),
+        ('counter_10MHz', 'u4'),
+        ('pps_counter', 'u2'),
+        ('timestamp', 'f8'),
+        ('stop_cells', stop_cells_dtype, num_channels),
+        ('flag', 'S16'),
+    ])
+
+    def _timestamp(self, clock):
+        return clock / 133e6
+
+    # the data header of 8 times 0xdd starts at byte 24 of the header
+    header_marker = (b'\xdd' * 8, 24)
+
+    def _valid_headers(self, raw):
+        return (
+            (raw['header_aaaa'] == 0xaaaa)
+            & (raw['data_header'] == 0xdddddddddddddddd)
+        )
 
     def calc_roi(self):
         body_size = self.event_size - self.header_size
@@ -368,14 +1184,19 @@ class EventGenerator_v5_1_0B(AbstractEventGenerator):
             flags,
         ) = struct.unpack('!HHIIIQQ16s', f.read(struct.calcsize('!HHIIIQQ16s')))
 
-        assert header_aaaa == 0xaaaa, \
-            "Header is not 0xaaaa but {!r}".format(header_aaaa)
-        assert data_header_all_ds == 0xdddddddddddddddd, \
-            "data_header is not 8x 0xdd but {!r}".format(data_header_all_ds)
+        if header_aaaa != 0xaaaa:
+            raise BrokenEventError(
+                "Header is not 0xaaaa but {!r}".format(header_aaaa)
+            )
+        if data_header_all_ds != 0xdddddddddddddddd:
+            raise BrokenEventError(
+                "data_header is not 8x 0xdd but {!r}".format(data_header_all_ds)
+            )
 
         stop_cells_for_user = self._read_stop_cells()
+        self._stats.bytes_read += self.header_size
 
-        timestamp = counter_133MHz / 133e6
+        timestamp = self._timestamp(counter_133MHz)
 
         return self.EventHeader(
             event_counter,
@@ -410,7 +1231,7 @@ class EventGenerator_v5_1_0B(AbstractEventGenerator):
         return event_size
 
 
-def EventGenerator(path, max_events=None, version=None):
+def EventGenerator(path, max_events=None, version=None, **kwargs):
     version_map = {
         "v5_1_05": EventGenerator_v5_1_05,
         "v5_1_0B": EventGenerator_v5_1_0B,
@@ -428,14 +1249,37 @@ def EventGenerator(path, max_events=None, version=None):
             'File version could not be determined for file {}'.format(path))
 
     if version is None:
-        return version_map[guess_version(path)](path, max_events)
-    else:
-        return version_map[version](path, max_events)
+        version = guess_version(path)
+
+    return version_map[version](path, max_events, **kwargs)
 
 
 class AbstractEventHeaderGenerator(AbstractEventGenerator):
+    ''' iterate over the event headers only
+
+    The headers of all available events are read at once from a memory map,
+    in follow mode only the headers of the new events are read when they appear.
+    '''
+    _headers = None
+    _headers_start = 0
+
     def next(self):
-        return super().next()
+        if not self._has_next():
+            raise StopIteration
+
+        index = self.event_counter - self._headers_start
+        if self._headers is None or not 0 <= index < len(self._headers):
+            self._headers_start = self.event_counter
+            self._headers = self._headers_from_raw(
+                self._raw_headers(self.event_counter, self.max_events - self.event_counter),
+                self.event_counter,
+            )
+            index = 0
+
+        header = self.EventHeader(*self._headers[index])
+        self.event_counter += 1
+
+        return self.Event(header, self.roi, None, None)
 
     def read_adc_data(self):
         ''' read data from self.file_descripter, and throw it away.
@@ -453,7 +1297,7 @@ class EventHeaderGenerator_v5_1_05(AbstractEventHeaderGenerator, EventGenerator_
 class EventHeaderGenerator_v5_1_0B(AbstractEventHeaderGenerator, EventGenerator_v5_1_0B):
     pass
 
-def EventHeaderGenerator(path, max_events=None, version=None):
+def EventHeaderGenerator(path, max_events=None, version=None, **kwargs):
     version_map = {
         "v5_1_05": EventHeaderGenerator_v5_1_05,
         "v5_1_0B": EventHeaderGenerator_v5_1_0B,
@@ -471,9 +1315,9 @@ def EventHeaderGenerator(path, max_events=None, version=None):
             'File version could not be determined for file {}'.format(path))
 
     if version is None:
-        return version_map[guess_version(path)](path, max_events)
-    else:
-        return version_map[version](path, max_events)
+        version = guess_version(path)
+
+    return version_map[version](path, max_events, **kwargs)
 
 
 
@@ -0,0 +1,233 @@
+'''
+Rolling quality metrics for runs that are still being written by the DAQ.
+
+A RunMonitor follows one file and keeps per channel summaries of the
+last `window` events, snapshots are published with `publish` as json
+to a file or a udp socket.
+'''
+from collections import OrderedDict
+import json
+import os
+import socket
+import time
+import numpy as np
+
+from .io import BrokenEventError, EventGenerator, stop_cells_to_array
+from .io import gaintypes, num_channels, num_gains, max_roi
+
+# largest payload of a udp datagram over ipv4
+max_datagram_size = 65507
+
+
+def _to_list(array):
+    ''' convert to nested lists for json, nan becomes None '''
+    array = np.asarray(array, dtype=float)
+    return np.where(np.isnan(array), None, array).tolist()
+
+
+def _per_gain(array):
+    ''' split an array with gain axis 1 into a dict by gain name '''
+    return {gain: _to_list(array[:, i]) for i, gain in enumerate(gaintypes)}
+
+
+class RunMonitor:
+    ''' Follow a run file and keep rolling quality metrics per pixel and gain
+
+    Only per event summaries of the last `window` events are kept,
+    so memory does not grow with the run length.
+    New events are decoded in blocks of up to `block_size` events.
+    Events with a broken header are skipped and counted in broken_events.
+
+    Metrics:
+      baseline: mean adc counts of each event, skipping the first and last samples
+      noise: standard deviation of the adc counts of each event
+      trigger_rate: events per second in the window
+      stop_cell_histogram: distribution of the stop cells in the window
+    '''
+
+    def __init__(
+            self,
+            path,
+            window=1000,
+            block_size=100,
+            skip_begin=5,
+            skip_end=5,
+            stop_cell_bins=64,
+            ):
+        if not 1 <= stop_cell_bins <= max_roi:
+            raise ValueError('stop_cell_bins must be between 1 and {}, got {}'.format(
+                max_roi, stop_cell_bins
+            ))
+
+        self.path = path
+        self.window = window
+        self.block_size = block_size
+        self.skip_begin = skip_begin
+        self.skip_end = skip_end
+        self.stop_cell_bins = stop_cell_bins
+
+        self.generator = None
+        self.events_total = 0
+        self.broken_events = 0
+        self._position = 0
+
+        shape = (window, num_channels, num_gains)
+        self.baseline = np.full(shape, np.nan, dtype='f4')
+        self.noise = np.full(shape, np.nan, dtype='f4')
+        self.stop_cells = np.zeros(shape, dtype='i2')
+        self.timestamps = np.full(window, np.nan)
+
+    def _open(self):
+        ''' try to open the file, it might not yet exist or be too short '''
+        try:
+            self.generator = EventGenerator(
+                self.path, follow=True, timeout=0, poll_interval=0, delta_t=False,
+            )
+        except OSError:
+            return False
+        return True
+
+    def update(self):
+        ''' process all events written since the last call
+
+        returns the number of new events
+        '''
+        if self.generator is None and not self._open():
+            return 0
+
+        num_new = 0
+        while True:
+            try:
+                for block in self.generator.iter_blocks(self.block_size, delta_t=False):
+                    self._add(block)
+                    num_new += len(block.data)
+                return num_new
+            except BrokenEventError as e:
+                num_new += self._skip_broken(e.event)
+
+    def _skip_broken(self, broken):
+        ''' add the valid events before the broken event and skip it
+
+        returns the number of added events
+        '''
+        generator = self.generator
+        # the failed block moved the file position, go back to the current event
+        generator.skip_events(0)
+
+        num_valid = broken - generator.event_counter
+        if num_valid > 0:
+            self._add(generator.next_block(num_valid, delta_t=False))
+
+        generator.skip_events(1)
+        self.broken_events += 1
+        return num_valid
+
+    def _add(self, block):
+        num_events = len(block.data)
+        stop = block.roi - self.skip_end
+        data = block.data[..., self.skip_begin:stop].astype('f4')
+
+        stop_cells = stop_cells_to_array(block.headers['stop_cells'])
+
+        # only the last `window` events of a block can end up in the window
+        keep = slice(max(num_events - self.window, 0), num_events)
+        index = (self._position + np.arange(num_events)[keep]) % self.window
+
+        self.baseline[index] = data[keep].mean(axis=-1)
+        self.noise[index] = data[keep].std(axis=-1)
+        self.stop_cells[index] = stop_cells[keep]
+        self.timestamps[index] = block.headers['timestamp'][keep]
+
+        self._position = (self._position + num_events) % self.window
+        self.events_total += num_events
+
+    def snapshot(self):
+        ''' return the current metrics as a json serializable dict '''
+        valid = np.isfinite(self.timestamps)
+        num_events = int(np.count_nonzero(valid))
+
+        snapshot = OrderedDict([
+            ('path', self.path),
+            ('events_total', self.events_total),
+            ('broken_events', self.broken_events),
+            ('window_events', num_events),
+        ])
+        if num_events == 0:
+            return snapshot
+
+        timestamps = self.timestamps[valid]
+        duration = timestamps.max() - timestamps.min()
+        trigger_rate = (num_events - 1) / duration if duration > 0 else np.nan
+
+        # bins of equal width, also if stop_cell_bins does not divide max_roi
+        stop_cell_bin = self.stop_cells[valid].astype('i4') * self.stop_cell_bins // max_roi
+        channel = np.arange(num_channels * num_gains).reshape(num_channels, num_gains)
+        bins = channel * self.stop_cell_bins + stop_cell_bin
+        histogram = np.bincount(
+            bins.ravel(), minlength=num_channels * num_gains * self.stop_cell_bins
+        ).reshape(num_channels, num_gains, self.stop_cell_bins)
+
+        snapshot['trigger_rate'] = _to_list(trigger_rate)
+        snapshot['baseline'] = _per_gain(np.nanmean(self.baseline[valid], axis=0))
+        snapshot['baseline_std'] = _per_gain(np.nanstd(self.baseline[valid], axis=0))
+        snapshot['noise'] = _per_gain(np.nanmean(self.noise[valid], axis=0))
+        snapshot['stop_cell_bin_width'] = max_roi / self.stop_cell_bins
+        snapshot['stop_cell_histogram'] = _per_gain(histogram)
+
+        return snapshot
+
+
+def publish(snapshot, target):
+    ''' publish a snapshot as json
+
+    target is either a file path, which is replaced atomically,
+    or an address of the form udp://host:port.
+    A datagram holds at most max_datagram_size bytes, so over udp
+    a snapshot with runs is sent as one datagram per run,
+    with the other keys of the snapshot and a list of only this run.
+    Raises a ValueError if a datagram would still be too large.
+    '''
+    if target.startswith('udp://'):
+        host, port = target[len('udp://'):].rsplit(':', 1)
+        if 'runs' in snapshot:
+            snapshots = [OrderedDict(snapshot, runs=[run]) for run in snapshot['runs']]
+        else:
+            snapshots = [snapshot]
+
+        messages = [json.dumps(part).encode() for part in snapshots]
+        for message in messages:
+            if len(message) > max_datagram_size:
+                raise ValueError(
+                    'A snapshot of {} bytes does not fit into a udp datagram, '
+                    'publish to a file instead'.format(len(message))
+                )
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for message in messages:
+                sock.sendto(message, (host, int(port)))
+    else:
+        tmp = target + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(json.dumps(snapshot))
+        os.replace(tmp, target)
+
+
+def run_monitors(monitors, target, interval=1.0, poll_interval=0.1):
+    ''' update all monitors and publish a snapshot every interval seconds
+
+    runs until interrupted
+    '''
+    last_publish = None
+    while True:
+        num_new = sum(monitor.update() for monitor in monitors)
+
+        now = time.monotonic()
+        if last_publish is None or now - last_publish >= interval:
+            publish(OrderedDict([
+                ('time', time.time()),
+                ('runs', [monitor.snapshot() for monitor in monitors]),
+            ]), target)
+            last_publish = now
+
+        if num_new == 0:
+            time.sleep(poll_interval)
@@ -10,8 +10,9 @@ from matplotlib.colors import ColorConverter
 import os
 import sys
 
-from .io import EventGenerator
-from .calibration import TimelapseCalibration, TimelapseCalibrationExtraOffsets
+from .io import EventGenerator, gaintypes
+from .utils import stop_cells2cells
+from .calibration import CalibrationPipeline
 
 color_converter = ColorConverter()
 
@@ -39,7 +40,15 @@ class FigureCanvas(FigureCanvasQTAgg):
 
 
 class DragonBrowser(QtWidgets.QMainWindow):
-    def __init__(self, filename=None, calibfile=None, extra_offset_file=None, start=None, **kwargs):
+    def __init__(
+            self,
+            filename=None,
+            calibfile=None,
+            extra_offset_file=None,
+            start=None,
+            pipeline_file=None,
+            **kwargs
+            ):
         QtWidgets.QMainWindow.__init__(self, **kwargs)
 
         self.setWindowTitle('DragonBrowser')
@@ -53,21 +62,19 @@ class DragonBrowser(QtWidgets.QMainWindow):
         if not self.filename:
             sys.exit()
 
-        if extra_offset_file is not None:
-            self.calib = TimelapseCalibrationExtraOffsets(calibfile, extra_offset_file)
-        elif calibfile is not None:
-            self.calib = TimelapseCalibration(calibfile)
+        if pipeline_file is not None:
+            self.calib = CalibrationPipeline.from_config(pipeline_file)
         else:
-            self.calib = lambda x: x
+            self.calib = CalibrationPipeline.from_files(calibfile, extra_offset_file)
 
-        self.generator = EventGenerator(self.filename)
+        self.generator = EventGenerator(self.filename, dtype='i2', layout='flat')
 
         if start is not None:
             for i in range(start):
                 next(self.generator)
 
         self.dragon_event = self.calib(next(self.generator))
-        self.gains = self.dragon_event.data.dtype.names
+        self.gains = gaintypes
         self.n_channels = self.dragon_event.data.shape[0]
         self.init_gui()
 
@@ -165,13 +172,13 @@ class DragonBrowser(QtWidgets.QMainWindow):
     def update(self):
         event = self.dragon_event
 
-        for gain in self.gains:
-            for channel in range(event.data.shape[0]):
-                stop_cell = event.header.stop_cells[channel][gain]
-                x = np.arange(event.roi)
-                if self.cb_physical.isChecked():
-                    x = (x + stop_cell) % 4096
-                self.plots[gain][channel].set_data(x, event.data[gain][channel])
+        x = np.broadcast_to(np.arange(event.roi), event.data.shape)
+        if self.cb_physical.isChecked():
+            x = stop_cells2cells(event.header.stop_cells, event.roi)
+
+        for g, gain in enumerate(self.gains):
+            for channel in range(self.n_channels):
+                self.plots[gain][channel].set_data(x[channel, g], event.data[channel, g])
 
         for ax in self.axs.values():
             ax.relim()
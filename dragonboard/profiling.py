@@ -0,0 +1,73 @@
+from collections import OrderedDict
+from functools import wraps
+import time
+
+
+class PipelineStats:
+    ''' Cumulative time and call counts for the stages of the event pipeline
+
+    Stages are registered by wrapping a callable with `wrap`,
+    only wrapped callables pay for the timing, so an instance without
+    any wrapped stages costs nothing per event.
+    '''
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.calls = OrderedDict()
+        self.time = OrderedDict()
+        self.events = 0
+        self.bytes_read = 0
+
+    def wrap(self, name, func):
+        ''' return func, timing every call as stage `name` '''
+        self.calls.setdefault(name, 0)
+        self.time.setdefault(name, 0.0)
+
+        @wraps(func)
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.time[name] += time.perf_counter() - t0
+                self.calls[name] += 1
+
+        return timed
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    @property
+    def events_per_second(self):
+        elapsed = self.elapsed
+        return self.events / elapsed if elapsed > 0 else float('nan')
+
+    def summary(self):
+        ''' return a human readable table of the collected numbers '''
+        elapsed = self.elapsed
+        lines = [
+            'events ....: {}'.format(self.events),
+            'bytes read : {:.1f} MB'.format(self.bytes_read / 1e6),
+            'wall time .: {:.2f} s'.format(elapsed),
+            'throughput : {:.1f} events/s, {:.1f} MB/s'.format(
+                self.events_per_second, self.bytes_read / 1e6 / elapsed
+            ),
+        ]
+        if self.calls:
+            lines.append('{:<24} {:>10} {:>10} {:>12} {:>7}'.format(
+                'stage', 'calls', 'total/s', 'per call/us', 'wall %'
+            ))
+        for name, calls in self.calls.items():
+            # e.g. the event by event stages of a generator read in blocks
+            if not calls:
+                continue
+            total = self.time[name]
+            lines.append('{:<24} {:>10d} {:>10.3f} {:>12.1f} {:>7.1f}'.format(
+                name,
+                calls,
+                total,
+                1e6 * total / calls if calls else float('nan'),
+                100 * total / elapsed,
+            ))
+        return '\n'.join(lines)
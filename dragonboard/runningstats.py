@@ -23,6 +23,34 @@ class RunningStats():
         self._mean[idx] += delta / self._n[idx]
         self._M2[idx] += delta * (data[idx] - self._mean[idx])
 
+    def add_many(self, data):
+        ''' add many values at once, data has the shape (num_values, ) + shape
+
+        The statistics of data are merged with the current ones
+        using the parallel algorithm of Chan et al., nans are ignored.
+        '''
+        data = np.atleast_2d(np.asarray(data))
+
+        valid = np.logical_not(np.isnan(data))
+        n_b = valid.sum(axis=0)
+        update = n_b > 0
+        n = self._n + n_b
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_b = np.where(valid, data, 0).sum(axis=0) / n_b
+            M2_b = np.where(valid, (data - mean_b) ** 2, 0).sum(axis=0)
+
+            mean_a = np.where(self._n > 0, self._mean, 0)
+            M2_a = np.where(self._n > 0, self._M2, 0)
+            delta = mean_b - mean_a
+
+            mean = mean_a + delta * n_b / n
+            M2 = M2_a + M2_b + delta ** 2 * self._n * n_b / n
+
+        self._mean = np.where(update, mean, self._mean)
+        self._M2 = np.where(update, M2, self._M2)
+        self._n = n
+
     @property
     def n(self):
         return self._n
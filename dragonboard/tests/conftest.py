@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def calib_file(tmpdir):
+    np.random.seed(0)
+    dfs = []
+    for pixel in range(8):
+        for channel in ('low', 'high'):
+            df = pd.DataFrame({
+                'a': np.random.uniform(1, 2, 4096),
+                'b': np.random.uniform(-0.5, -0.3, 4096),
+                'c': np.random.uniform(100, 300, 4096),
+                'chisq_ndf': np.ones(4096),
+            })
+            df['pixel'] = pixel
+            df['channel'] = channel
+            df['cell'] = np.arange(4096)
+            dfs.append(df)
+
+    path = str(tmpdir.join('calib.hdf5'))
+    pd.concat(dfs).to_hdf(path, key='data')
+    return path
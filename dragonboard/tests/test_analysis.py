@@ -0,0 +1,144 @@
+import os
+import numpy as np
+import pytest
+
+
+def test_evaluate_calibrations(calib_file):
+    from dragonboard import EventGenerator
+    from dragonboard.calibration import NoCalibration, TimelapseCalibration
+    from dragonboard.analysis.calibration_performance import evaluate_calibrations
+
+    path = 'data/random_noise_v5_1_0B.dat'
+    calibs = [NoCalibration(), TimelapseCalibration(calib_file)]
+
+    # max_events counts the skipped events
+    df = evaluate_calibrations(path, calibs, max_events=35, skip=5, block_size=7)
+    assert len(df) == 30 * 7 * 2
+    assert list(df.columns) == [
+        name + '_' + stat
+        for name in ('NoCalibration', 'TimelapseCalibration')
+        for stat in ('mean', 'std', 'min', 'max')
+    ]
+
+    parallel = evaluate_calibrations(path, calibs, max_events=35, skip=5, n_jobs=2)
+    assert np.allclose(df.values, parallel.values)
+
+    with pytest.raises(ValueError):
+        evaluate_calibrations(path, calibs, max_events=5, skip=5)
+
+    generator = EventGenerator(path)
+    for event in generator:
+        if event.header.event_counter == 20:
+            break
+    calibrated = calibs[1](event)
+    expected = calibrated.data['high'][3].mean()
+    assert np.isclose(df.loc[(20, 3, 'high'), 'TimelapseCalibration_mean'], expected)
+
+
+def test_crosstalk(tmpdir):
+    from dragonboard import EventGenerator
+    from dragonboard.analysis.crosstalk import (
+        average_windows, crosstalk_matrix, find_crosstalk_files
+    )
+
+    path = 'data/random_noise_v5_1_0B.dat'
+    for name in ('CtCh2L.dat', 'CtCh5H.dat', 'notes.txt'):
+        tmpdir.join(name).mksymlinkto(os.path.abspath(path))
+
+    files = find_crosstalk_files(str(tmpdir))
+    assert sorted(files) == [('high', 2), ('low', 5)]
+
+    crosstalk = crosstalk_matrix(str(tmpdir), max_events=50, block_size=7)
+    parallel = crosstalk_matrix(files, max_events=50, n_jobs=2)
+
+    # the per event loop of the old crosstalk study
+    expected = np.zeros((8, 40))
+    for event in EventGenerator(path, max_events=50):
+        data = event.data['high']
+        position = 20 + np.argmax(data[2][20:75])
+        for pixel in range(8):
+            expected[pixel] += data[pixel][position - 20:position + 20]
+    expected /= 50
+    expected -= expected[:, :13].mean(axis=1, keepdims=True)
+
+    high = crosstalk['high']
+    assert high.num_events[2] == 50
+    assert np.allclose(high.averages[2], expected)
+    assert np.allclose(high.matrix[2], 100 * expected.max(axis=1) / expected[2].max())
+    assert high.matrix[2, 2] == 100
+    assert np.all(np.isnan(high.matrix[[0, 1, 3, 4, 5, 6, 7]]))
+    assert np.allclose(crosstalk['low'].matrix[5], parallel['low'].matrix[5])
+
+    # windows starting before the first sample are never aligned
+    with pytest.raises(ValueError) as e:
+        average_windows(path, 2, 'high', search=(0, 5), max_events=10)
+    assert path in str(e.value) and 'pixel 2' in str(e.value)
+
+
+def test_gain_ratio(tmpdir):
+    from dragonboard import EventGenerator
+    from dragonboard.analysis.gain_ratio import gain_ratio_curves
+
+    path = 'data/random_noise_v5_1_0B.dat'
+    for name in ('a.dat', 'b.dat'):
+        tmpdir.join(name).mksymlinkto(os.path.abspath(path))
+
+    df = gain_ratio_curves(str(tmpdir), max_events=40, block_size=7, n_jobs=2)
+    assert len(df) == 2 * 8
+
+    # the per event loop of the old gain ratio script
+    ratios = []
+    amplitudes = []
+    for event in EventGenerator(path, max_events=40):
+        maxima = {}
+        for gain in ('low', 'high'):
+            data = event.data[gain].astype(float)
+            data -= data[:, :20].mean(axis=1, keepdims=True)
+            maxima[gain] = data[:, :90].max(axis=1)
+        ratios.append(np.where(maxima['low'] > 0, maxima['high'] / maxima['low'], np.nan))
+        amplitudes.append(maxima['high'])
+    ratios = np.array(ratios)
+
+    for pixel in range(8):
+        result = df.loc[pixel].iloc[0]
+        assert np.isclose(result['amplitude_high'], np.mean(amplitudes, axis=0)[pixel])
+        assert np.isclose(result['ratio'], np.nanmean(ratios[:, pixel]))
+        assert result['n_events'] == np.sum(~np.isnan(ratios[:, pixel]))
+
+
+def test_grouped_stats(tmpdir):
+    import pandas as pd
+    from dragonboard.analysis.grouped_stats import grouped_stats
+
+    n = 20000
+    df = pd.DataFrame({
+        'cell': np.random.randint(0, 50, n).astype('int16'),
+        'sample': np.random.randint(0, 10, n).astype('int16'),
+        'delta_t': np.random.uniform(0, 0.1, n).astype('float32'),
+        'adc_counts': np.random.normal(300, 10, n).astype('int16'),
+    })
+    path = str(tmpdir.join('cstc.hdf5'))
+    df.to_hdf(path, key='pixel_0_high', format='table')
+
+    result = grouped_stats(
+        path, 'pixel_0_high',
+        selection=lambda chunk: chunk['delta_t'] > 0.05,
+        percentiles=(25, 50, 75),
+        chunksize=3000,
+    )
+    selected = df[df['delta_t'] > 0.05]
+    expected = selected.groupby(['cell', 'sample'])['adc_counts'].describe()
+
+    assert np.all(result.index == expected.index)
+    assert np.all(result['count'] == expected['count'])
+    for column in ('mean', 'std', '25%', '50%', '75%'):
+        assert np.allclose(result[column], expected[column], equal_nan=True)
+
+    result = grouped_stats(
+        path, 'pixel_0_high', by=('cell', ),
+        value=lambda chunk: chunk['adc_counts'] - 2 * chunk['delta_t'],
+        chunksize=7000,
+    )
+    expected = (df['adc_counts'] - 2 * df['delta_t']).groupby(df['cell']).agg(['mean', 'std'])
+    assert np.allclose(result['mean'], expected['mean'])
+    assert np.allclose(result['std'], expected['std'])
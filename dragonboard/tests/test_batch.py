@@ -0,0 +1,65 @@
+import os
+import pytest
+
+
+def count_lines(inputfile, partfile, options):
+    with open(inputfile) as f:
+        lines = f.read().splitlines()
+    if 'fail' in lines:
+        raise ValueError('broken input')
+    with open(partfile, 'w') as f:
+        f.write('{}\n'.format(len(lines) * options.get('factor', 1)))
+
+
+def sum_counts(inputfiles, partfiles, outputfile, options):
+    total = 0
+    for partfile in partfiles:
+        with open(partfile) as f:
+            total += int(f.read())
+    with open(outputfile, 'w') as f:
+        f.write('{}\n'.format(total))
+
+
+def test_run_batch(tmpdir):
+    from ..batch import Recipe, BatchError, run_batch
+
+    recipe = Recipe('count', count_lines, sum_counts, '.txt')
+    inputfiles = []
+    for i in range(1, 4):
+        path = str(tmpdir.join('run_{}.dat'.format(i)))
+        with open(path, 'w') as f:
+            f.write('x\n' * i)
+        inputfiles.append(path)
+
+    broken = str(tmpdir.join('broken.dat'))
+    with open(broken, 'w') as f:
+        f.write('fail\n')
+
+    outputfile = str(tmpdir.join('total.txt'))
+    with pytest.raises(BatchError) as e:
+        run_batch(recipe, inputfiles + [broken], outputfile, n_jobs=2)
+    assert list(e.value.failed) == [broken]
+    assert not os.path.exists(outputfile)
+
+    # the finished files are not processed again
+    parts = run_batch(recipe, inputfiles, outputfile, n_jobs=1)
+    mtimes = [os.path.getmtime(part) for part in parts]
+    with open(outputfile) as f:
+        assert int(f.read()) == 6
+
+    with pytest.raises(FileExistsError):
+        run_batch(recipe, inputfiles, outputfile)
+
+    assert run_batch(recipe, inputfiles, outputfile, overwrite=True) == parts
+    assert [os.path.getmtime(part) for part in parts] == mtimes
+
+    # other options or a changed input file are processed again
+    with open(inputfiles[0], 'a') as f:
+        f.write('x\n')
+    run_batch(recipe, inputfiles, outputfile, overwrite=True)
+    assert os.path.getmtime(parts[0]) != mtimes[0]
+    assert [os.path.getmtime(part) for part in parts[1:]] == mtimes[1:]
+
+    run_batch(recipe, inputfiles, outputfile, options={'factor': 2}, overwrite=True)
+    with open(outputfile) as f:
+        assert int(f.read()) == 14
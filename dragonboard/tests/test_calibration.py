@@ -0,0 +1,138 @@
+import json
+import pytest
+import numpy as np
+import pandas as pd
+
+
+def shuffled_stop_cells(event):
+    stop_cells = event.header.stop_cells.copy()
+    stop_cells['low'] = np.random.randint(0, 4096, 8)
+    stop_cells['high'] = np.random.randint(0, 4096, 8)
+    return event._replace(header=event.header._replace(stop_cells=stop_cells))
+
+
+def test_timelapse_calibration(calib_file):
+    from dragonboard import EventGenerator, sample2cell
+    from dragonboard.calibration import TimelapseCalibration
+
+    calib = TimelapseCalibration(calib_file)
+    constants = pd.read_hdf(calib_file).set_index(['pixel', 'channel', 'cell']).sort_index()
+
+    generator = EventGenerator('data/random_noise_v5_1_0B.dat', max_events=3)
+    for event in generator:
+        event = shuffled_stop_cells(event)
+        calibrated = calib(event)
+
+        for pixel in range(8):
+            for gain in ('low', 'high'):
+                sc = event.header.stop_cells[pixel][gain]
+                cells = sample2cell(np.arange(event.roi), sc)
+                a, b, c = constants.loc[pixel, gain].loc[cells][['a', 'b', 'c']].values.T
+                dt = event.time_since_last_readout[pixel][gain]
+                offset = a * dt ** b + c
+                offset[np.isnan(offset)] = c[np.isnan(offset)]
+                expected = event.data[pixel][gain] - offset.astype('>i2')
+
+                assert np.all(calibrated.data[pixel][gain] == expected)
+
+
+def test_pipeline_from_config(calib_file, tmpdir):
+    from dragonboard import EventGenerator
+    from dragonboard.calibration import CalibrationPipeline, TimelapseCalibration
+
+    config = tmpdir.join('pipeline.json')
+    config.write(json.dumps({'stages': [
+        {'calibration': 'TimelapseCalibration', 'filename': 'calib.hdf5'},
+        {'calibration': 'NoCalibration'},
+    ]}))
+    pipeline = CalibrationPipeline.from_config(str(config))
+    assert len(pipeline.stages) == 2
+
+    event = next(EventGenerator('data/random_noise_v5_1_0B.dat', max_events=1))
+    calibrated = pipeline(event)
+    expected = TimelapseCalibration(calib_file)(event)
+
+    for gain in ('low', 'high'):
+        assert np.all(calibrated.data[gain] == expected.data[gain])
+        # the input event is not modified
+        assert not np.all(calibrated.data[gain] == event.data[gain])
+
+
+def test_taka_offsets(tmpdir, monkeypatch):
+    from dragonboard import EventGenerator
+    from dragonboard.calibration import TakaOffsetCalibration, parse_taka_offsets
+
+    monkeypatch.setenv('DRAGONBOARD_CACHE_DIR', str(tmpdir.join('cache')))
+
+    table = np.random.randint(-100, 100, (4096, 16))
+    path = str(tmpdir.join('taka.txt'))
+    np.savetxt(path, table, fmt='%d')
+
+    calib = TakaOffsetCalibration(path)
+    assert calib.offsets.shape == (8, 2, 4096)
+    assert np.all(calib.offsets[3, 1] == table[:, 3])
+    assert np.all(calib.offsets[3, 0] == table[:, 11])
+    assert len(tmpdir.join('cache').listdir()) == 1
+
+    # the second instance is loaded from the cache
+    cached = TakaOffsetCalibration(path)
+    assert np.all(cached.offsets == calib.offsets)
+    assert len(tmpdir.join('cache').listdir()) == 1
+    assert np.all(parse_taka_offsets(path) == calib.offsets)
+
+    # a failing write is not cached and leaves no temporary file behind
+    def fail(src, dst):
+        raise OSError('disk full')
+
+    monkeypatch.setenv('DRAGONBOARD_CACHE_DIR', str(tmpdir.join('failing')))
+    monkeypatch.setattr('os.replace', fail)
+    assert np.all(TakaOffsetCalibration(path).offsets == calib.offsets)
+    assert tmpdir.join('failing').listdir() == []
+    monkeypatch.undo()
+
+    event = next(EventGenerator('data/random_noise_v5_1_0B.dat', max_events=1))
+    calibrated = calib(event)
+    for pixel in range(8):
+        for gain, column in (('high', pixel), ('low', pixel + 8)):
+            sc = event.header.stop_cells[pixel][gain]
+            cells = (np.arange(event.roi) + sc) % 4096
+            expected = event.data[pixel][gain] - table[cells, column]
+            assert np.all(calibrated.data[pixel][gain] == expected)
+
+
+def test_calibration_without_delta_t(calib_file, tmpdir):
+    from dragonboard import EventGenerator, read
+    from dragonboard.calibration import (
+        CalibrationPipeline, PatternSubtraction, TakaOffsetCalibration, TimelapseCalibration
+    )
+    from dragonboard.calibration_bundle import write_bundle
+
+    taka_path = str(tmpdir.join('taka.txt'))
+    np.savetxt(taka_path, np.random.randint(-100, 100, (4096, 16)), fmt='%d')
+    pattern_path = str(tmpdir.join('pattern.dcal'))
+    pattern = np.random.uniform(-5, 5, (8, 2, 4096, 10)).astype('f4')
+    write_bundle(pattern_path, 'pattern', {'pattern': pattern})
+
+    path = 'data/random_noise_v5_1_0B.dat'
+    pipeline = CalibrationPipeline([
+        TakaOffsetCalibration(taka_path), PatternSubtraction(pattern_path)
+    ])
+
+    # the same result as with delta_t, which these stages do not use
+    expected = pipeline.calibrate_block(EventGenerator(path).next_block(10))
+    block = EventGenerator(path, delta_t=False).next_block(10)
+    assert block.time_since_last_readout is None
+    assert np.all(pipeline.calibrate_block(block) == expected)
+
+    for layout in ('structured', 'flat'):
+        events = read(path, max_events=3, delta_t=False, layout=layout)
+        reference = read(path, max_events=3, layout=layout)
+        for event, ref in zip(events, reference):
+            calibrated = pipeline(event)
+            assert np.all(calibrated.data == pipeline(ref).data)
+
+    with pytest.raises(ValueError) as e:
+        TimelapseCalibration(calib_file)(events[0])
+    assert 'TimelapseCalibration' in str(e.value)
+    with pytest.raises(ValueError):
+        CalibrationPipeline([TimelapseCalibration(calib_file)]).calibrate_block(block)
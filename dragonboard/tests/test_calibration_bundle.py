@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+
+def test_write_and_load(tmpdir):
+    from dragonboard.calibration_bundle import write_bundle, load_bundle, is_bundle
+
+    path = str(tmpdir.join('offsets.dcal'))
+    arrays = {
+        'offsets': np.random.normal(0, 1, (8, 2, 4096, 3)).astype('f4'),
+        'counts': np.arange(13, dtype='i2'),
+    }
+    write_bundle(path, 'offsets', arrays, roi=40)
+    assert is_bundle(path)
+
+    bundle = load_bundle(path, kind='offsets', verify=True)
+    assert bundle.metadata == {'roi': 40}
+    for name, array in arrays.items():
+        assert bundle[name].dtype == array.dtype
+        assert np.all(bundle[name] == array)
+        assert not bundle[name].flags.writeable
+
+    with pytest.raises(ValueError):
+        load_bundle(path, kind='pattern')
+
+    # corrupt the last byte
+    with open(path, 'r+b') as f:
+        f.seek(-1, 2)
+        f.write(b'\x42')
+    load_bundle(path)
+    with pytest.raises(ValueError):
+        load_bundle(path, verify=True)
+
+
+def test_timelapse_bundle(calib_file, tmpdir):
+    from dragonboard import EventGenerator
+    from dragonboard.calibration import TimelapseCalibration, load_timelapse_constants
+    from dragonboard.calibration_bundle import write_bundle
+
+    path = str(tmpdir.join('calib.dcal'))
+    write_bundle(path, 'timelapse', load_timelapse_constants(calib_file))
+
+    event = next(EventGenerator('data/random_noise_v5_1_0B.dat', max_events=1))
+    from_hdf5 = TimelapseCalibration(calib_file)(event)
+    from_bundle = TimelapseCalibration(path)(event)
+    for gain in ('low', 'high'):
+        assert np.all(from_hdf5.data[gain] == from_bundle.data[gain])
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def test_sort_by_cell(tmpdir):
+    from dragonboard.cell_sorted import sort_by_cell, CellSortedFile
+
+    inputfile = str(tmpdir.join('cstc.hdf5'))
+    outputfile = str(tmpdir.join('cstc_sorted.hdf5'))
+
+    n = 5000
+    tables = {}
+    with pd.HDFStore(inputfile, mode='w') as store:
+        for key in ('pixel_0_low', 'pixel_0_high'):
+            df = pd.DataFrame({
+                'sample': np.random.randint(0, 40, n).astype('int16'),
+                'adc_counts': np.random.randint(0, 4000, n).astype('int16'),
+                'cell': np.random.randint(0, 200, n).astype('int16'),
+                'delta_t': np.random.uniform(0, 1, n).astype('float32'),
+            })
+            # written in several appends like dragonboard_dataextraction does
+            for start in range(0, n, 2000):
+                store.append(key, df.iloc[start:start + 2000])
+            tables[key] = df
+
+    sort_by_cell(inputfile, outputfile, chunksize=700)
+
+    with CellSortedFile(outputfile) as f:
+        assert f.channels == ['pixel_0_high', 'pixel_0_low']
+
+        cell_start, cell_stop = f.index(0, 'low')
+        assert cell_start.shape == (4096, )
+        assert cell_stop[-1] == n
+
+        for gain in ('low', 'high'):
+            df = tables['pixel_0_' + gain]
+            for cell in (0, 17, 199, 300):
+                data = f.cell(0, gain, cell, columns=('delta_t', 'adc_counts', 'sample'))
+                expected = df[df['cell'] == cell]
+                for column in ('delta_t', 'adc_counts', 'sample'):
+                    assert np.all(data[column] == expected[column].values)
+
+            order = np.argsort(df['cell'].values, kind='stable')
+            data = f.channel(0, gain, columns=('delta_t', 'adc_counts', 'sample'))
+            for column in data:
+                assert np.all(data[column] == df[column].values[order])
+
+    # the sorted chunks are removed
+    assert sorted(tmpdir.listdir()) == sorted([tmpdir.join('cstc.hdf5'), tmpdir.join('cstc_sorted.hdf5')])
+
+
+def test_wrong_layout(tmpdir):
+    from dragonboard.cell_sorted import CellSortedFile
+
+    path = str(tmpdir.join('table.hdf5'))
+    pd.DataFrame({'cell': [1, 2]}).to_hdf(path, key='pixel_0_low', format='table')
+
+    with pytest.raises(ValueError):
+        CellSortedFile(path)
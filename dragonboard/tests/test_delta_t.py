@@ -0,0 +1,55 @@
+import numpy as np
+
+
+def test_round_trip():
+    from ..delta_t import compress, expand, invalid, min_delta_t, max_delta_t
+
+    delta_t = np.logspace(-7, 5, 10000).astype('f4')
+    codes = compress(delta_t)
+    assert codes.dtype == np.uint16
+    assert np.all(np.abs(expand(codes) / delta_t - 1) < 2.2e-4)
+
+    codes = compress(np.array([np.nan, 0, 1e-9, 1e9], dtype='f4'))
+    assert codes[0] == invalid
+    assert np.isnan(expand(codes)[0])
+    assert np.isclose(expand(codes)[1:3], min_delta_t).all()
+    assert np.isclose(expand(codes)[3], max_delta_t)
+
+
+def test_compact_generator():
+    from ..io import EventGenerator, structured_to_array
+    from ..delta_t import expand, valid
+    from ..calibration import CalibrationPipeline
+
+    path = 'data/random_noise_v5_1_0B.dat'
+    block = EventGenerator(path, max_events=20).next_block(20)
+    compact = EventGenerator(path, max_events=20, compact_delta_t=True).next_block(20)
+
+    assert compact.time_since_last_readout.dtype == np.uint16
+    assert np.all(valid(compact.time_since_last_readout) == valid(block.time_since_last_readout))
+    assert np.allclose(
+        expand(compact.time_since_last_readout), block.time_since_last_readout,
+        rtol=2.2e-4, equal_nan=True,
+    )
+
+    for event, reference in zip(
+            EventGenerator(path, max_events=5, compact_delta_t=True),
+            EventGenerator(path, max_events=5),
+            ):
+        assert np.allclose(
+            expand(structured_to_array(event.time_since_last_readout)),
+            structured_to_array(reference.time_since_last_readout),
+            rtol=2.2e-4, equal_nan=True,
+        )
+
+    class Offset:
+        def add_offsets(self, offsets, cells, time_since_last_readout):
+            offsets += np.nan_to_num(time_since_last_readout)
+
+    pipeline = CalibrationPipeline([Offset()])
+    stop_cells = np.zeros((20, 8, 2), dtype='i2')
+    assert np.allclose(
+        pipeline.offsets(stop_cells, compact.time_since_last_readout),
+        pipeline.offsets(stop_cells, block.time_since_last_readout),
+        rtol=2.2e-4,
+    )
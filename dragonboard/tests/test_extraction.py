@@ -0,0 +1,94 @@
+import json
+import numpy as np
+import pytest
+
+
+def pulses(num_events=50, roi=100):
+    samples = np.arange(roi)
+    position = np.random.uniform(30, 60, (num_events, 8, 2, 1))
+    amplitude = np.random.uniform(50, 500, (num_events, 8, 2, 1))
+    data = amplitude * np.exp(-0.5 * ((samples - position) / 3) ** 2)
+    data += np.random.normal(300, 2, data.shape)
+    return np.round(data).astype('i2')
+
+
+def test_integrals():
+    from dragonboard.extraction import fixed_window_integral, sliding_window_integral
+
+    data = pulses()
+    start = np.random.randint(0, 95, data.shape[:-1])
+    charge = fixed_window_integral(data, start, 5)
+    start_sliding, charge_sliding = sliding_window_integral(data, 5, 10, 80)
+
+    for index in np.ndindex(data.shape[:-1]):
+        series = data[index]
+        assert charge[index] == series[start[index]:start[index] + 5].sum()
+
+        sums = [series[i:i + 5].sum() for i in range(10, 80)]
+        assert start_sliding[index] == 10 + np.argmax(sums)
+        assert charge_sliding[index] == max(sums)
+
+
+def test_extractor():
+    from dragonboard.extraction import Extractor
+
+    data = pulses()
+    features = Extractor(width=7, search_window=(20, 80))(data)
+    assert features.shape == data.shape[:-1]
+
+    for index in np.ndindex(data.shape[:-1]):
+        series = data[index] - data[index][:20].mean()
+        position = 20 + np.argmax(series[20:80])
+        assert features['peak_position'][index] == position
+        assert np.isclose(features['amplitude'][index], series[position])
+        assert np.isclose(
+            features['charge'][index], series[position - 3:position + 4].sum(), rtol=1e-4
+        )
+
+        threshold = 0.5 * series[position]
+        i = np.flatnonzero(series[:position] < threshold)[-1]
+        time = i + (threshold - series[i]) / (series[i + 1] - series[i])
+        assert np.isclose(features['arrival_time'][index], time, atol=1e-3)
+
+
+def test_extractor_windows():
+    from dragonboard.extraction import Extractor, peak
+
+    data = pulses()
+    roi = data.shape[-1]
+
+    # a search window reaching beyond the roi is clipped
+    clipped = Extractor(search_window=(roi - 10, roi + 50), integration='sliding')(data)
+    expected = Extractor(search_window=(roi - 10, None), integration='sliding')(data)
+    assert np.all(clipped == expected)
+    assert np.all(clipped['peak_position'] >= roi - 10)
+
+    for search_window in ((roi, roi + 10), (-5, -20)):
+        with pytest.raises(ValueError, match='search_window'):
+            Extractor(search_window=search_window)(data)
+    with pytest.raises(ValueError, match='search_window'):
+        Extractor(search_window=(30, 30))
+    with pytest.raises(ValueError, match='width'):
+        Extractor(width=roi + 1)(data)
+    with pytest.raises(ValueError):
+        peak(data, roi + 1)
+
+
+def test_pipeline_extraction(tmpdir):
+    from dragonboard import EventGenerator
+    from dragonboard.calibration import CalibrationPipeline
+    from dragonboard.extraction import Extractor
+
+    config = tmpdir.join('pipeline.json')
+    config.write(json.dumps({
+        'stages': [{'calibration': 'NoCalibration'}],
+        'extraction': {'integration': 'sliding', 'width': 5},
+    }))
+    pipeline = CalibrationPipeline.from_config(str(config))
+
+    block = EventGenerator('data/random_noise_v5_1_0B.dat').next_block(10)
+    features = pipeline.extract_block(block)
+    assert features.shape == (10, 8, 2)
+
+    expected = Extractor(integration='sliding', width=5)(block.data)
+    assert np.all(features == expected)
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+def test_fit_timelapse():
+    from dragonboard.fitting import sort_samples, fit_timelapse, f
+
+    channels = [0, 5, 15]
+    cells = [0, 1000, 4095]
+    truth = {}
+
+    parts = []
+    for channel in channels:
+        for cell in cells:
+            a, b, c = np.random.uniform(1, 2), -0.38, np.random.uniform(200, 400)
+            truth[channel, cell] = (a, b, c)
+            delta_t = np.random.uniform(1e-4, 1e-1, 200)
+            adc = f(delta_t, a, b, c) + np.random.normal(0, 0.1, len(delta_t))
+            parts.append((np.full(200, channel), np.full(200, cell), delta_t, adc))
+
+    # shuffle, like the samples come from events
+    channel, cell, delta_t, adc = (np.concatenate(column) for column in zip(*parts))
+    order = np.random.permutation(len(channel))
+    delta_t, adc, cell_start, cell_stop = sort_samples(
+        channel[order], cell[order], delta_t[order], adc[order]
+    )
+    assert cell_start.shape == (8, 2, 4096)
+
+    result = fit_timelapse(delta_t, adc, cell_start, cell_stop, n_jobs=1, chunksize=512)
+    parallel = fit_timelapse(delta_t, adc, cell_start, cell_stop, n_jobs=2, chunksize=512)
+    assert result.shape == (8, 2, 4096, 4)
+    assert np.allclose(result, parallel, equal_nan=True)
+
+    for (channel, cell), (a, b, c) in truth.items():
+        pixel, gain = divmod(channel, 2)
+        assert np.allclose(result[pixel, gain, cell, :3], (a, b, c), rtol=0.05)
+
+    # cells without samples
+    assert np.isnan(result[1, 1, 7, 3])
+
+    # compact delta_t gives the same fit
+    from dragonboard.delta_t import compress
+    compact = fit_timelapse(compress(delta_t), adc, cell_start, cell_stop, n_jobs=1, chunksize=512)
+    assert np.allclose(compact[..., :3], result[..., :3], rtol=1e-3, equal_nan=True)
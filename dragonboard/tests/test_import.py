@@ -0,0 +1,31 @@
+import json
+import subprocess
+import sys
+
+# generous upper limit for ``import dragonboard`` on top of the numpy import
+import_time_budget = 1.0
+
+script = '''
+import json, sys, time
+import numpy
+t0 = time.perf_counter()
+import dragonboard
+duration = time.perf_counter() - t0
+print(json.dumps({'duration': duration, 'modules': sorted(sys.modules)}))
+'''
+
+
+def test_import_is_lightweight():
+    output = subprocess.check_output([sys.executable, '-c', script])
+    result = json.loads(output.decode())
+
+    heavy = {'PyQt5', 'matplotlib', 'pandas', 'scipy', 'pkg_resources', 'tables'}
+    assert not heavy & set(result['modules'])
+    assert result['duration'] < import_time_budget
+
+
+def test_lazy_attributes():
+    import dragonboard
+
+    assert dragonboard.calibration.CalibrationPipeline is dragonboard.CalibrationPipeline
+    assert isinstance(dragonboard.__version__, str)
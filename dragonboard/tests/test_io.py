@@ -1,3 +1,35 @@
+import numpy as np
+import pytest
+
+
+def write_test_file(path, version='v5_1_0B', num_events=20):
+    ''' write a file with random stop cells and adc data '''
+    from ..tools.create_fake_data import (
+        write_header_v5_1_0B, write_header_v5_1_05, write_stop_cells, write_adc_data
+    )
+    with open(path, 'wb') as f:
+        for event_counter in range(num_events):
+            if version == 'v5_1_0B':
+                write_header_v5_1_0B(
+                    f,
+                    pps_counter=0,
+                    event_counter=event_counter,
+                    trigger_counter=event_counter,
+                    counter_10MHz=event_counter * 1000,
+                    counter_133MHz=event_counter * 13300,
+                )
+            else:
+                write_header_v5_1_05(
+                    f,
+                    event_counter=event_counter,
+                    trigger_counter=event_counter,
+                    clock=event_counter * 13300,
+                )
+            write_stop_cells(f, np.random.randint(0, 4096, 8))
+            write_adc_data(f, np.random.randint(0, 2**12, 16 * 1024))
+    return path
+
+
 def test_reading_v5_1_05():
     from ..io import EventGenerator_v5_1_05
 
@@ -40,3 +72,472 @@ def test_performance_v5_1_0B():
     events = read('data/random_noise_v5_1_0B.dat')
 
     assert len(events) == 100
+
+
+def test_read_lazy():
+    from ..io import read, EventGenerator
+
+    path = 'data/random_noise_v5_1_0B.dat'
+    expected = list(EventGenerator(path, max_events=30, layout='flat'))
+
+    events = read(path, max_events=30, chunk_size=7, layout='flat')
+    assert len(events) == 30
+    for event, reference in zip(events, expected):
+        assert np.all(event.data == reference.data)
+        assert np.array_equal(
+            event.time_since_last_readout, reference.time_since_last_readout, equal_nan=True
+        )
+
+    # random access and slicing reproduce the same delta t
+    for i in (25, 3, 17):
+        assert np.array_equal(
+            events[i].time_since_last_readout,
+            expected[i].time_since_last_readout,
+            equal_nan=True,
+        )
+    part = events[5:20:3]
+    assert len(part) == 5
+    assert [e.header.event_counter for e in part] == [
+        e.header.event_counter for e in expected[5:20:3]
+    ]
+    assert events[-1].header.event_counter == expected[-1].header.event_counter
+
+    events = read(path, max_events=30, chunk_size=7, delta_t=False, layout='flat')
+    assert events[12].time_since_last_readout is None
+    assert events[12].data.shape == (8, 2, 1024)
+
+    # without delta_t, going back seeks in the same generator
+    generator = events._generator
+    for i in (25, 3, 17, 0):
+        assert np.all(events[i].data == expected[i].data)
+        assert events[i].header.event_counter == expected[i].header.event_counter
+    assert events._generator is generator
+
+
+@pytest.mark.parametrize('delta_t', [False, True])
+def test_read_array(delta_t):
+    from ..io import read_array, EventGenerator
+
+    path = 'data/random_noise_v5_1_0B.dat'
+    block = read_array(path, max_events=25, delta_t=delta_t, block_size=10)
+    expected = list(EventGenerator(path, max_events=25, layout='flat'))
+
+    assert block.data.shape == (25, 8, 2, 1024)
+    assert block.data.dtype == np.int16
+    assert np.all(block.headers['event_counter'] == [
+        e.header.event_counter for e in expected
+    ])
+    assert np.all(block.data == np.array([e.data for e in expected]))
+    if delta_t:
+        assert np.array_equal(
+            block.time_since_last_readout,
+            np.array([e.time_since_last_readout for e in expected]),
+            equal_nan=True,
+        )
+    else:
+        assert block.time_since_last_readout is None
+
+
+def test_stats():
+    from ..io import EventGenerator
+
+    eg = EventGenerator('data/random_noise_v5_1_0B.dat', max_events=10, profile=True)
+    for event in eg:
+        pass
+
+    stats = eg.stats()
+    assert stats.events == 10
+    assert stats.bytes_read == 10 * eg.event_size
+    assert stats.calls['read_header'] == 10
+    assert stats.calls['read_adc_data'] == 10
+    assert 'read_adc_data' in stats.summary()
+
+    eg = EventGenerator('data/random_noise_v5_1_0B.dat', max_events=10, profile=True)
+    for block in eg.iter_blocks(block_size=4):
+        pass
+
+    stats = eg.stats()
+    assert stats.calls['read_block'] == 3
+    assert stats.calls['decode_adc'] == 3
+    assert stats.calls['_update_last_seen'] == 10
+    assert stats.time['decode_adc'] > 0
+    assert stats.bytes_read == 10 * eg.event_size
+
+    # skipping reads only the headers, going back reads the event again
+    eg = EventGenerator('data/random_noise_v5_1_0B.dat', max_events=10)
+    eg.skip_events(5)
+    assert eg.stats().bytes_read == 5 * eg.header_size
+    next(eg)
+    next(eg)
+    eg.previous()
+    assert eg.stats().bytes_read == 5 * eg.header_size + 3 * eg.event_size
+
+    eg = EventGenerator('data/random_noise_v5_1_0B.dat', max_events=10)
+    next(eg)
+    assert eg.stats().events == 1
+    assert not eg.stats().calls
+
+
+@pytest.mark.parametrize('version', ['v5_1_05', 'v5_1_0B'])
+def test_read_headers(tmpdir, version):
+    from ..io import read_headers, EventGenerator, EventHeaderGenerator
+
+    path = write_test_file(str(tmpdir.join('test.dat')), version)
+
+    headers = read_headers(path)
+    assert len(headers) == 20
+    assert len(read_headers(path, max_events=5)) == 5
+
+    for i, event in enumerate(EventGenerator(path)):
+        for field, value in event.header._asdict().items():
+            if field == 'stop_cells':
+                assert np.all(headers[field][i] == value)
+            else:
+                assert headers[field][i] == value
+
+    for i, event in enumerate(EventHeaderGenerator(path)):
+        assert event.header.event_counter == i
+        assert np.all(event.header.stop_cells == headers['stop_cells'][i])
+
+
+def test_decode_stop_cells(tmpdir):
+    from ..io import (
+        decode_stop_cells, stop_cell_map, EventGenerator, stop_cells_to_array
+    )
+
+    words = np.arange(100, 108).astype('>u2')
+    stop_cells = decode_stop_cells(words)
+    assert stop_cells.shape == (8, )
+    for (gain, pixel), chip in stop_cell_map.items():
+        assert stop_cells[gain][pixel] == words[chip]
+
+    batch = np.random.randint(0, 4096, (10, 8)).astype('>u2')
+    decoded = decode_stop_cells(batch)
+    assert decoded.shape == (10, 8)
+    for event, result in zip(batch, decoded):
+        assert np.all(result == decode_stop_cells(event))
+
+    path = write_test_file(str(tmpdir.join('test.dat')))
+    stop_cells = EventGenerator(path).read_stop_cells()
+    flat = EventGenerator(path, layout='flat').read_stop_cells()
+    for i, event in enumerate(EventGenerator(path)):
+        assert np.all(stop_cells[i] == event.header.stop_cells)
+        assert np.all(flat[i] == stop_cells_to_array(event.header.stop_cells))
+
+
+def corrupt_header(path, event, version):
+    ''' break the marker of the header of event, the flag for v5_1_05, 0xaaaa for v5_1_0B '''
+    from ..io import EventGenerator
+    event_size = EventGenerator(path).event_size
+    offset = 16 if version == 'v5_1_05' else 0
+    with open(path, 'r+b') as f:
+        f.seek(event * event_size + offset)
+        f.write(b'\x00\x00')
+
+
+@pytest.mark.parametrize('version', ['v5_1_05', 'v5_1_0B'])
+def test_read_headers_broken(tmpdir, version):
+    from ..io import read_headers, EventHeaderGenerator, BrokenEventError
+
+    path = write_test_file(str(tmpdir.join('test.dat')), version)
+    corrupt_header(path, 3, version)
+
+    with pytest.raises(BrokenEventError, match='Event 3 '):
+        read_headers(path)
+    with pytest.raises(BrokenEventError):
+        next(EventHeaderGenerator(path))
+    assert len(read_headers(path, max_events=3)) == 3
+
+
+@pytest.mark.parametrize('version', ['v5_1_05', 'v5_1_0B'])
+def test_next_block_broken(tmpdir, version):
+    from ..io import EventGenerator, BrokenEventError
+
+    path = write_test_file(str(tmpdir.join('test.dat')), version)
+    corrupt_header(path, 12, version)
+
+    generator = EventGenerator(path)
+    assert len(generator.next_block(10).headers) == 10
+    with pytest.raises(BrokenEventError, match='Event 12 '):
+        generator.next_block(10)
+
+    with pytest.warns(UserWarning):
+        generator = EventGenerator(path, resync=True)
+    blocks = list(generator.iter_blocks(block_size=7))
+    assert sum(len(block.headers) for block in blocks) == 19
+
+
+@pytest.mark.parametrize('version', ['v5_1_05', 'v5_1_0B'])
+def test_scan_and_resync(tmpdir, version):
+    from ..io import scan, read_headers, EventGenerator, EventHeaderGenerator, BrokenEventError
+
+    path = write_test_file(str(tmpdir.join('test.dat')), version)
+    event_size = EventGenerator(path).event_size
+
+    report = scan(path)
+    assert report.ok
+    assert report.num_events == 20
+
+    with open(path, 'rb') as f:
+        data = bytearray(f.read())
+
+    # destroy the header of event 5
+    data[5 * event_size:5 * event_size + 32] = bytes(32)
+    # event 10 was not completely written before event 11 started
+    del data[10 * event_size + 100:10 * event_size + 1100]
+    # the last event is truncated
+    del data[-500:]
+
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    with pytest.warns(UserWarning):
+        report = scan(path)
+    assert not report.ok
+    assert report.num_events == 17
+    assert len(report.skipped) == 2
+    assert report.truncated_bytes == event_size - 500
+    assert len(report.counter_gaps) == 2
+
+    with pytest.warns(UserWarning):
+        events = list(EventGenerator(path, resync=True))
+    counters = [event.header.event_counter for event in events]
+    assert counters == [0, 1, 2, 3, 4, 6, 7, 8, 9, 11, 12, 13, 14, 15, 16, 17, 18]
+
+    with pytest.warns(UserWarning):
+        headers = read_headers(path, resync=True)
+    assert list(headers['event_counter']) == counters
+
+    with pytest.warns(UserWarning):
+        header_events = list(EventHeaderGenerator(path, resync=True))
+    assert [event.header.event_counter for event in header_events] == counters
+
+    with pytest.raises(BrokenEventError), pytest.warns(UserWarning):
+        for event in EventGenerator(path):
+            pass
+
+
+def test_follow(tmpdir):
+    import threading
+    import time
+    from ..io import EventGenerator, EventHeaderGenerator
+
+    full_path = write_test_file(str(tmpdir.join('full.dat')))
+    event_size = EventGenerator(full_path).event_size
+    with open(full_path, 'rb') as f:
+        data = f.read()
+
+    path = str(tmpdir.join('growing.dat'))
+    with open(path, 'wb') as f:
+        f.write(data[:5 * event_size])
+
+    def daq(path=path):
+        with open(path, 'ab') as f:
+            # write in pieces not aligned to the events
+            for start in range(5 * event_size, len(data), 7000):
+                time.sleep(0.005)
+                f.write(data[start:start + 7000])
+                f.flush()
+
+    thread = threading.Thread(target=daq)
+    thread.start()
+    events = list(EventGenerator(path, follow=True, poll_interval=0.001, timeout=0.5))
+    thread.join()
+
+    expected = list(EventGenerator(full_path))
+    assert len(events) == len(expected) == 20
+    for event, expected_event in zip(events, expected):
+        for gain in ('low', 'high'):
+            assert np.all(event.data[gain] == expected_event.data[gain])
+            assert np.array_equal(
+                event.time_since_last_readout[gain],
+                expected_event.time_since_last_readout[gain],
+                equal_nan=True,
+            )
+
+    generator = EventGenerator(path, follow=True, max_events=3, timeout=0)
+    assert len(list(generator)) == 3
+
+    # the header generator reads only the headers of the new events
+    header_path = str(tmpdir.join('growing_headers.dat'))
+    with open(header_path, 'wb') as f:
+        f.write(data[:5 * event_size])
+
+    generator = EventHeaderGenerator(
+        header_path, follow=True, poll_interval=0.001, timeout=0.5
+    )
+    read_ranges = []
+    raw_headers = generator._raw_headers
+
+    def record(first_event, num_events):
+        read_ranges.append((first_event, num_events))
+        return raw_headers(first_event, num_events)
+
+    generator._raw_headers = record
+    thread = threading.Thread(target=daq, args=(header_path, ))
+    thread.start()
+    headers = [event.header for event in generator]
+    thread.join()
+
+    assert [h.event_counter for h in headers] == [e.header.event_counter for e in expected]
+    assert sum(num_events for _, num_events in read_ranges) == 20
+
+
+@pytest.mark.parametrize('version', ['v5_1_05', 'v5_1_0B'])
+def test_next_block(tmpdir, version):
+    from ..io import EventGenerator
+
+    path = write_test_file(str(tmpdir.join('test.dat')), version)
+
+    events = list(EventGenerator(path))
+    blocks = list(EventGenerator(path).iter_blocks(block_size=7))
+    assert [len(block.data) for block in blocks] == [7, 7, 6]
+
+    data = np.concatenate([block.data for block in blocks])
+    delta_t = np.concatenate([block.time_since_last_readout for block in blocks])
+    headers = np.concatenate([block.headers for block in blocks])
+
+    for i, event in enumerate(events):
+        assert headers['event_counter'][i] == event.header.event_counter
+        for gain_id, gain in enumerate(('low', 'high')):
+            assert np.all(data[i, :, gain_id] == event.data[gain])
+            assert np.array_equal(
+                delta_t[i, :, gain_id], event.time_since_last_readout[gain], equal_nan=True
+            )
+
+
+@pytest.mark.parametrize('dtype', ['i2', 'f4'])
+def test_native_dtype(dtype, calib_file):
+    from dragonboard import EventGenerator
+    from dragonboard.calibration import TimelapseCalibration
+
+    path = 'data/random_noise_v5_1_0B.dat'
+    big_endian = EventGenerator(path, max_events=5)
+    native = EventGenerator(path, max_events=5, dtype=dtype)
+
+    for expected, event in zip(big_endian, native):
+        for gain in ('low', 'high'):
+            assert event.data[gain].dtype.isnative
+            assert event.data[gain].dtype.kind == np.dtype(dtype).kind
+            assert np.all(event.data[gain] == expected.data[gain])
+
+    block = EventGenerator(path, max_events=5, dtype=dtype).next_block(5)
+    assert block.data.dtype == np.dtype(dtype)
+
+    # calibrations work on both
+    calib = TimelapseCalibration(calib_file)
+    expected = calib(next(EventGenerator(path)))
+    calibrated = calib(next(EventGenerator(path, dtype=dtype)))
+    for gain in ('low', 'high'):
+        assert np.allclose(calibrated.data[gain], expected.data[gain], atol=1)
+
+
+def test_flat_layout(calib_file):
+    from dragonboard import EventGenerator
+    from dragonboard.io import to_flat, to_structured, gaintypes
+    from dragonboard.calibration import TimelapseCalibration
+
+    path = 'data/random_noise_v5_1_0B.dat'
+    structured = list(EventGenerator(path, max_events=5))
+    flat = list(EventGenerator(path, max_events=5, layout='flat', dtype='i2'))
+
+    for s, f in zip(structured, flat):
+        assert f.data.shape == (8, 2, s.roi)
+        assert f.data.flags.c_contiguous
+        assert f.header.stop_cells.shape == (8, 2)
+        for pixel in range(8):
+            for g, gain in enumerate(gaintypes):
+                assert np.all(f.data[pixel, g] == s.data[pixel][gain])
+                assert f.header.stop_cells[pixel, g] == s.header.stop_cells[pixel][gain]
+                assert np.array_equal(
+                    f.time_since_last_readout[pixel, g],
+                    s.time_since_last_readout[pixel][gain],
+                    equal_nan=True,
+                )
+
+        converted = to_flat(s)
+        assert np.all(converted.data == f.data)
+        back = to_structured(f)
+        for gain in gaintypes:
+            assert np.all(back.data[gain] == s.data[gain])
+            assert np.all(back.header.stop_cells[gain] == s.header.stop_cells[gain])
+
+    calib = TimelapseCalibration(calib_file)
+    expected = calib(structured[-1])
+    calibrated = calib(flat[-1])
+    for g, gain in enumerate(gaintypes):
+        assert np.all(calibrated.data[:, g] == expected.data[gain])
+
+
+def decode_adc_reference(d, roi):
+    ''' the former per channel decoding of read_adc_data '''
+    N = 2 * 8 * roi
+    array = np.empty(8, dtype=[('low', 'i2', roi), ('high', 'i2', roi)])
+    data_odd = d[N // 2:]
+    data_even = d[:N // 2]
+    for channel in range(0, 8, 2):
+        array['high'][channel] = data_even[channel::8]
+        array['low'][channel] = data_even[channel + 1::8]
+        array['high'][channel + 1] = data_odd[channel::8]
+        array['low'][channel + 1] = data_odd[channel + 1::8]
+    return array
+
+
+@pytest.mark.parametrize('roi', [12, 40, 300, 1024])
+def test_decode_adc(roi):
+    from dragonboard.io import decode_adc, gaintypes
+
+    # every word gets its position as value, so each one is checked
+    words = np.arange(2 * 8 * roi).astype('>i2')
+    expected = decode_adc_reference(words, roi)
+    decoded = decode_adc(words, roi)
+
+    assert decoded.shape == (8, 2, roi)
+    for g, gain in enumerate(gaintypes):
+        assert np.all(decoded[:, g] == expected[gain])
+    assert np.all(np.sort(decoded.ravel()) == np.arange(2 * 8 * roi))
+
+    # the batch form decodes every event like the single event form
+    events = np.random.randint(-2**15, 2**15, (5, 2 * 8 * roi)).astype('>i2')
+    batch = decode_adc(events, roi, dtype='f4')
+    assert batch.shape == (5, 8, 2, roi)
+    assert batch.dtype == np.float32
+    for event, result in zip(events, batch):
+        assert np.all(result == decode_adc(event, roi))
+
+
+@pytest.mark.parametrize('version', ['v5_1_05', 'v5_1_0B'])
+def test_delta_t_long_run(tmpdir, version):
+    ''' delta t stays exact after hours of run time '''
+    from ..tools.create_fake_data import (
+        write_header_v5_1_0B, write_header_v5_1_05, write_stop_cells, write_adc_data
+    )
+    from ..io import EventGenerator
+
+    start = 10 * 3600 * 133000000
+    path = str(tmpdir.join('test.dat'))
+    with open(path, 'wb') as f:
+        for event_counter in range(5):
+            clock = start + event_counter * 1000
+            if version == 'v5_1_0B':
+                write_header_v5_1_0B(
+                    f,
+                    pps_counter=0,
+                    event_counter=event_counter,
+                    trigger_counter=event_counter,
+                    counter_10MHz=0,
+                    counter_133MHz=clock,
+                )
+            else:
+                write_header_v5_1_05(
+                    f, event_counter=event_counter, trigger_counter=event_counter, clock=clock,
+                )
+            write_stop_cells(f, np.full(8, 100))
+            write_adc_data(f, np.zeros(16 * 1024))
+
+    generator = EventGenerator(path, layout='flat')
+    expected = generator._timestamp(1000)
+    block = generator.next_block(5)
+
+    assert np.all(np.isnan(block.time_since_last_readout[0]))
+    assert np.allclose(block.time_since_last_readout[1:], expected, rtol=1e-6)
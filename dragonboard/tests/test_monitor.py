@@ -0,0 +1,96 @@
+import json
+import numpy as np
+import pytest
+
+
+def test_run_monitor(tmpdir):
+    from dragonboard.monitor import RunMonitor, publish
+
+    monitor = RunMonitor('data/random_noise_v5_1_0B.dat', window=50, block_size=30)
+    assert monitor.update() == 100
+    assert monitor.update() == 0
+
+    snapshot = monitor.snapshot()
+    assert snapshot['events_total'] == 100
+    assert snapshot['window_events'] == 50
+
+    # the file contains gaussian noise with mean 100 and std 5
+    assert np.allclose(snapshot['baseline']['low'], 100, atol=1)
+    assert np.allclose(snapshot['noise']['high'], 5, atol=0.5)
+    assert snapshot['trigger_rate'] > 0
+
+    histogram = np.array(snapshot['stop_cell_histogram']['low'])
+    assert histogram.shape == (8, 64)
+    assert np.all(histogram.sum(axis=1) == 50)
+
+    # the last stop cell falls into the last bin for any number of bins
+    monitor = RunMonitor('data/random_noise_v5_1_0B.dat', window=50, stop_cell_bins=100)
+    monitor.update()
+    monitor.stop_cells[:] = 4095
+    histogram = np.array(monitor.snapshot()['stop_cell_histogram']['high'])
+    assert histogram.shape == (8, 100)
+    assert np.all(histogram[:, -1] == 50)
+
+    with pytest.raises(ValueError):
+        RunMonitor('data/random_noise_v5_1_0B.dat', stop_cell_bins=0)
+
+    target = str(tmpdir.join('snapshot.json'))
+    publish(snapshot, target)
+    with open(target) as f:
+        assert json.load(f) == json.loads(json.dumps(snapshot))
+
+
+def test_run_monitor_broken_events(tmpdir):
+    from dragonboard.io import EventGenerator
+    from dragonboard.monitor import RunMonitor
+
+    path = str(tmpdir.join('broken.dat'))
+    with open('data/random_noise_v5_1_0B.dat', 'rb') as f:
+        data = bytearray(f.read())
+
+    # break the 0xaaaa marker of the headers of event 12, 13 and 40
+    event_size = EventGenerator('data/random_noise_v5_1_0B.dat').event_size
+    for event in (12, 13, 40):
+        data[event * event_size:event * event_size + 2] = bytes(2)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    monitor = RunMonitor(path, window=200, block_size=30)
+    assert monitor.update() == 97
+    snapshot = monitor.snapshot()
+    assert snapshot['events_total'] == snapshot['window_events'] == 97
+    assert snapshot['broken_events'] == 3
+
+
+def test_publish_udp():
+    import socket
+    from collections import OrderedDict
+    from dragonboard.monitor import RunMonitor, publish, max_datagram_size
+
+    monitor = RunMonitor('data/random_noise_v5_1_0B.dat', window=50)
+    monitor.update()
+    runs = [monitor.snapshot()] * 12
+    snapshot = OrderedDict([('time', 1.5), ('runs', runs)])
+    assert len(json.dumps(snapshot)) > max_datagram_size
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        sock.settimeout(5)
+        port = sock.getsockname()[1]
+        publish(snapshot, 'udp://127.0.0.1:{}'.format(port))
+
+        for run in runs:
+            message = json.loads(sock.recv(max_datagram_size).decode())
+            assert message['time'] == 1.5
+            assert message['runs'] == [json.loads(json.dumps(run))]
+
+    with pytest.raises(ValueError):
+        publish({'data': 'x' * max_datagram_size}, 'udp://127.0.0.1:{}'.format(port))
+
+
+def test_run_monitor_missing_file(tmpdir):
+    from dragonboard.monitor import RunMonitor
+
+    monitor = RunMonitor(str(tmpdir.join('not_yet_written.dat')))
+    assert monitor.update() == 0
+    assert monitor.snapshot()['window_events'] == 0
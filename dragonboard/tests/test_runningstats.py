@@ -28,3 +28,22 @@ def test_std_result():
         rs.add(row)
 
     assert np.all(np.isclose(rs.std, np.std(data, axis=0, ddof=1)))
+
+
+def test_add_many():
+
+    rs = RunningStats(5)
+    data = np.random.normal(1, 2, size=(1000, rs.shape))
+    data[::7, 2] = np.nan
+
+    for block in np.array_split(data, 13):
+        rs.add_many(block)
+
+    assert np.all(rs.n == np.sum(~np.isnan(data), axis=0))
+    assert np.allclose(rs.mean, np.nanmean(data, axis=0))
+    assert np.allclose(rs.std, np.nanstd(data, axis=0, ddof=1))
+
+    rs = RunningStats((2, ))
+    rs.add_many([[1., 2.], [3., 4.]])
+    assert np.all(rs.n == 2)
+    assert np.allclose(rs.mean, [2, 3])
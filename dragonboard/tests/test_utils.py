@@ -17,3 +17,25 @@ def test_cell_in_samples():
     assert cell_in_samples(cell=5, stop_cell=4090, roi=40, total_cells=4096)
 
     assert not cell_in_samples(cell=0, stop_cell=10, roi=40, total_cells=4096)
+
+
+def test_sample2cell_table():
+    import numpy as np
+    from dragonboard import sample2cell, sample2cell_table, stop_cells2cells
+
+    table = sample2cell_table(40)
+    assert table.shape == (4096, 40)
+    assert table.dtype == np.int16
+    assert sample2cell_table(40) is table
+
+    for stop_cell in (0, 17, 4070, 4095):
+        assert np.all(table[stop_cell] == sample2cell(np.arange(40), stop_cell))
+
+    with pytest.raises(ValueError):
+        table[0, 0] = 1
+
+    stop_cells = np.random.randint(0, 4096, size=(10, 8, 2))
+    cells = stop_cells2cells(stop_cells, 40)
+    assert cells.shape == (10, 8, 2, 40)
+    assert cells.dtype == np.int16
+    assert np.all(cells[3, 2, 1] == table[stop_cells[3, 2, 1]])
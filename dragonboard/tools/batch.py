@@ -0,0 +1,151 @@
+'''
+Usage:
+  dragonboard_batch <recipe> <outputfile> [<inputfiles> ...] [-o KEY=VALUE]... [options]
+  dragonboard_batch (-h | --help)
+
+Options:
+  -h --help             Show this screen.
+  --runs FILE           Text file with one input file per line, added to the inputfiles
+  --workdir DIR         Directory for the part files and the manifest,
+                        default is <outputfile>.parts
+  -n <n>, --n-jobs=<n>  Number of files processed in parallel [default: 1]
+  -o --option KEY=VALUE  Option of the recipe, values are parsed as json if possible,
+                        can be given multiple times
+  --overwrite           Overwrite an existing outputfile
+  --no-merge            Only process the files, do not merge the results
+
+Process many raw data files in parallel. Finished files are recorded in a manifest
+in the work directory, running the same command again after an interruption
+only processes the remaining files, see dragonboard.batch.
+
+Recipes and their options:
+
+  dataextraction   dragonboard_dataextraction for every file, merged into one file
+      calib, extra, pipeline: calibration files, see dragonboard_dataextraction
+      layout: 'table' or 'cell' [default: table]
+      compact_delta_t: true or false
+      memory: fraction of memory per process in percent [default: 20]
+
+  timelapse        calc_timelapse_constants, the samples of every file are
+                   read in parallel, the fit uses all of them
+      max_events, skip_begin, skip_end, do_channel8, compact_delta_t:
+          see calc_timelapse_constants
+      fit_jobs: number of processes for the fit, default all cpus
+'''
+import json
+import logging
+import sys
+import numpy as np
+from docopt import docopt
+
+from dragonboard.batch import Recipe, BatchError, run_batch
+from dragonboard.fitting import write_result
+from dragonboard.tools.dataextraction import extract_data, merge_parts
+from dragonboard.tools.calc_timelapse_constants import read_file, fit_samples
+
+logging.basicConfig(level=logging.INFO)
+
+
+def process_dataextraction(inputfile, partfile, options):
+    extract_data(
+        [inputfile],
+        outpath=partfile,
+        memory=float(options.get('memory', 20)),
+        calibpath=options.get('calib'),
+        extrapath=options.get('extra'),
+        pipelinepath=options.get('pipeline'),
+        compact_delta_t=bool(options.get('compact_delta_t', False)),
+    )
+
+
+def merge_dataextraction(inputfiles, partfiles, outputfile, options):
+    merge_parts(partfiles, outputfile, layout=options.get('layout', 'table'))
+
+
+def _timelapse_pixels(options):
+    return list(range(8 if options.get('do_channel8') else 7))
+
+
+def process_timelapse(inputfile, partfile, options):
+    channel, cell, delta_t, adc = read_file(
+        inputfile,
+        _timelapse_pixels(options),
+        int(options.get('skip_begin', 5)),
+        int(options.get('skip_end', 5)),
+        max_events=options.get('max_events'),
+        compact_delta_t=bool(options.get('compact_delta_t', False)),
+    )
+    with open(partfile, 'wb') as f:
+        np.savez(f, channel=channel, cell=cell, delta_t=delta_t, adc=adc)
+
+
+def merge_timelapse(inputfiles, partfiles, outputfile, options):
+    columns = {'channel': [], 'cell': [], 'delta_t': [], 'adc': []}
+    for partfile in partfiles:
+        with np.load(partfile) as part:
+            for name, values in columns.items():
+                values.append(part[name])
+
+    result = fit_samples(
+        *(np.concatenate(columns.pop(name)) for name in ('channel', 'cell', 'delta_t', 'adc')),
+        do_channel8=bool(options.get('do_channel8')),
+        n_jobs=options.get('fit_jobs'),
+    )
+    write_result(outputfile, result, inputfiles=inputfiles)
+
+
+recipes = {
+    recipe.name: recipe
+    for recipe in (
+        Recipe('dataextraction', process_dataextraction, merge_dataextraction, '.hdf5'),
+        Recipe('timelapse', process_timelapse, merge_timelapse, '.npz'),
+    )
+}
+
+
+def parse_option(option):
+    key, sep, value = option.partition('=')
+    if not sep:
+        raise ValueError('Options have to be given as KEY=VALUE, got {!r}'.format(option))
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    return key, value
+
+
+def main():
+    args = docopt(__doc__)
+
+    if args['<recipe>'] not in recipes:
+        sys.exit('Unknown recipe {!r}, available are: {}'.format(
+            args['<recipe>'], ', '.join(recipes)
+        ))
+
+    inputfiles = list(args['<inputfiles>'])
+    if args['--runs']:
+        with open(args['--runs']) as f:
+            inputfiles.extend(line.strip() for line in f if line.strip())
+    if not inputfiles:
+        sys.exit('No input files given')
+
+    options = dict(parse_option(option) for option in args['--option'])
+
+    try:
+        run_batch(
+            recipes[args['<recipe>']],
+            inputfiles,
+            args['<outputfile>'],
+            options=options,
+            workdir=args['--workdir'],
+            n_jobs=int(args['--n-jobs']),
+            overwrite=args['--overwrite'],
+            merge=not args['--no-merge'],
+            verbose=5,
+        )
+    except (FileExistsError, BatchError) as e:
+        sys.exit(str(e))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,94 +3,81 @@ Usage:
     dragonboard_calc_calib_constants <inputfile> <outputfile> [options]
 
 Options:
-    -n <n>, --n-jobs=<n>     How many threads to use [default: 1]
-    -v <v>, --verbosity=<v>  Verbosity of joblib [default: 5]
+    -n <n>, --n-jobs=<n>     How many processes to use, default all cpus
+    --overwrite              Overwrite an existing outputfile
 
 fit raw data with powerlaw a*x**b+c and calculate chisquare for every fit.
 data is contained in a pandas data frame.
-inputfile: .h5 file generated by dragonboard_dataextraction without using a calibration
+inputfile: .h5 file generated by dragonboard_dataextraction without using a calibration,
+           in the table or the cell sorted layout
+outputfile: hdf5 file, or a calibration bundle if it ends with .dcal
 '''
 
 import pandas as pd
-from scipy.optimize import curve_fit
-from joblib import Parallel, delayed
 import numpy as np
 import logging
 import os
 import sys
 from docopt import docopt
+import tables
 
-logging.basicConfig(level=logging.INFO)
+from dragonboard.io import gaintypes, max_roi, num_channels, num_gains
+from dragonboard.cell_sorted import CellSortedFile, layout_name
+from dragonboard.fitting import sort_samples, fit_timelapse, write_result
 
+logging.basicConfig(level=logging.INFO)
 
-def f(x, a, b, c):
-    return a * x ** b + c
 
+def is_cell_sorted(path):
+    with tables.open_file(path, mode='r') as f:
+        return getattr(f.root._v_attrs, 'layout', None) == layout_name
 
-def fit(df, cell, plot=False):
-    big_time = df.delta_t.quantile(0.75)
-    p0 = [
-        1.3,
-        -0.38,
-        df.adc_counts[df.delta_t >= big_time].mean(),
-    ]
-    try:
-        (a, b, c), cov = curve_fit(
-            f,
-            df['delta_t'],
-            df['adc_counts'],
-            p0=p0,
-        )
-    except RuntimeError:
-        logging.error('Could not fit cell {}'.format(cell))
-        return np.full(4, np.nan)
 
-    ndf = len(df.index) - 3
-    residuals = df['adc_counts'] - f(df['delta_t'], a, b, c)
-    chisquare = np.sum(residuals**2) / ndf
+def read_channel(path, pixel, channel):
+    ''' return cell, sample, delta_t and adc_counts of a channel '''
+    if is_cell_sorted(path):
+        with CellSortedFile(path) as f:
+            columns = ('sample', 'delta_t', 'adc_counts')
+            data = f.channel(pixel, channel, columns=columns)
+            cell_start, cell_stop = f.index(pixel, channel)
+        cell = np.repeat(np.arange(max_roi), cell_stop - cell_start)
+        return (cell, ) + tuple(data[column] for column in columns)
 
-    return a, b, c, chisquare
+    df = pd.read_hdf(path, 'pixel_{}_{}'.format(pixel, channel))
+    return tuple(df[column].values for column in ('cell', 'sample', 'delta_t', 'adc_counts'))
 
 
 def main():
     args = docopt(__doc__)
+    n_jobs = int(args['--n-jobs']) if args['--n-jobs'] else None
+
+    if os.path.isfile(args['<outputfile>']) and not args['--overwrite']:
+        sys.exit('Outputfile {} exists, use --overwrite to replace it'.format(args['<outputfile>']))
+
+    parts = []
+    for pixel in range(num_channels):
+        for gain, channel in enumerate(gaintypes):
+            logging.info('reading %s  %s', pixel, channel)
+            cell, sample, delta_t, adc = read_channel(args['<inputfile>'], pixel, channel)
+
+            sample_max = sample.max() - 5
+            sample_min = sample.min() + 5
+            valid = (sample >= sample_min) & (sample < sample_max)
+
+            channel_id = np.full(np.count_nonzero(valid), pixel * num_gains + gain, dtype='u1')
+            parts.append((channel_id, cell[valid], delta_t[valid], adc[valid]))
+
+    channel, cell, delta_t, adc = (np.concatenate(column) for column in zip(*parts))
+    del parts
+    delta_t, adc, cell_start, cell_stop = sort_samples(channel, cell, delta_t, adc)
+    del channel, cell
+
+    logging.info('fitting')
+    result = fit_timelapse(delta_t, adc, cell_start, cell_stop, n_jobs=n_jobs, progress=True)
+    # failed fits and cells without data are nan
+    result[np.isnan(result[..., 3])] = np.nan
 
-    pool = Parallel(int(args['--n-jobs']), verbose=int(args['--verbosity']))
-    ids = np.arange(4096)
-
-    if os.path.isfile(args['<outputfile>']):
-        answer = input('Outputfile exists, overwrite? (y / [n]): ')
-        if not answer.lower().startswith('y'):
-            sys.exit()
-
-    with pd.HDFStore(args['<outputfile>'], 'w') as store:
-        for pixel in range(8):
-            for channel in ('low', 'high'):
-                logging.info('%s  %s', pixel, channel)
-                data = pd.read_hdf(
-                    args['<inputfile>'],
-                    'pixel_{}_{}'.format(pixel, channel)
-                )
-
-
-                sample_max = data["sample"].max() - 5
-                sample_min = data["sample"].min() + 5
-
-                data = data[
-                    (data['sample'] >= sample_min) 
-                    & (data['sample'] < sample_max)
-                ]
-
-                by_cell = data.groupby('cell')
-                result = pd.DataFrame(
-                    pool(delayed(fit)(df, name) for name, df in by_cell),
-                    columns=['a', 'b', 'c', 'chisq_ndf']
-                )
-                result['pixel'] = pixel
-                result['channel'] = channel
-                result['cell'] = ids
-
-                store.append('data', result, min_itemsize={'channel': 4})
+    write_result(args['<outputfile>'], result, inputfiles=[args['<inputfile>']])
 
 
 if __name__ == '__main__':
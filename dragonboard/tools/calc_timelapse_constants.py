@@ -7,66 +7,110 @@ Options:
   --skip_begin N    integer; number of start-samples to be skipped for fitting [default: 5]
   --skip_end N      integer; number of end-samples to be skipped for fitting [default: 5]
   --do_channel8     fit also channel 8 values
+  --profile         print time spent per processing stage for each file
+  -n <n>, --n-jobs=<n>  number of processes used for fitting, default all cpus
+  --compact-delta-t  keep delta_t as log-quantised uint16 until the fit of each cell,
+                     see dragonboard.delta_t
+  --overwrite       overwrite an existing outputfile
+
+outputfile: hdf5 file, or a calibration bundle if it ends with .dcal
 '''
 
 import os
 import sys
-import psutil
 import logging
 from tqdm import tqdm
 from docopt import docopt
 
-from joblib import Parallel, delayed
-
 import numpy as np
 
-import pandas as pd
-
-import scipy.sparse
-from scipy.sparse import lil_matrix, coo_matrix
-from scipy.optimize import curve_fit
 
 import dragonboard as dr
+from dragonboard.io import num_gains, stop_cells_to_array
+from dragonboard.fitting import sort_samples, fit_timelapse, write_result
+from dragonboard.delta_t import valid as valid_delta_t
 
 logging.basicConfig(level=logging.DEBUG)
 
 
-from array import array
-
-def f(x, a, b, c):
-    return a * x ** b + c
-
-
-def fit(adc, delta_t, cell):
-    a0 = 1.3
-    b0 = -0.38
-    c0 = 0
-
-    if not len(adc):
-        return a0, b0, c0, np.nan
-
-    big_time = np.percentile(delta_t, 75)
-    p0 = [
-        1.3,
-        -0.38,
-        adc[delta_t >= big_time].mean(),
-    ]
-    try:
-        (a, b, c), cov = curve_fit(
-            f,
-            delta_t,
-            adc,
-            p0=p0,
-        )
-    except (RuntimeError, TypeError):
-        logging.error('Could not fit cell {}'.format(cell))
-        return p0[0], p0[1], p0[2], np.nan
-
-    ndf = len(adc) - 3
-    residuals = adc - f(delta_t, a, b, c)
-    chisquare = np.sum(residuals**2) / ndf
+def read_samples(generator, pixels, skip_begin, skip_end):
+    ''' read all samples with a valid delta_t of the given pixels
+
+    returns flat arrays of channel (pixel * num_gains + gain), cell,
+    delta_t and adc counts, delta_t is compact if the generator's is
+    '''
+    channel = np.array(pixels)[:, np.newaxis] * num_gains + np.arange(num_gains)
+
+    samples = slice(skip_begin, -skip_end if skip_end else None)
+    parts = []
+    for block in tqdm(
+            iterable=generator.iter_blocks(),
+            desc=os.path.basename(generator.path),
+            leave=True,
+            unit=' blocks',
+            ):
+        cells = dr.stop_cells2cells(
+            stop_cells_to_array(block.headers['stop_cells']), block.roi
+        )[:, pixels, :, samples]
+        delta_t = block.time_since_last_readout[:, pixels, :, samples]
+        adc = block.data[:, pixels, :, samples]
+
+        valid = valid_delta_t(delta_t)
+        parts.append((
+            np.broadcast_to(channel[:, :, np.newaxis], delta_t.shape)[valid].astype('u1'),
+            cells[valid],
+            delta_t[valid],
+            adc[valid],
+        ))
+
+    return parts
+
+
+def read_file(
+        path,
+        pixels,
+        skip_begin,
+        skip_end,
+        max_events=None,
+        profile=False,
+        compact_delta_t=False,
+        ):
+    ''' return channel, cell, delta_t and adc counts of the samples of a file,
+    see read_samples
+    '''
+    eg = dr.EventGenerator(
+        path,
+        max_events=max_events,
+        profile=profile,
+        compact_delta_t=compact_delta_t,
+    )
+    parts = read_samples(eg, pixels, skip_begin, skip_end)
+
+    if profile:
+        print(eg.stats().summary())
+
+    if not parts:
+        dtypes = ('u1', 'i2', 'u2' if compact_delta_t else 'f4', 'i2')
+        return tuple(np.empty(0, dtype=dtype) for dtype in dtypes)
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+
+def fit_samples(channel, cell, delta_t, adc, do_channel8=False, n_jobs=None):
+    ''' fit the samples of all files, see read_file,
+    returns the result of dragonboard.fitting.fit_timelapse
+    '''
+    delta_t, adc, cell_start, cell_stop = sort_samples(channel, cell, delta_t, adc)
+    del channel, cell
+
+    result = fit_timelapse(
+        delta_t, adc, cell_start, cell_stop, n_jobs=n_jobs, progress=True
+    )
+    if not do_channel8:
+        # We need to put nans for channel 8 into the output file, since the
+        # rest of the system expects this data to be there ... even if it its nan.
+        result[7] = np.nan
+    return result
 
-    return a, b, c, chisquare
 
 def main():
     args = docopt(__doc__)
@@ -74,81 +118,37 @@ def main():
     args["--skip_begin"] = int(args["--skip_begin"])
     args["--skip_end"] = int(args["--skip_end"])
     args["--do_channel8"] = bool(args["--do_channel8"])
+    n_jobs = int(args['--n-jobs']) if args['--n-jobs'] else None
     print(args['<outputfile>'])
-    if os.path.isfile(args['<outputfile>']):
-        answer = input('Outputfile {} exists. Do you want to overwrite? y/[n] '.format(args['<outputfile>']))
-        if not answer.lower().startswith('y'):
-            sys.exit()
+    if os.path.isfile(args['<outputfile>']) and not args['--overwrite']:
+        sys.exit('Outputfile {} exists, use --overwrite to replace it'.format(args['<outputfile>']))
 
-
-    store = pd.HDFStore(args['<outputfile>'], 'w')
-
-
-
-    adc = {}
-    delta_t = {}
-    for pixel in range(8 if args["--do_channel8"] else 7):
-        for gain in ["high", "low"]:
-            adc[pixel, gain] = [array('H') for i in range(4096)]
-            delta_t[pixel, gain] = [array('f') for i in range(4096)]
-    if not args["--do_channel8"]:
-        # We need to put nans for channel 8 into the output file, since the
-        # rest of the system expects this data to be there ... even if it its nan.
-        result = pd.DataFrame( np.full((4096, 4), np.nan),
-            columns=['a', 'b', 'c', 'chisq_ndf']
-        )
-        result['pixel'] = 7
-        result['channel'] = "high"
-        result['cell'] = np.arange(4096)
-        store.append('data', result, min_itemsize={'channel': 4})
-
-        result['channel'] = "low"
-        store.append('data', result, min_itemsize={'channel': 4})
+    pixels = list(range(8 if args["--do_channel8"] else 7))
 
     print("reading raw file(s) into memory:")
-    for eg in [dr.EventGenerator(filename, max_events=args["--max_events"]) for filename in args["<inputfiles>"]]:
-        sample_ids = np.arange(eg.roi)
-
-        for event in tqdm(
-                iterable=eg,
-                desc=os.path.basename(eg.path),
-                leave=True,
-                unit=' events',
-                ):
-
-            for pixel, gain in sorted(adc.keys()):
-                sc = event.header.stop_cells[pixel][gain]
-                skip_slice = slice(args["--skip_begin"], -args["--skip_end"])
-                cell_ids = dr.sample2cell(sample_ids, sc)[skip_slice]
-                data = event.data[pixel][gain][skip_slice]
-                delta_ts = event.time_since_last_readout[pixel][gain][skip_slice]
-                for i, cid in enumerate(cell_ids):
-                    delta_t[pixel, gain][cid].append(delta_ts[i])
-                    adc[pixel, gain][cid].append(data[i])
-
-    for key in sorted(adc.keys()):
-        # adc and delta_t have the same keys
-        for i in tqdm(range(4096), desc=str(key)):
-            adc[key][i] = np.array(adc[key][i], dtype=adc[key][i].typecode)
-            delta_t[key][i] = np.array(delta_t[key][i], dtype=delta_t[key][i].typecode)
-
-            adc[key][i] = adc[key][i][~np.isnan(delta_t[key][i])]
-            delta_t[key][i] = delta_t[key][i][~np.isnan(delta_t[key][i])]
-
+    parts = [
+        read_file(
+            filename,
+            pixels,
+            args["--skip_begin"],
+            args["--skip_end"],
+            max_events=args["--max_events"],
+            profile=args["--profile"],
+            compact_delta_t=args["--compact-delta-t"],
+        )
+        for filename in args["<inputfiles>"]
+    ]
+    channel, cell, delta_t, adc = (np.concatenate(column) for column in zip(*parts))
+    del parts
 
     print("fitting")
-    pool = Parallel(max(psutil.cpu_count()-1, 1))
-    for key in tqdm(iterable=sorted(adc.keys()), leave=True):
-        result = pd.DataFrame(
-            pool(delayed(fit)(adc[key][i], delta_t[key][i], i) for i in range(4096)),
-            columns=['a', 'b', 'c', 'chisq_ndf']
-        )
-        pixel, channel = key
-        result['pixel'] = pixel
-        result['channel'] = channel
-        result['cell'] = np.arange(4096)
+    result = fit_samples(
+        channel, cell, delta_t, adc, do_channel8=args["--do_channel8"], n_jobs=n_jobs
+    )
+    del channel, cell, delta_t, adc
+
+    write_result(args['<outputfile>'], result, inputfiles=args['<inputfiles>'])
 
-        store.append('data', result, min_itemsize={'channel': 4})
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,46 @@
+'''
+Check dragonboard files for broken or truncated events
+
+Usage:
+    dragonboard_check_integrity <inputfiles>... [options]
+
+Options:
+    --index-dir=<dir>   Save the byte offsets of all valid events
+                        as <dir>/<inputfile>.valid_events.npy
+
+Exits with status 1 if any of the files has problems.
+'''
+import os
+import sys
+import numpy as np
+from docopt import docopt
+
+from dragonboard import scan
+
+
+def main():
+    args = docopt(__doc__)
+
+    if args['--index-dir']:
+        os.makedirs(args['--index-dir'], exist_ok=True)
+
+    all_ok = True
+    for path in args['<inputfiles>']:
+        report = scan(path)
+        all_ok &= report.ok
+        print(report.summary())
+
+        if args['--index-dir']:
+            np.save(
+                os.path.join(
+                    args['--index-dir'],
+                    os.path.basename(path) + '.valid_events.npy'
+                ),
+                report.offsets,
+            )
+
+    sys.exit(0 if all_ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+'''
+Convert calibration constants into a calibration bundle
+
+Usage:
+    dragonboard_convert_calibration <inputfile> <outputfile> --kind=<kind> [options]
+
+Options:
+    --kind=<kind>   Kind of the constants, one of
+                    timelapse: fit results of dragonboard_calc_calib_constants
+                    offsets: output of scripts/offset_cell_sample.py
+                    pattern: output of scripts/extract_pattern.py
+    --verify        Load the written bundle again and compare the checksum
+'''
+from docopt import docopt
+
+from dragonboard.calibration import load_timelapse_constants, load_offsets, load_pattern
+from dragonboard.calibration_bundle import write_bundle, load_bundle
+
+
+def main():
+    args = docopt(__doc__)
+    kind = args['--kind']
+
+    if kind == 'timelapse':
+        arrays = load_timelapse_constants(args['<inputfile>'])
+    elif kind == 'offsets':
+        arrays = {'offsets': load_offsets(args['<inputfile>'])}
+    elif kind == 'pattern':
+        arrays = {'pattern': load_pattern(args['<inputfile>'])}
+    else:
+        raise ValueError('Unknown kind {!r}'.format(kind))
+
+    shape = next(iter(arrays.values())).shape
+    write_bundle(
+        args['<outputfile>'],
+        kind,
+        arrays,
+        num_pixels=shape[0],
+        num_samples=shape[3] if len(shape) > 3 else None,
+        source=args['<inputfile>'],
+    )
+
+    if args['--verify']:
+        print(load_bundle(args['<outputfile>'], kind=kind, verify=True))
+
+
+if __name__ == '__main__':
+    main()
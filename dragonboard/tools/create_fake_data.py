@@ -62,7 +62,7 @@ def write_adc_data(f, data):
 
 
 def write_stop_cells(f, stop_cells):
-    stop_cells = stop_cells.astype('<i2')
+    stop_cells = stop_cells.astype('>u2')
     stop_cells.tofile(f)
 
 
@@ -10,7 +10,13 @@ Options:
   --outpath N   Outputfile path [default: data.hdf5]
   -c --calib P  Path to calibration file
   -e --extra P  Path to extra offset file
+  -p --pipeline P  Path to a calibration pipeline config file, overrides -c and -e
   --memory M    fraction of computer mem to use in percent [default: 20]
+  --profile     Print time spent per processing stage for each file
+  --layout L    Layout of the output, 'table': one table per channel in event order,
+                'cell': sorted by cell, see dragonboard.cell_sorted [default: table]
+  --compact-delta-t  Keep delta_t as log-quantised uint16 in memory,
+                     see dragonboard.delta_t, it is written as float32
 Save (cell, sample, time_since_last_readout, adc_counts) to an hdf5 file
 for all given inputfiles.
 inputfiles: raw_data.dat
@@ -23,21 +29,23 @@ from docopt import docopt
 import pandas as pd
 from collections import defaultdict
 import numpy as np
-from dragonboard.calibration import TimelapseCalibration
-from dragonboard.calibration import TimelapseCalibrationExtraOffsets
-from dragonboard.calibration import MedianTimelapseExtraOffsets
-from dragonboard.calibration import NoCalibration
+from dragonboard.calibration import CalibrationPipeline
+from dragonboard.io import gaintypes
+from dragonboard.cell_sorted import sort_by_cell
+from dragonboard.delta_t import as_float, valid as valid_delta_t
 
 import psutil
 
 
 def write(store, data):
     for (pixel, gain), value in data.items():
-        df = pd.DataFrame(value)
+        df = pd.DataFrame({
+            column: np.concatenate(arrays) for column, arrays in value.items()
+        })
         df['sample'] = df['sample'].astype('int16')
         df['adc_counts'] = df['adc_counts'].astype('int16')
         df['cell'] = df['cell'].astype('int16')
-        df['delta_t'] = df['delta_t'].astype('float32')
+        df['delta_t'] = as_float(df['delta_t'].values).astype('float32')
 
         store.append(
             'pixel_{}_{}'.format(pixel, gain),
@@ -45,14 +53,34 @@ def write(store, data):
         )
 
 
+def merge_parts(partfiles, outpath, layout='table', chunksize=1000000):
+    ''' merge the outputs of extract_data for single files into outpath,
+    appending the tables of all channels in the order of partfiles
+    '''
+    tablepath = outpath + '.tmp' if layout == 'cell' else outpath
+    with pd.HDFStore(tablepath, mode='w', comp_level=5, comp_lib='blosc') as store:
+        for partfile in partfiles:
+            with pd.HDFStore(partfile, mode='r') as part:
+                for key in part.keys():
+                    for chunk in part.select(key, chunksize=chunksize):
+                        store.append(key, chunk)
+
+    if layout == 'cell':
+        sort_by_cell(tablepath, outpath)
+        os.remove(tablepath)
+
+
 def extract_data(
         inputfiles,
         outpath,
         memory,
         calibpath=None,
         extrapath=None,
+        pipelinepath=None,
         a=None,
         b=None,
+        profile=False,
+        compact_delta_t=False,
         ):
     '''
     calculate time lapse dependence for a given capacitor
@@ -62,19 +90,16 @@ def extract_data(
     calibpath: TimelapseCalibration
     extrapath: MedianTimelapseExtraOffsets
     calibpath and extrapath: TimelapseCalibrationExtraOffsets
+    pipelinepath: CalibrationPipeline.from_config(pipelinepath)
+
+    With compact_delta_t, the delta_t of the samples are kept as uint16 codes
+    until they are written, halving their memory.
     '''
-    if extrapath and not calibpath:
-        print('using: MedianTimelapseExtraOffsets')
-        calib = MedianTimelapseExtraOffsets(extrapath)
-    elif extrapath and calibpath:
-        print('using: TimelapseCalibrationExtraOffsets')
-        calib = TimelapseCalibrationExtraOffsets(calibpath, extrapath)
-    elif not extrapath and calibpath:
-        print('using: TimelapseCalibration')
-        calib = TimelapseCalibration(calibpath)
+    if pipelinepath:
+        calib = CalibrationPipeline.from_config(pipelinepath)
     else:
-        print('using: --')
-        calib = NoCalibration()
+        calib = CalibrationPipeline.from_files(calibpath, extrapath)
+    print('using: {}'.format(calib))
 
     p = psutil.Process(os.getpid())
 
@@ -84,34 +109,43 @@ def extract_data(
         for filename in sorted(inputfiles):
             data = defaultdict(lambda: defaultdict(list))
 
+            generator = dr.EventGenerator(
+                filename,
+                profile=profile,
+                dtype='i2',
+                layout='flat',
+                compact_delta_t=compact_delta_t,
+            )
+            calibrate = calib
+            if profile:
+                calibrate = calib.instrument(generator.stats())
+
             for event in tqdm(
-                    iterable=dr.EventGenerator(filename),
+                    iterable=generator,
                     desc=os.path.basename(filename),
                     leave=True,
                     unit=' events',
                     ):
 
-                event = calib(event)
+                event = calibrate(event)
 
-                if sample_ids is None or sample_ids.shape != event.roi:
+                if sample_ids is None or sample_ids.shape != (event.roi, ):
                     sample_ids = np.arange(event.roi)
+                    cell_table = dr.sample2cell_table(event.roi)
 
-                for pixel, pixel_data in enumerate(event.data):
-                    for gain in pixel_data.dtype.names:
+                cells = cell_table[event.header.stop_cells]
+                valid = valid_delta_t(event.time_since_last_readout)
 
-                        stop_cell = event.header.stop_cells[pixel][gain]
+                for pixel, gain in np.ndindex(*valid.shape[:2]):
+                    v = valid[pixel, gain]
+                    if not np.any(v):
+                        continue
 
-                        delta_ts = event.time_since_last_readout[pixel][gain]
-                        valid = np.logical_not(np.isnan(delta_ts))
-                        if not np.any(valid):
-                            continue
-
-                        data[(pixel, gain)]['delta_t'].extend(delta_ts[valid])
-                        data[(pixel, gain)]['cell'].extend(
-                            dr.sample2cell(sample_ids[valid], stop_cell)
-                        )
-                        data[(pixel, gain)]['sample'].extend(sample_ids[valid])
-                        data[(pixel, gain)]['adc_counts'].extend(pixel_data[gain][valid])
+                    channel = data[(pixel, gaintypes[gain])]
+                    channel['delta_t'].append(event.time_since_last_readout[pixel, gain][v])
+                    channel['cell'].append(cells[pixel, gain][v])
+                    channel['sample'].append(sample_ids[v])
+                    channel['adc_counts'].append(event.data[pixel, gain][v])
 
                 if p.memory_percent() > memory:
                     write(store, data)
@@ -119,20 +153,38 @@ def extract_data(
 
             write(store, data)
 
+            if profile:
+                print(generator.stats().summary())
+
 
 def main():
     args = docopt(
         __doc__, version='Dragon Board Time-Dependent Offset Calculation v.1.0'
     )
     args['--memory'] = float(args['--memory'])
+    if args['--layout'] not in ('table', 'cell'):
+        raise ValueError('Unknown layout {!r}'.format(args['--layout']))
+
+    outpath = args['--outpath']
+    if args['--layout'] == 'cell':
+        outpath += '.tmp'
+
     extract_data(
         args['<inputfiles>'],
-        outpath=args['--outpath'],
+        outpath=outpath,
         calibpath=args['--calib'],
         extrapath=args['--extra'],
-        memory=args['--memory']
+        pipelinepath=args['--pipeline'],
+        memory=args['--memory'],
+        profile=args['--profile'],
+        compact_delta_t=args['--compact-delta-t'],
     )
 
+    if args['--layout'] == 'cell':
+        print('sorting by cell')
+        sort_by_cell(outpath, args['--outpath'])
+        os.remove(outpath)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,47 @@
+'''
+Follow run files while they are written and publish rolling quality metrics
+
+Usage:
+    dragonboard_monitor <inputfiles>... [options]
+
+Options:
+    -o <target>, --output=<target>  json file to write, or udp://host:port
+                                    [default: dragonboard_monitor.json]
+    -w <N>, --window=<N>            Number of events in the sliding window [default: 1000]
+    -i <s>, --interval=<s>          Seconds between two snapshots [default: 1]
+    -b <N>, --block-size=<N>        Maximum number of events decoded at once [default: 100]
+    --poll=<s>                      Seconds to wait for new data [default: 0.1]
+
+Over udp, every run is sent as a datagram of its own, see dragonboard.monitor.publish.
+'''
+import sys
+from docopt import docopt
+
+from dragonboard.monitor import RunMonitor, run_monitors
+
+
+def main():
+    args = docopt(__doc__)
+
+    monitors = [
+        RunMonitor(
+            path,
+            window=int(args['--window']),
+            block_size=int(args['--block-size']),
+        )
+        for path in args['<inputfiles>']
+    ]
+
+    try:
+        run_monitors(
+            monitors,
+            args['--output'],
+            interval=float(args['--interval']),
+            poll_interval=float(args['--poll']),
+        )
+    except KeyboardInterrupt:
+        sys.stderr.write('\rReceived SIGINT, terminating\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
+from functools import lru_cache
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 from .io import max_roi
 
 
@@ -24,3 +26,35 @@ def cell_in_samples(cell, stop_cell, roi, total_cells=max_roi):
     assert np.all(cell < total_cells)
 
     return cell2sample(cell, stop_cell, total_cells) < roi
+
+
+@lru_cache(maxsize=None)
+def sample2cell_table(roi, total_cells=max_roi):
+    '''
+    Return a read-only table of shape (total_cells, roi),
+    row stop_cell contains the physical cells of the samples 0 to roi - 1,
+    so sample2cell_table(roi)[stop_cell] is the same as
+    sample2cell(np.arange(roi), stop_cell) without any new allocation.
+
+    The table is a strided view into a single array of length total_cells + roi
+    and is created only once per roi.
+    The cells are int16, so indexing the table with many stop cells,
+    see stop_cells2cells, creates a quarter of the data of int64 cells.
+    '''
+    assert roi <= total_cells
+
+    dtype = 'i2' if total_cells <= np.iinfo('i2').max + 1 else 'i8'
+    cells = (np.arange(total_cells + roi) % total_cells).astype(dtype)
+    step = cells.strides[0]
+    return as_strided(
+        cells, shape=(total_cells, roi), strides=(step, step), writeable=False
+    )
+
+
+def stop_cells2cells(stop_cells, roi, total_cells=max_roi):
+    '''
+    Convert an array of stop cells, e.g. of shape (n_events, 8, 2),
+    into the physical cells of all samples with shape (n_events, 8, 2, roi),
+    int16 like sample2cell_table
+    '''
+    return sample2cell_table(roi, total_cells)[stop_cells]
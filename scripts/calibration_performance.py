@@ -5,7 +5,8 @@ Usage:
 Options:
     -n <cores>       Cores to use [default: 1]
     -v <verbosity>   Verbosity [default: 10]
-    -m <max_events>  Maximum number of Events
+    -m <max_events>  Maximum number of Events, including the skipped ones
+    -b <block_size>  Number of events calibrated at once [default: 100]
     --skip=<N>       Number of events to skip at start [default: 0]
     --start=<N>      First sample to consider
     --end=<N>        Last sample to consider, negative numbers count from end
@@ -15,41 +16,13 @@ inputfile: .dat file
 fit constants: fit_delta_t.py output file
 offsets: offsets_cell_sample.py output file
 '''
-from dragonboard import EventGenerator
+from dragonboard.analysis.calibration_performance import evaluate_calibrations
 from dragonboard.calibration import TimelapseCalibration
 from dragonboard.calibration import TimelapseCalibrationExtraOffsets
 from dragonboard.calibration import MedianTimelapseExtraOffsets
 from dragonboard.calibration import MedianTimelapseCalibration
 from dragonboard.calibration import NoCalibration
-from joblib import Parallel, delayed
-import numpy as np
-import pandas as pd
 from docopt import docopt
-from collections import defaultdict
-
-
-def calc_data(event, start=None, end=None):
-    data = defaultdict(dict)
-
-    sl = slice(start, end)
-
-    for calib in calibs:
-        key = calib.__class__.__name__
-        event_calib = calib(event)
-
-        for pixel in range(7):
-            for channel in event.data.dtype.names:
-
-                idx = (event.header.event_counter, pixel, channel)
-
-                data[key + '_mean'][idx] = np.mean(event_calib.data[pixel][channel][sl])
-                data[key + '_std'][idx] = np.std(event_calib.data[pixel][channel][sl])
-                data[key + '_min'][idx] = np.min(event_calib.data[pixel][channel][sl])
-                data[key + '_max'][idx] = np.max(event_calib.data[pixel][channel][sl])
-
-    df = pd.DataFrame(data)
-    df.index.names = 'event', 'pixel', 'channel'
-    return df
 
 
 if __name__ == '__main__':
@@ -68,24 +41,16 @@ if __name__ == '__main__':
         MedianTimelapseCalibration(args['<fit_constants>']),
     ]
 
-    events = EventGenerator(
+    data = evaluate_calibrations(
         args['<inputfile>'],
+        calibs,
         max_events=int(args['-m']) if args['-m'] else None,
+        skip=int(args['--skip']),
+        start=int(args['--start']) if args['--start'] else None,
+        end=int(args['--end']) if args['--end'] else None,
+        block_size=int(args['-b']),
+        n_jobs=int(args['-n']),
+        verbose=int(args['-v']),
     )
 
-    for i in range(int(args['--skip'])):
-        next(events)
-
-    start = int(args['--start']) if args['--start'] else None
-    end = int(args['--end']) if args['--end'] else None
-
-    with Parallel(int(args['-n']), verbose=int(args['-v'])) as pool:
-
-        data = pd.concat(
-            pool(
-                delayed(calc_data)(event, start=start, end=end)
-                for event in events
-            )
-        )
-
-    data.to_hdf(args['<outputfile>'], 'timeseries_full_data')
+    data.to_hdf(args['<outputfile>'], key='timeseries_full_data')
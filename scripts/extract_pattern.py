@@ -3,12 +3,17 @@ Calculate the remaining offset in the first ten slices
 after TimeLapseCalibration.
 
 Usage:
-    extract_pattern <cstc_file> <outputfile>
+    extract_pattern <cstc_file> <outputfile> [options]
+
+Options:
+    --chunksize=<N>  Number of rows read at once [default: 1000000]
 '''
-import pandas as pd
 from tqdm import tqdm
+import pandas as pd
 from docopt import docopt
 
+from dragonboard.analysis.grouped_stats import grouped_stats
+
 
 if __name__ == '__main__':
     args = docopt(__doc__)
@@ -18,15 +23,12 @@ if __name__ == '__main__':
             for pixel in range(7):
                 for channel in ('low', 'high'):
 
-                    df = pd.read_hdf(
+                    mean = grouped_stats(
                         args['<cstc_file>'],
-                        'pixel_{}_{}'.format(pixel, channel)
-                    )
-                    df = df[df['sample'] <= 10]
-
-                    mean = df.groupby(['cell', 'sample'])['adc_counts'].agg(
-                        ['mean', 'std']
-                    )
+                        'pixel_{}_{}'.format(pixel, channel),
+                        selection=lambda df: df['sample'] <= 10,
+                        chunksize=int(args['--chunksize']),
+                    )[['mean', 'std']]
                     mean['pixel'] = pixel
                     mean['channel'] = channel
 
@@ -11,25 +11,24 @@ from matplotlib.backends.backend_pdf import PdfPages
 import pandas as pd
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 
+from dragonboard.analysis.grouped_stats import grouped_stats
+
 import os
 
 
 def main(cstcfile, args):
-    st = pd.HDFStore(cstcfile)
-    keys = st.keys()[:-2]  # ignore channel 7
+    with pd.HDFStore(cstcfile, mode='r') as st:
+        keys = st.keys()[:-2]  # ignore channel 7
 
     name, ext = os.path.splitext(cstcfile)
 
     with PdfPages(name + '.pdf') as pdf:
         fig, axes = plt.subplots(1, 2, figsize=(12, 6))
         for i, n in enumerate(keys):
-            df = st[n]
-
-            m = df.groupby(['cell', 'sample']).mean()
-            s = df.groupby(['cell', 'sample']).std()
+            stats = grouped_stats(cstcfile, n)
 
-            m2d = m['adc_counts'].values.reshape(-1, 40)
-            s2d = s['adc_counts'].values.reshape(-1, 40)
+            m2d = stats['mean'].unstack('sample').values
+            s2d = stats['std'].unstack('sample').values
 
             plots = {
                 'mean': {
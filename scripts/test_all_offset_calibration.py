@@ -4,42 +4,28 @@ Usage:
 
 Options:
     -p, --plot              Show plots while fitting
-    -n <n>, --n-jobs=<n>    How many threads to use [default: 1]
+    --chunksize=<N>         Number of rows read at once [default: 1000000]
 '''
 import pandas as pd
-from scipy.optimize import curve_fit
-from joblib import Parallel, delayed
-import numpy as np
-import matplotlib.pyplot as plt
-import logging
 from docopt import docopt
 import os
 
-fig = None
-x = np.logspace(-4, 0, 250)
+from dragonboard.analysis.grouped_stats import grouped_stats
 
 
 def f(x, a, b, c):
     return a * x ** b + c
 
 
-def test(df, cell, fit_results):
-    df = df[df["sample"] < 38]
-
-    fr = fit_results.iloc[cell]
+def calibrated(df, fit_results):
+    fr = fit_results.iloc[df.cell.values]
     offset = f(
-        x=df.delta_t,
-        a=fr.a,
-        b=fr.b,
-        c=fr.c,
+        x=df.delta_t.values,
+        a=fr.a.values,
+        b=fr.b.values,
+        c=fr.c.values,
         )
-
-    calibrated = df.adc_counts - offset
-
-    m = calibrated.mean()
-    s = calibrated.std()
-    n = len(calibrated)
-    return m, s, n
+    return df.adc_counts.values - offset
 
 
 if __name__ == '__main__':
@@ -53,17 +39,17 @@ if __name__ == '__main__':
         for pixel in range(7):
             for gain in ["low", "high"]:
 
-                data = pd.read_hdf(args['<inputfile>'], 'pixel_{}_{}'.format(pixel, gain))
-
-                by_cell = data.groupby('cell')
-
                 fit_results = st['{}/{}'.format(pixel, gain)]
 
-                with Parallel(int(args['--n-jobs']), verbose=5) as pool:
-                    result = pd.DataFrame(
-                        pool(delayed(test)(df, name, fit_results) for name, df in by_cell),
-                        columns=['mean', 'std', 'N']
-                    )
+                stats = grouped_stats(
+                    args['<inputfile>'],
+                    'pixel_{}_{}'.format(pixel, gain),
+                    by=('cell', ),
+                    value=lambda df: calibrated(df, fit_results),
+                    selection=lambda df: df['sample'] < 38,
+                    chunksize=int(args['--chunksize']),
+                )
+                result = stats.rename(columns={'count': 'N'}).reset_index(drop=True)
 
                 result.to_hdf(
                     'test_results_in{}_calib{}.hdf5'.format(input_number, calib_number),
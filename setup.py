@@ -8,17 +8,19 @@ setup(
     author='Kai Brügge, Mario Hörbe, Dominik Neise, Maximilian Nöthe',
     author_email='maximilian.noethe@tu-dortmund.de, kai.bruegge@tu-dortmund.de, dominik.neise@tu-dortmund.de',
     license='MIT',
+    python_requires='>=3.8',
     install_requires=[
         'numpy',
         'matplotlib',
         'scipy',
         'pandas',
+        'tables',
         'tqdm',
-        'joblib',
+        'joblib>=1.3',
         'docopt',
         'psutil',
     ],
-    packages=['dragonboard', 'dragonboard.tools'],
+    packages=['dragonboard', 'dragonboard.tools', 'dragonboard.analysis'],
     entry_points={
         'gui_scripts': [
             'dragonviewer = dragonboard.__main__:main',
@@ -26,6 +28,10 @@ setup(
             'dragonboard_calc_calib_constants = dragonboard.tools.calc_calib_constants:main',
             'dragonboard_dataextraction = dragonboard.tools.dataextraction:main',
             'calc_timelapse_constants = dragonboard.tools.calc_timelapse_constants:main',
+            'dragonboard_check_integrity = dragonboard.tools.check_integrity:main',
+            'dragonboard_monitor = dragonboard.tools.monitor:main',
+            'dragonboard_convert_calibration = dragonboard.tools.convert_calibration:main',
+            'dragonboard_batch = dragonboard.tools.batch:main',
         ]
     }
 )